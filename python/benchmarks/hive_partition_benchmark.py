@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the memory use and speed of HivePartition and CompactHivePartition
+on hourly partitions, as returned by Hive.partitions.
+
+Usage (from the root of the repo):
+    PYTHONPATH=python python python/benchmarks/hive_partition_benchmark.py [<partitions>]
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from datetime import datetime, timedelta
+
+from refinery.hive import CompactHivePartition, Hive, HivePartition
+
+
+def hourly_partition_specs(count):
+    start = datetime(2015, 1, 1)
+    specs = []
+    for i in range(count):
+        dt = start + timedelta(hours=i)
+        desc = 'webrequest_source=text/year={0}/month={1}/day={2}/hour={3}'.format(
+            dt.year, dt.month, dt.day, dt.hour)
+        specs.append(Hive.partition_spec_from_partition_desc(desc))
+    return specs
+
+
+def timed(function, repeat=3):
+    """Returns the result of function(), and its best duration out of repeat runs."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return result, min(durations)
+
+
+def benchmark(partition_class, specs):
+    partitions, build_time = timed(lambda: [partition_class(spec) for spec in specs])
+    del partitions
+    gc.collect()
+    tracemalloc.start()
+    partitions = [partition_class(spec) for spec in specs]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # HivePartitions are not comparable, they are sorted by values like CompactHivePartitions.
+    sort_key = (lambda p: tuple(p.values())) if partition_class is HivePartition else None
+    results = {
+        'build (s)': build_time,
+        'memory (MB)': memory / 1024 / 1024,
+        'sort (s)': timed(lambda: sorted(partitions, key=sort_key))[1],
+        'spec() (s)': timed(lambda: [p.spec() for p in partitions])[1],
+        'lookups (s)': timed(lambda: [p['hour'] for p in partitions if 'hour' in p])[1],
+    }
+    if partition_class is CompactHivePartition:
+        results['set (s)'] = timed(lambda: set(partitions))[1]
+    return results
+
+
+def main(count):
+    specs = hourly_partition_specs(count)
+    print('{0} hourly partitions'.format(count))
+    results = [(cls.__name__, benchmark(cls, specs)) for cls in (HivePartition, CompactHivePartition)]
+    metrics = sorted(set(metric for _, r in results for metric in r))
+    print('{0:<14}'.format('') + ''.join('{0:>22}'.format(name) for name, _ in results))
+    for metric in metrics:
+        print('{0:<14}'.format(metric) + ''.join(
+            '{0:>22}'.format('{0:.3f}'.format(r[metric]) if metric in r else '-') for _, r in results))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
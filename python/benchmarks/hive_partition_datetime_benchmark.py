@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the speed of HivePartition.datetime with the dateutil parsing it
+used for every call, for each supported partition scheme. Each datetime is
+computed twice, as refinery-drop-older-than does.
+
+Usage (from the root of the repo):
+    PYTHONPATH=python python python/benchmarks/hive_partition_datetime_benchmark.py [<partitions>]
+"""
+
+import sys
+import time
+
+from datetime import datetime, timedelta
+
+from refinery.hive import (DATETIME_PARTITION_KEYS, HivePartition,
+                           _dateutil_partition_datetime, partition_datetime)
+
+
+SCHEMES = {
+    'year/month/day/hour': lambda dt: 'webrequest_source=text/year={0}/month={1}/day={2}/hour={3}'.format(
+        dt.year, dt.month, dt.day, dt.hour),
+    'date': lambda dt: 'date={0:%Y-%m-%d}/wiki=enwiki'.format(dt),
+    'snapshot (week)': lambda dt: 'snapshot={0:%Y-%m-%d}/wiki=enwiki'.format(dt),
+    'snapshot (month)': lambda dt: 'snapshot={0:%Y-%m}/wiki=enwiki'.format(dt),
+    'hour': lambda dt: 'hour={0:%Y-%m-%d-%H}'.format(dt),
+}
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def benchmark(partitions):
+    def dateutil():
+        for partition in partitions:
+            for _ in range(2):
+                _dateutil_partition_datetime(
+                    tuple((k, v) for k, v in partition.items() if k in DATETIME_PARTITION_KEYS))
+
+    def fast():
+        partition_datetime.cache_clear()
+        for partition in partitions:
+            for _ in range(2):
+                partition.datetime()
+
+    try:
+        dateutil_time = timed(dateutil)
+    except ValueError:
+        # The hour=YYYY-MM-DD-HH scheme could not be parsed with dateutil.
+        dateutil_time = None
+    return dateutil_time, timed(fast)
+
+
+def main(count):
+    start = datetime(2015, 1, 1)
+    print('{0} partitions per scheme, datetime computed twice'.format(count))
+    print('{0:<22}{1:>14}{2:>14}{3:>10}'.format('', 'dateutil (s)', 'fast (s)', 'speedup'))
+    for scheme, desc in SCHEMES.items():
+        partitions = [HivePartition(desc(start + timedelta(hours=i))) for i in range(count)]
+        dateutil_time, fast_time = benchmark(partitions)
+        if dateutil_time is None:
+            print('{0:<22}{1:>14}{2:>14.3f}{3:>10}'.format(scheme, 'failure', fast_time, '-'))
+        else:
+            print('{0:<22}{1:>14.3f}{2:>14.3f}{3:>9.1f}x'.format(
+                scheme, dateutil_time, fast_time, dateutil_time / fast_time))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
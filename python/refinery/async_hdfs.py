@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Wikimedia Analytics Refinery python asyncio Hdfs API.
+
+AsyncHdfs exposes coroutine counterparts of the Hdfs metadata operations, so
+that many independent operations can be awaited concurrently instead of
+paying each one's latency serially:
+
+    async def check(paths):
+        return await asyncio.gather(*[AsyncHdfs.exists(path) for path in paths])
+
+    exists = asyncio.run(check(paths))
+
+Operations run the blocking Hdfs methods (and thus its configured backend)
+in a shared thread pool, and at most AsyncHdfs.concurrency of them run at
+the same time whatever the number of awaited coroutines.
+
+See hdfs.py in the same folder
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+import weakref
+
+from concurrent.futures import ThreadPoolExecutor
+
+from refinery.hdfs import Hdfs
+
+
+logger = logging.getLogger('async-hdfs')
+
+
+class AsyncHdfs(object):
+    """
+    Coroutine counterparts of Hdfs methods, with a global concurrency limit.
+    """
+    concurrency = 16
+    _executor = None
+    _semaphores = weakref.WeakKeyDictionary()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def set_concurrency(concurrency):
+        """
+        Sets the maximum number of Hdfs operations running at the same time.
+        Should be called before any operation is awaited.
+        """
+        with AsyncHdfs._lock:
+            AsyncHdfs.concurrency = concurrency
+            executor, AsyncHdfs._executor = AsyncHdfs._executor, None
+            AsyncHdfs._semaphores = weakref.WeakKeyDictionary()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _limits(loop):
+        """
+        Returns the (executor, semaphore) limiting operations run from loop.
+        """
+        with AsyncHdfs._lock:
+            if AsyncHdfs._executor is None:
+                AsyncHdfs._executor = ThreadPoolExecutor(
+                    max_workers=AsyncHdfs.concurrency, thread_name_prefix='async-hdfs')
+            semaphore = AsyncHdfs._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = AsyncHdfs._semaphores[loop] = asyncio.Semaphore(AsyncHdfs.concurrency)
+            return AsyncHdfs._executor, semaphore
+
+    @staticmethod
+    async def _run(function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        executor, semaphore = AsyncHdfs._limits(loop)
+        async with semaphore:
+            return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+    @staticmethod
+    async def ls(paths, include_children=True, with_details=False):
+        """
+        See Hdfs.ls.
+        """
+        return await AsyncHdfs._run(Hdfs.ls, paths, include_children=include_children,
+                                    with_details=with_details)
+
+    @staticmethod
+    async def stat(paths):
+        """
+        See Hdfs.stat.
+        """
+        return await AsyncHdfs._run(Hdfs.stat, paths)
+
+    @staticmethod
+    async def exists(path):
+        """
+        Returns True if path (or, if a glob, any matching path) exists.
+        """
+        return bool(await AsyncHdfs._run(Hdfs.ls, path, include_children=False))
+
+    @staticmethod
+    async def mkdir(paths, create_parent=True):
+        """
+        See Hdfs.mkdir.
+        """
+        return await AsyncHdfs._run(Hdfs.mkdir, paths, create_parent=create_parent)
+
+    @staticmethod
+    async def rm(paths, recurse=True, skip_trash=True):
+        """
+        See Hdfs.rm.
+        """
+        return await AsyncHdfs._run(Hdfs.rm, paths, recurse=recurse, skip_trash=skip_trash)
+
+    @staticmethod
+    async def mv(from_paths, to_paths, inParent=True, bulk=False):
+        """
+        See Hdfs.mv.
+        """
+        return await AsyncHdfs._run(Hdfs.mv, from_paths, to_paths, inParent=inParent, bulk=bulk)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Wikimedia Analytics Refinery python local HDFS file checksums.
+
+When computed with dfs.checksum.combine.mode=COMPOSITE_CRC, the checksum of
+an HDFS file is the CRC of its whole content, whatever its block and chunk
+sizes (contrary to the default MD5-of-MD5-of-CRC checksums). It can thus be
+computed locally and compared to the one of an HDFS file, as returned by
+`hdfs dfs -checksum`, without transferring any data:
+
+    file_checksum('/srv/dumps/file.bz2')
+    -> {'algorithm': 'COMPOSITE-CRC32C', 'checksum': 'a4b10ad2'}
+
+CRC32C computation uses the crc32c package if installed, and a (slow)
+pure python implementation otherwise.
+
+See hdfs.py in the same folder
+"""
+
+import zlib
+
+try:
+    from crc32c import crc32c as _crc32c_native
+except ImportError:
+    _crc32c_native = None
+
+
+# Algorithm names of HDFS COMPOSITE_CRC checksums, depending on dfs.checksum.type
+COMPOSITE_CRC32C = 'COMPOSITE-CRC32C'
+COMPOSITE_CRC32 = 'COMPOSITE-CRC32'
+
+# Size of the chunks in which local files are read
+CHECKSUM_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def _crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _crc32c_table()
+
+
+def _crc32c_python(data, crc=0):
+    table = _CRC32C_TABLE
+    crc ^= 0xFFFFFFFF
+    for byte in data:
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def crc32c(data, crc=0):
+    """
+    Returns the CRC32C (Castagnoli) of data, continuing from crc
+    if given (same signature as zlib.crc32).
+    """
+    if _crc32c_native is not None:
+        return _crc32c_native(data, crc)
+    return _crc32c_python(data, crc)
+
+
+CRC_FUNCTIONS = {
+    COMPOSITE_CRC32C: crc32c,
+    COMPOSITE_CRC32: zlib.crc32,
+}
+
+
+def file_checksum(path, algorithm=COMPOSITE_CRC32C, buffer_size=CHECKSUM_BUFFER_SIZE):
+    """
+    Computes the HDFS COMPOSITE_CRC checksum of a local file, reading
+    it in chunks of buffer_size bytes.
+    Returns a {'algorithm', 'checksum'} dictionnary, checksum being formatted
+    as in `hdfs dfs -checksum` output.
+
+    Parameters:
+        path        : Path of the local file.
+        algorithm   : Either COMPOSITE-CRC32C (default) or COMPOSITE-CRC32,
+                      depending on the dfs.checksum.type of the cluster.
+        buffer_size : Number of bytes read at once.
+    """
+    if algorithm not in CRC_FUNCTIONS:
+        raise ValueError('Unsupported checksum algorithm {}, only {} can be computed locally '
+                         '(is dfs.checksum.combine.mode set to COMPOSITE_CRC?)'.format(
+                             algorithm, ' and '.join(sorted(CRC_FUNCTIONS))))
+    crc_function = CRC_FUNCTIONS[algorithm]
+    crc = 0
+    with open(path, 'rb') as f:
+        chunk = f.read(buffer_size)
+        while chunk:
+            crc = crc_function(chunk, crc)
+            chunk = f.read(buffer_size)
+    return {'algorithm': algorithm, 'checksum': '{:08x}'.format(crc & 0xFFFFFFFF)}
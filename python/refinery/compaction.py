@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Wikimedia Analytics Refinery python small files compaction.
+
+Jobs writing one file per mapper (sqoop for instance) leave many small files
+in their output partitions, weighing on NameNode memory and slowing down
+every scan of the data. Compaction merges the data files of such partitions
+into files of about a target size:
+
+    partitions = find_partitions_to_compact(
+        '/wmf/data/raw/mediawiki/tables/*/snapshot=2023-04/wiki_db=*',
+        min_average_size=64 * 1024 * 1024)
+    compact_partitions(partitions, merge_tool_command('avrodata', '/srv/avro-tools.jar'),
+                       target_size=256 * 1024 * 1024, tmp_base_path='/wmf/tmp/compaction')
+
+Merges are run by a pool of workers, each of them running a command merging
+input files into an output file, e.g. `hadoop jar avro-tools.jar concat`.
+Merged files are written to a temporary folder, then swapped in place of
+the partition with moves once all of its merges succeeded, provided that
+the partition data files are unchanged and that each merged file is there
+with about the size of its inputs. The original partition is sent to the
+trash.
+
+See hdfs.py in the same folder
+"""
+
+import logging
+import os
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from subprocess import check_call, DEVNULL
+from urllib.parse import urlparse
+
+from refinery.hdfs import Hdfs
+
+
+logger = logging.getLogger('compaction')
+
+
+# Merge tool command of each sqoop output format, run as
+# `hadoop jar <tool jar> <command> <input paths> <output path>`
+MERGE_TOOL_COMMANDS = {
+    'avrodata': 'concat',  # avro-tools
+    'parquet': 'merge',    # parquet-tools
+}
+
+# Sub-folders of the temporary folder where partitions are merged, and
+# where they are moved while swapped
+MERGED_FOLDER = 'merged'
+BACKUP_FOLDER = 'backup'
+
+
+def merge_tool_command(output_format, tools_jar):
+    """
+    Returns the command merging files of output_format (avrodata or parquet)
+    with the avro-tools or parquet-tools jar tools_jar.
+    """
+    if output_format not in MERGE_TOOL_COMMANDS:
+        raise ValueError('Invalid output format {}'.format(output_format))
+    return ['hadoop', 'jar', tools_jar, MERGE_TOOL_COMMANDS[output_format]]
+
+
+def _rm_if_exists(path, skip_trash=True):
+    if Hdfs.ls(path, include_children=False):
+        Hdfs.rm(path, skip_trash=skip_trash)
+
+
+def partition_tmp_paths(partition, tmp_base_path):
+    """
+    Returns the (merged path, backup path) temporary folders of partition,
+    mirroring its full path (and authority if any) under tmp_base_path
+    so that distinct partitions never share them.
+    """
+    parsed = urlparse(partition)
+    relative_path = os.path.join(parsed.netloc, parsed.path.strip('/'))
+    return (os.path.join(tmp_base_path, MERGED_FOLDER, relative_path),
+            os.path.join(tmp_base_path, BACKUP_FOLDER, relative_path))
+
+
+def is_data_file(status):
+    """
+    Returns True if status is the one of a data file, as opposed to folders
+    and hidden or marker files (e.g. _SUCCESS) ignored by readers.
+    """
+    name = os.path.basename(status.path)
+    return not status.is_directory() and not name.startswith(('_', '.'))
+
+
+def find_partitions_to_compact(partition_glob, min_average_size, min_files=2):
+    """
+    Lists at once the content of the partition folders matching partition_glob,
+    and returns the ones whose data files average size is below min_average_size,
+    as a dictionnary keyed by partition path having for value the list of
+    HdfsFileStatus of its data files. Partitions containing folders are
+    skipped: only their files would be carried over by the compaction.
+
+    Parameters:
+        partition_glob   : Path or glob of partition folders.
+        min_average_size : Partitions whose data files are smaller in average
+                           than this size in bytes are compacted.
+        min_files        : Partitions with less data files are never compacted.
+    """
+    files, with_folders = {}, set()
+    for status in Hdfs.iter_ls(partition_glob):
+        if is_data_file(status):
+            files.setdefault(os.path.dirname(status.path), []).append(status)
+        elif status.is_directory():
+            with_folders.add(os.path.dirname(status.path))
+
+    partitions = {}
+    for partition, statuses in files.items():
+        if partition in with_folders:
+            logger.warning('Not compacting {}, it contains folders'.format(partition))
+            continue
+        total_size = sum(status.size for status in statuses)
+        if len(statuses) >= min_files and total_size < min_average_size * len(statuses):
+            partitions[partition] = statuses
+    logger.info('Found {} partitions to compact out of {} in {}'.format(
+        len(partitions), len(files), partition_glob))
+    return partitions
+
+
+def plan_merges(files, target_size):
+    """
+    Groups files (HdfsFileStatus) into lists of files to merge together,
+    each group being of at most target_size bytes unless made of a single
+    bigger file. Files are kept in path order.
+    """
+    groups, group, group_size = [], [], 0
+    for status in sorted(files, key=lambda status: status.path):
+        if group and group_size + status.size > target_size:
+            groups.append(group)
+            group, group_size = [], 0
+        group.append(status)
+        group_size += status.size
+    if group:
+        groups.append(group)
+    return groups
+
+
+def _merge(merge_command, files, output_path, dry_run):
+    """
+    Merges files into output_path, copying the file if there is only one.
+    """
+    paths = [status.path for status in files]
+    if len(paths) == 1:
+        logger.debug('Copying {} to {}'.format(paths[0], output_path))
+        if not dry_run:
+            Hdfs.cp(paths[0], output_path)
+        return
+    command = merge_command + paths + [output_path]
+    logger.debug('Merging {} files to {} with: {}'.format(len(paths), output_path, command))
+    if not dry_run:
+        check_call(command, stdout=DEVNULL, stderr=DEVNULL)
+
+
+def _prepare_partition(partition, files, merge_command, target_size, tmp_base_path, dry_run):
+    """
+    Creates the empty temporary folder of partition, copying its marker files
+    into it, and returns the list of (merge_command, files, output_path, dry_run)
+    merges to run to fill it.
+    """
+    tmp_path = partition_tmp_paths(partition, tmp_base_path)[0]
+    data_paths = set(status.path for status in files)
+    markers = [status.path for status in Hdfs.iter_ls(partition)
+               if status.path not in data_paths and not status.is_directory()]
+    if not dry_run:
+        _rm_if_exists(tmp_path)
+        Hdfs.mkdir(tmp_path)
+        for marker in markers:
+            Hdfs.cp(marker, os.path.join(tmp_path, os.path.basename(marker)))
+
+    merges = []
+    for i, group in enumerate(plan_merges(files, target_size)):
+        extension = os.path.splitext(group[0].path)[1]
+        output_path = os.path.join(tmp_path, 'part-c-{:05d}{}'.format(i, extension))
+        merges.append((merge_command, group, output_path, dry_run))
+    return merges
+
+
+def check_merges(partition, files, merges, size_tolerance):
+    """
+    Raises a RuntimeError if the data files of partition changed since files
+    were listed, if it now contains folders, or if the output of one of merges (as returned by
+    _prepare_partition) is missing or has a size differing from the one of
+    its inputs by more than size_tolerance (as a fraction of it).
+    Row counts are not checked, that would need reading the data.
+    """
+    def signature(statuses):
+        return set((status.path, status.size, status.mtime) for status in statuses)
+
+    statuses = list(Hdfs.iter_ls(partition))
+    if any(status.is_directory() for status in statuses):
+        raise RuntimeError('{} contains folders, that its compaction would drop'.format(partition))
+    if signature(s for s in statuses if is_data_file(s)) != signature(files):
+        raise RuntimeError('Data files of {} changed since its compaction was planned'.format(partition))
+
+    output_sizes = {}
+    for output_folder in set(os.path.dirname(output_path) for _, _, output_path, _ in merges):
+        output_sizes.update((status.path, status.size) for status in Hdfs.iter_ls(output_folder))
+    for _, group, output_path, _ in merges:
+        if output_path not in output_sizes:
+            raise RuntimeError('Merged file {} of {} is missing'.format(output_path, partition))
+        input_size = sum(status.size for status in group)
+        if abs(output_sizes[output_path] - input_size) > size_tolerance * input_size:
+            raise RuntimeError('Merged file {} of {} has {} bytes for {} bytes of input files'.format(
+                output_path, partition, output_sizes[output_path], input_size))
+
+
+def swap_partition(partition, tmp_path, backup_path, dry_run=False):
+    """
+    Replaces partition by tmp_path using moves: partition is moved aside
+    to backup_path first, and moved back if tmp_path can't be moved in its
+    place. The backup is then sent to the trash.
+    """
+    logger.info('Swapping {} with {}'.format(partition, tmp_path))
+    if dry_run:
+        return
+    _rm_if_exists(backup_path)
+    Hdfs.mkdir(os.path.dirname(backup_path))
+    Hdfs.mv(partition, backup_path, inParent=False)
+    try:
+        Hdfs.mv(tmp_path, partition, inParent=False)
+    except Exception:
+        Hdfs.mv(backup_path, partition, inParent=False)
+        raise
+    Hdfs.rm(backup_path, skip_trash=False)
+
+
+def compact_partitions(partitions, merge_command, target_size, tmp_base_path,
+                       workers=1, size_tolerance=0.5, dry_run=False):
+    """
+    Compacts partitions, as returned by find_partitions_to_compact.
+    Merges of all partitions are run by a pool of workers, and each partition
+    is swapped with its merged files once all of its merges succeeded and
+    were checked (see check_merges).
+    Returns the list of partitions whose compaction failed (and are left untouched).
+
+    Parameters:
+        partitions     : Dictionnary of partition path to data files statuses.
+        merge_command  : Command merging files into one, input paths and output
+                         path being appended, see merge_tool_command.
+        target_size    : Maximum size in bytes of the merged input files.
+        tmp_base_path  : HDFS folder where merged files are written first.
+        workers        : Number of merges run in parallel.
+        size_tolerance : Maximum difference between the size of a merged file
+                         and the one of its inputs, as a fraction of the latter
+                         (merged files lose the headers of their inputs).
+        dry_run        : If True, only log what would be done.
+    """
+    failed = set()
+    planned_merges = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for partition, files in sorted(partitions.items()):
+            try:
+                merges = _prepare_partition(
+                    partition, files, merge_command, target_size, tmp_base_path, dry_run)
+            except Exception:
+                logger.exception('ERROR preparing the compaction of {}'.format(partition))
+                failed.add(partition)
+                continue
+            logger.info('Compacting {} files of {} into {}'.format(len(files), partition, len(merges)))
+            planned_merges[partition] = merges
+            for merge in merges:
+                futures[executor.submit(_merge, *merge)] = partition
+
+        remaining = Counter(futures.values())
+        for future in as_completed(futures):
+            partition = futures[future]
+            try:
+                future.result()
+            except Exception:
+                logger.exception('ERROR merging files of {}'.format(partition))
+                failed.add(partition)
+            remaining[partition] -= 1
+            if remaining[partition] == 0 and partition not in failed:
+                try:
+                    if not dry_run:
+                        check_merges(partition, partitions[partition], planned_merges[partition],
+                                     size_tolerance)
+                    swap_partition(partition, *partition_tmp_paths(partition, tmp_base_path),
+                                   dry_run=dry_run)
+                except Exception:
+                    logger.exception('ERROR swapping {}'.format(partition))
+                    failed.add(partition)
+
+    for partition in failed:
+        if not dry_run:
+            _rm_if_exists(partition_tmp_paths(partition, tmp_base_path)[0])
+    return sorted(failed)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Wikimedia Analytics Refinery python success-flag waiter.
+
+Waits for many flag files (e.g. _SUCCESS) written by other jobs, returning
+each of them as soon as it appears so that dependent work can start early:
+
+    for flag in iter_appearing_flags(flag_paths, timeout=3600):
+        start_job_depending_on(flag)
+
+Flags are polled together: each poll is a single listing of all the folders
+expected to contain several still missing flags, and a single stat of the
+other missing flags. The interval between polls grows exponentially while
+no new flag appears.
+
+See hdfs.py in the same folder
+"""
+
+import logging
+import os
+import time
+
+from refinery.hdfs import Hdfs
+
+
+logger = logging.getLogger('flag-waiter')
+
+
+class FlagsTimeoutError(RuntimeError):
+    """
+    Raised when flags are still missing after the waiting timeout,
+    missing being the set of their paths.
+    """
+
+    def __init__(self, missing):
+        super(FlagsTimeoutError, self).__init__('Timed out waiting for {} flags: {}'.format(
+            len(missing), ', '.join(sorted(missing))))
+        self.missing = missing
+
+
+def existing_flags(paths):
+    """
+    Returns the set of paths existing in HDFS (globs are not supported),
+    grouping them by parent folder: folders expected to contain several
+    flags are listed at once, and the other flags are stat-ed at once,
+    avoiding to list whole data folders for a single flag.
+    """
+    expected = {}
+    for path in paths:
+        parent, name = os.path.split(path.rstrip('/'))
+        expected.setdefault(parent, {})[name] = path
+    listed = sorted(parent for parent, names in expected.items() if len(names) > 1)
+    stated = sorted(path for names in expected.values() if len(names) == 1 for path in names.values())
+
+    # The backend is used directly: the listing cache would hide new flags.
+    existing = set()
+    if listed:
+        for status in Hdfs.backend().iter_ls(listed):
+            parent, name = os.path.split(status.path)
+            path = expected.get(parent, {}).get(name)
+            if path is not None:
+                existing.add(path)
+    if stated:
+        existing.update(path for path, stat in Hdfs.stat(stated).items() if stat is not None)
+    return existing
+
+
+def iter_appearing_flags(paths, timeout=None, initial_interval=10, max_interval=600, backoff=2):
+    """
+    Polls paths until they all exist, yielding each of them as soon as it
+    is found. Raises a FlagsTimeoutError if some are missing after timeout.
+
+    Parameters:
+        paths            : Paths of the expected flag files.
+        timeout          : Maximum number of seconds to wait, no limit if None.
+        initial_interval : Seconds to wait after the first poll, and after
+                           any poll finding new flags.
+        max_interval     : Maximum number of seconds between two polls.
+        backoff          : Factor by which the interval grows after a poll
+                           finding no new flag.
+    """
+    missing = set(paths)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    interval = None
+    while missing:
+        found = existing_flags(missing)
+        for path in sorted(found):
+            missing.discard(path)
+            yield path
+        if not missing:
+            return
+        if found or interval is None:
+            interval = initial_interval
+        else:
+            interval = min(interval * backoff, max_interval)
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise FlagsTimeoutError(missing)
+        logger.debug('Waiting {} seconds for {} flags'.format(interval, len(missing)))
+        time.sleep(interval if remaining is None else min(interval, remaining))
+
+
+def wait_for_flags(paths, callback=None, timeout=None, initial_interval=10,
+                   max_interval=600, backoff=2):
+    """
+    Polls paths like iter_appearing_flags, calling callback (if any) with
+    each path as soon as it is found.
+    Returns True if all paths were found, False if timeout was reached.
+    """
+    try:
+        for path in iter_appearing_flags(paths, timeout=timeout, initial_interval=initial_interval,
+                                         max_interval=max_interval, backoff=backoff):
+            logger.info('Found flag {}'.format(path))
+            if callback is not None:
+                callback(path)
+        return True
+    except FlagsTimeoutError as e:
+        logger.error(e)
+        return False
@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Wikimedia Analytics Refinery python offline HDFS namespace index.
+
+Builds a compact, memory-mappable index of the namespace described by an
+XML fsimage (as produced by `hdfs oiv -p XML`, see
+bin/convert_fsimage_to_xml_on_hdfs.sh), and answers ls, du, count, find and
+per-owner usage queries from it without touching the NameNode.
+Also converts fsimages to chunked compressed TSV files, see convert_to_tsv.
+
+Usage:
+    with Hdfs.open('/wmf/data/raw/hdfs/xml_fsimage/fsimage_2022-12-01.xml') as xml_file:
+        build_index(xml_file, '/srv/fsimage_2022-12-01.idx')
+
+    with FsImageIndex('/srv/fsimage_2022-12-01.idx') as index:
+        index.ls('/wmf/data/raw')
+        index.du('/wmf/data/raw')
+        index.find('/wmf/data/raw', older_than=datetime(2022, 9, 1))
+
+Index layout: a header, then one fixed-size record per inode in depth-first
+order (children sorted by name), then the UTF-8 paths, then the JSON list
+of owner and group names. As each directory subtree is a contiguous range
+of records, records store the end of their subtree and its aggregated
+size, making du and count constant-time and ls a walk over children only.
+Paths are in lexicographic order of their components, so a path is found
+by binary search.
+
+Symlinks and inodes only referenced from snapshots are not indexed.
+"""
+
+import gzip
+import json
+import logging
+import mmap
+import os
+import stat
+import struct
+import tempfile
+import xml.etree.ElementTree as ET
+
+from datetime import datetime
+
+from refinery.hdfs import FileType, Hdfs, HdfsFileStatus, epoch_seconds
+
+
+logger = logging.getLogger('fsimage')
+
+MAGIC = b'RFSIMG1\n'
+# record count, paths offset, names offset
+HEADER = struct.Struct('<QQQ')
+# path offset, path length, subtree end, size, subtree bytes, subtree files,
+# mtime, owner, group, mode, replication, type
+RECORD = struct.Struct('<QIIQQQqIIHHB3x')
+RECORDS_OFFSET = len(MAGIC) + HEADER.size
+
+ROOT_INODE_ID = 16385
+
+
+def _path_key(path):
+    """
+    Returns the components of path, ordering paths as the index does.
+    """
+    path = path.strip('/')
+    return tuple(path.split('/')) if path else ()
+
+
+def _parse_permission(permission, names):
+    """
+    Parses an fsimage 'owner:group:mode' permission string,
+    returning (owner id, group id, mode).
+    """
+    owner, group, mode = permission.rsplit(':', 2)
+    return (names.setdefault(owner, len(names)),
+            names.setdefault(group, len(names)),
+            int(mode, 8))
+
+
+def iter_fsimage(xml_file):
+    """
+    Stream-parses the fsimage XML read from xml_file (a local path or a binary
+    file object), yielding ('inode', element) for each inode of the INodeSection
+    and ('directory', element) for each directory of the INodeDirectorySection,
+    in constant memory: elements are cleared once the consumer moved on.
+    """
+    section, depth = None, 0
+    for event, element in ET.iterparse(xml_file, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 2:
+                section = element
+            continue
+        depth -= 1
+        if depth != 2:
+            continue
+        if section.tag == 'INodeSection' and element.tag == 'inode':
+            yield 'inode', element
+        elif section.tag == 'INodeDirectorySection' and element.tag == 'directory':
+            yield 'directory', element
+        # Processed elements are not needed anymore.
+        section.clear()
+
+
+def _inode_size(element):
+    """
+    Returns the size in bytes of an inode element, summing its blocks.
+    """
+    return sum(int(b.findtext('numBytes')) for b in element.iterfind('blocks/block'))
+
+
+def _read_inodes(xml_file):
+    """
+    Streams the fsimage XML, returning (inodes, children, names) where inodes
+    maps inode ids to (name, type, size, mtime, owner, group, mode, replication)
+    tuples, children maps directory ids to their children ids, and names
+    maps owner and group names to their ids.
+    """
+    inodes, children, names = {}, {}, {}
+    for kind, element in iter_fsimage(xml_file):
+        if kind == 'inode':
+            inode_type = element.findtext('type')
+            if inode_type in ('FILE', 'DIRECTORY'):
+                is_file = inode_type == 'FILE'
+                owner, group, mode = _parse_permission(element.findtext('permission'), names)
+                inodes[int(element.findtext('id'))] = (
+                    element.findtext('name') or '',
+                    FileType.FILE if is_file else FileType.DIRECTORY,
+                    _inode_size(element) if is_file else 0,
+                    int(element.findtext('mtime')) // 1000,
+                    owner,
+                    group,
+                    mode | (stat.S_IFREG if is_file else stat.S_IFDIR),
+                    int(element.findtext('replication') or 0) if is_file else 0,
+                )
+        else:
+            children[int(element.findtext('parent'))] = [int(c.text) for c in element.iterfind('child')]
+    return inodes, children, names
+
+
+def build_index(xml_file, index_path):
+    """
+    Builds the index of the fsimage XML read from xml_file (a local path or a
+    binary file object, for instance opened with Hdfs.open) into index_path.
+    The XML is streamed, but the inodes are kept in memory while building.
+    Returns the number of indexed paths.
+    """
+    logger.info('Reading fsimage inodes')
+    inodes, children, names = _read_inodes(xml_file)
+    if ROOT_INODE_ID not in inodes:
+        raise ValueError('No root directory in fsimage')
+    logger.info('Indexing {} inodes'.format(len(inodes)))
+
+    records = bytearray(len(inodes) * RECORD.size)
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    with tempfile.TemporaryFile(dir=index_dir) as paths_file:
+        count, paths_length = 0, 0
+        # Depth-first walk, the stack holding the (inode id, path) left to visit,
+        # or (None, record index) of a directory whose subtree is done.
+        stack = [(ROOT_INODE_ID, '/')]
+        while stack:
+            inode_id, path = stack.pop()
+            if inode_id is None:
+                # path is the record index of a finished directory
+                _finish_directory(records, path, count)
+                continue
+            (name, file_type, size, mtime, owner, group, mode, replication) = inodes[inode_id]
+            encoded_path = path.encode('utf-8')
+            paths_file.write(encoded_path)
+            RECORD.pack_into(
+                records, count * RECORD.size,
+                paths_length, len(encoded_path), count + 1, size, size,
+                1 if file_type is FileType.FILE else 0, mtime, owner, group,
+                mode, replication, ord(file_type.value))
+            paths_length += len(encoded_path)
+            if file_type is FileType.DIRECTORY:
+                stack.append((None, count))
+                child_inodes = [(inodes[c][0], c) for c in children.get(inode_id, []) if c in inodes]
+                prefix = path.rstrip('/') + '/'
+                for child_name, child_id in sorted(child_inodes, reverse=True):
+                    stack.append((child_id, prefix + child_name))
+            count += 1
+
+        paths_offset = RECORDS_OFFSET + count * RECORD.size
+        encoded_names = json.dumps(sorted(names, key=names.get)).encode('utf-8')
+        tmp_index_path = index_path + '.tmp'
+        with open(tmp_index_path, 'wb') as index_file:
+            index_file.write(MAGIC)
+            index_file.write(HEADER.pack(count, paths_offset, paths_offset + paths_length))
+            index_file.write(memoryview(records)[:count * RECORD.size])
+            paths_file.seek(0)
+            while True:
+                chunk = paths_file.read(1024 * 1024)
+                if not chunk:
+                    break
+                index_file.write(chunk)
+            index_file.write(encoded_names)
+        os.replace(tmp_index_path, index_path)
+    logger.info('Indexed {} paths in {}'.format(count, index_path))
+    return count
+
+
+def _finish_directory(records, index, end):
+    """
+    Sets the subtree end and aggregates of the directory record at index,
+    whose subtree records are all written.
+    """
+    offset = index * RECORD.size
+    fields = list(RECORD.unpack_from(records, offset))
+    subtree_bytes, subtree_files = 0, 0
+    child = index + 1
+    while child < end:
+        child_fields = RECORD.unpack_from(records, child * RECORD.size)
+        subtree_bytes += child_fields[4]
+        subtree_files += child_fields[5]
+        child = child_fields[2]
+    fields[2], fields[4], fields[5] = end, subtree_bytes, subtree_files
+    RECORD.pack_into(records, offset, *fields)
+
+
+class FsImageIndex(object):
+    """
+    Read-only access to an index built by build_index. Records are returned
+    as HdfsFileStatus, as yielded by Hdfs.iter_ls. Paths should be absolute
+    and globs are not supported.
+
+    Parameters:
+        index_path : Local path of the index file.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(index_path, 'rb') as index_file:
+            self._mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError('{} is not an fsimage index'.format(index_path))
+        self._record_count, self._paths_offset, names_offset = HEADER.unpack_from(self._mmap, len(MAGIC))
+        self._names = json.loads(self._mmap[names_offset:].decode('utf-8'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._record_count
+
+    def close(self):
+        self._mmap.close()
+
+    def _fields(self, index):
+        return RECORD.unpack_from(self._mmap, RECORDS_OFFSET + index * RECORD.size)
+
+    def _path(self, fields):
+        offset = self._paths_offset + fields[0]
+        return self._mmap[offset:offset + fields[1]].decode('utf-8')
+
+    def _status(self, fields):
+        (_, _, _, size, _, _, mtime, owner, group, mode, replication, file_type) = fields
+        return HdfsFileStatus(
+            self._path(fields),
+            FileType(chr(file_type)),
+            size,
+            mtime,
+            stat.filemode(mode)[1:],
+            replication,
+            self._names[owner],
+            self._names[group],
+        )
+
+    def _find(self, path):
+        """
+        Returns the record index of path, or None if it is not indexed.
+        """
+        key = _path_key(path)
+        low, high = 0, self._record_count
+        while low < high:
+            middle = (low + high) // 2
+            middle_key = _path_key(self._path(self._fields(middle)))
+            if middle_key == key:
+                return middle
+            if middle_key < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def stat(self, path):
+        """
+        Returns the HdfsFileStatus of path, or None if it doesn't exist.
+        """
+        index = self._find(path)
+        return None if index is None else self._status(self._fields(index))
+
+    def ls(self, path, include_children=True):
+        """
+        Returns the HdfsFileStatus list of path's children if it is a directory
+        and include_children is True, of path itself otherwise, like Hdfs.iter_ls.
+        An empty list is returned if path doesn't exist.
+        """
+        index = self._find(path)
+        if index is None:
+            return []
+        fields = self._fields(index)
+        if not include_children or chr(fields[-1]) != FileType.DIRECTORY:
+            return [self._status(fields)]
+        statuses = []
+        child = index + 1
+        while child < fields[2]:
+            child_fields = self._fields(child)
+            statuses.append(self._status(child_fields))
+            child = child_fields[2]
+        return statuses
+
+    def du(self, path):
+        """
+        Returns the size in bytes of path, or None if it doesn't exist.
+        """
+        index = self._find(path)
+        return None if index is None else self._fields(index)[4]
+
+    def count(self, path):
+        """
+        Returns {'directory_count', 'file_count', 'content_size'} for path,
+        as Hdfs.count does, or None if it doesn't exist.
+        """
+        index = self._find(path)
+        if index is None:
+            return None
+        fields = self._fields(index)
+        return {
+            'directory_count': fields[2] - index - fields[5],
+            'file_count': fields[5],
+            'content_size': fields[4],
+        }
+
+    def _iter_subtree(self, path):
+        """
+        Yields the record fields of path and of everything below it.
+        """
+        index = self._find(path)
+        if index is None:
+            return
+        end = self._fields(index)[2]
+        start = RECORDS_OFFSET + index * RECORD.size
+        for fields in RECORD.iter_unpack(self._mmap[start:RECORDS_OFFSET + end * RECORD.size]):
+            yield fields
+
+    def find(self, path='/', older_than=None, file_type=None):
+        """
+        Yields the HdfsFileStatus of path and everything below it, in depth-first
+        order, optionally filtered.
+
+        Parameters:
+            path        : Root of the search.
+            older_than  : If set, only yields entries modified before this datetime
+                          (naive datetimes are considered UTC) or epoch seconds.
+            file_type   : If set, only yields entries of this FileType ('f' or 'd').
+        """
+        if isinstance(older_than, datetime):
+            older_than = epoch_seconds(older_than)
+        for fields in self._iter_subtree(path):
+            if older_than is not None and fields[6] >= older_than:
+                continue
+            if file_type is not None and chr(fields[-1]) != file_type:
+                continue
+            yield self._status(fields)
+
+    def usage_by_owner(self, path='/'):
+        """
+        Returns a dictionnary keyed by owner name of the usage below path, as
+        {'file_count', 'content_size', 'space_consumed'} dictionnaries,
+        space_consumed accounting for replication.
+        """
+        usage = {}
+        for fields in self._iter_subtree(path):
+            if chr(fields[-1]) != FileType.FILE:
+                continue
+            owner_usage = usage.get(fields[7])
+            if owner_usage is None:
+                owner_usage = usage[fields[7]] = {'file_count': 0, 'content_size': 0, 'space_consumed': 0}
+            owner_usage['file_count'] += 1
+            owner_usage['content_size'] += fields[3]
+            owner_usage['space_consumed'] += fields[3] * fields[10]
+        return {self._names[owner]: owner_usage for owner, owner_usage in usage.items()}
+
+
+# Columns of the TSV files written by convert_to_tsv
+INODE_COLUMNS = (
+    'id', 'type', 'name', 'replication', 'mtime', 'atime', 'preferred_block_size',
+    'owner', 'group', 'mode', 'size', 'block_count', 'ns_quota', 'ds_quota', 'storage_policy_id',
+)
+DIRECTORY_COLUMNS = ('parent', 'child')
+
+# Backslash-escaping of TSV values, to be read with ESCAPED BY '\\' in Hive.
+TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _inode_row(element):
+    """
+    Returns the INODE_COLUMNS values of an inode element, as strings.
+    """
+    owner, group, mode = (element.findtext('permission') or '::').rsplit(':', 2)
+    is_file = element.findtext('type') == 'FILE'
+    return [
+        element.findtext('id'),
+        element.findtext('type'),
+        element.findtext('name') or '',
+        element.findtext('replication') or '',
+        element.findtext('mtime') or '',
+        element.findtext('atime') or '',
+        element.findtext('preferredBlockSize') or '',
+        owner,
+        group,
+        mode,
+        str(_inode_size(element)) if is_file else '',
+        str(len(element.findall('blocks/block'))) if is_file else '',
+        element.findtext('nsquota') or '',
+        element.findtext('dsquota') or '',
+        element.findtext('storagePolicyId') or '',
+    ]
+
+
+class ChunkedTsvWriter(object):
+    """
+    Writes rows as gzip-compressed TSV files of at most rows_per_chunk rows,
+    named part-00000.tsv.gz, part-00001.tsv.gz... in the output_path folder.
+    When writing to HDFS, each chunk is compressed to a local temporary file,
+    uploaded and removed, so that local disk usage is bounded by one chunk.
+
+    Parameters:
+        output_path    : Output folder, created if needed.
+        rows_per_chunk : Maximum number of rows per file.
+        to_hdfs        : Whether output_path is on HDFS or local.
+    """
+
+    def __init__(self, output_path, rows_per_chunk=1000000, to_hdfs=True):
+        self.output_path = output_path
+        self.rows_per_chunk = rows_per_chunk
+        self.to_hdfs = to_hdfs
+        self.row_count = 0
+        self.chunk_count = 0
+        self._chunk = None
+        self._chunk_path = None
+        if to_hdfs:
+            Hdfs.mkdir(output_path, create_parent=True)
+        else:
+            os.makedirs(output_path, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, row):
+        """
+        Writes row, a list of strings.
+        """
+        if self._chunk is None:
+            self._open_chunk()
+        self._chunk.write('\t'.join(value.translate(TSV_ESCAPES) for value in row) + '\n')
+        self.row_count += 1
+        if self.row_count % self.rows_per_chunk == 0:
+            self._close_chunk()
+
+    def _open_chunk(self):
+        name = 'part-{:05d}.tsv.gz'.format(self.chunk_count)
+        if self.to_hdfs:
+            (fd, local_path) = tempfile.mkstemp(suffix='-' + name)
+            os.close(fd)
+        else:
+            local_path = os.path.join(self.output_path, name)
+        self._chunk = gzip.open(local_path, 'wt', encoding='utf-8')
+        self._chunk_path = local_path
+        self.chunk_count += 1
+
+    def _close_chunk(self):
+        self._chunk.close()
+        self._chunk = None
+        if self.to_hdfs:
+            try:
+                name = 'part-{:05d}.tsv.gz'.format(self.chunk_count - 1)
+                Hdfs.put(self._chunk_path, os.path.join(self.output_path, name), force=True)
+            finally:
+                os.remove(self._chunk_path)
+        logger.debug('Wrote chunk {} of {}'.format(self.chunk_count - 1, self.output_path))
+
+    def close(self):
+        """
+        Writes the last chunk, if any. Returns the number of rows written.
+        """
+        if self._chunk is not None:
+            self._close_chunk()
+        return self.row_count
+
+
+def convert_to_tsv(xml_file, output_path, rows_per_chunk=1000000, to_hdfs=True):
+    """
+    Converts the fsimage XML read from xml_file (a local path or a binary file
+    object, for instance the stdout of `hdfs oiv -p XML -o -`) to chunked
+    compressed TSV files (see ChunkedTsvWriter), in constant memory:
+     - output_path/inodes, with one INODE_COLUMNS row per inode,
+     - output_path/directories, with one DIRECTORY_COLUMNS row per directory child.
+    Paths are not resolved, as this would need every inode in memory:
+    they are to be rebuilt by joining both tables.
+    Returns a dictionnary of the number of rows written per table.
+    """
+    with ChunkedTsvWriter(os.path.join(output_path, 'inodes'), rows_per_chunk, to_hdfs) as inodes, \
+            ChunkedTsvWriter(os.path.join(output_path, 'directories'), rows_per_chunk, to_hdfs) as directories:
+        for kind, element in iter_fsimage(xml_file):
+            if kind == 'inode':
+                inodes.write(_inode_row(element))
+            else:
+                parent = element.findtext('parent')
+                for child in element.iterfind('child'):
+                    directories.write([parent, child.text])
+    logger.info('Converted {} inodes and {} directory children to {}'.format(
+        inodes.row_count, directories.row_count, output_path))
+    return {'inodes': inodes.row_count, 'directories': directories.row_count}
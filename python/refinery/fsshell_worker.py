@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Wikimedia Analytics Refinery python warm FsShell Hdfs backend.
+
+Instead of starting a new `hdfs dfs` JVM for every operation, a single
+long-lived JVM running Hadoop's FsShell is started once per Python process
+and fed `hdfs dfs` arguments over a pipe. The JVM startup and Kerberos login
+are thus paid only once, while commands keep the exact semantics and
+output format of `hdfs dfs`.
+
+The worker is a small Nashorn script run with jrunscript (Java 8) on the
+Hadoop classpath. Each request is a JSON array of arguments written on a
+single line, run by an admin tool instead of FsShell if its first element
+is the tool name prefixed with @ (e.g. ["@storagepolicies", "-getStoragePolicy",
+...]). Each response is a header line "<exit code> <stdout length>
+<stderr length>" followed by the raw stdout and stderr bytes of the command.
+
+See hdfs.py in the same folder
+"""
+
+import atexit
+import json
+import logging
+import subprocess
+import threading
+
+from refinery.hdfs import HdfsCliBackend
+from refinery.util import sh
+
+
+logger = logging.getLogger('fsshell-worker')
+
+WORKER_SCRIPT = '''
+var Configuration = Java.type('org.apache.hadoop.conf.Configuration');
+var FsShell = Java.type('org.apache.hadoop.fs.FsShell');
+var System = Java.type('java.lang.System');
+var PrintStream = Java.type('java.io.PrintStream');
+var ByteArrayOutputStream = Java.type('java.io.ByteArrayOutputStream');
+var BufferedReader = Java.type('java.io.BufferedReader');
+var InputStreamReader = Java.type('java.io.InputStreamReader');
+var StringArray = Java.type('java.lang.String[]');
+
+var conf = new Configuration();
+// Generic options can't be passed to FsShell.run: -checksum options are set here.
+conf.set('dfs.checksum.combine.mode', 'COMPOSITE_CRC');
+var shell = new FsShell(conf);
+// Admin tools run instead of FsShell by requests starting with @<tool name>
+var ADMIN_TOOLS = {
+    'storagepolicies': 'org.apache.hadoop.hdfs.tools.StoragePolicyAdmin'
+};
+var stdout = System.out;
+var stderr = System.err;
+var input = new BufferedReader(new InputStreamReader(System.in, 'UTF-8'));
+var line;
+while ((line = input.readLine()) != null) {
+    var out = new ByteArrayOutputStream();
+    var err = new ByteArrayOutputStream();
+    var code;
+    System.setOut(new PrintStream(out, true, 'UTF-8'));
+    System.setErr(new PrintStream(err, true, 'UTF-8'));
+    try {
+        var args = JSON.parse(line);
+        var tool = shell;
+        if (args.length > 0 && args[0].charAt(0) == '@') {
+            tool = new (Java.type(ADMIN_TOOLS[args.shift().substring(1)]))(conf);
+        }
+        code = tool.run(Java.to(args, StringArray));
+    } catch (e) {
+        System.err.println(String(e));
+        code = -1;
+    } finally {
+        System.out.flush();
+        System.err.flush();
+        System.setOut(stdout);
+        System.setErr(stderr);
+    }
+    var outBytes = out.toByteArray();
+    var errBytes = err.toByteArray();
+    stdout.print(code + ' ' + outBytes.length + ' ' + errBytes.length + '\\n');
+    stdout.write(outBytes, 0, outBytes.length);
+    stdout.write(errBytes, 0, errBytes.length);
+    stdout.flush();
+}
+'''
+
+
+def default_worker_command():
+    """
+    Returns the command starting the worker with jrunscript on the Hadoop classpath.
+    """
+    return ['jrunscript', '-classpath', sh(['hadoop', 'classpath']), '-e', WORKER_SCRIPT]
+
+
+class FsShellWorkerBackend(HdfsCliBackend):
+    """
+    Hdfs backend sending `hdfs dfs` commands to a warm FsShell worker process.
+
+    The worker is started on first use and restarted if it dies. Commands are
+    serialized, so the backend can safely be shared between threads.
+
+    Parameters:
+        worker_command : Command starting the worker process. Defaults to
+                         jrunscript running WORKER_SCRIPT on the Hadoop classpath.
+    """
+    # Set in the worker configuration instead.
+    checksum_options = []
+
+    def __init__(self, worker_command=None):
+        super(FsShellWorkerBackend, self).__init__()
+        self.worker_command = worker_command
+        self.process = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _start(self):
+        command = self.worker_command or default_worker_command()
+        logger.debug('Starting FsShell worker')
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+
+    def _read(self, length):
+        data = b''
+        while len(data) < length:
+            chunk = self.process.stdout.read(length - len(data))
+            if not chunk:
+                raise RuntimeError('FsShell worker died while answering')
+            data += chunk
+        return data
+
+    def _run(self, args):
+        """
+        Sends args to the worker and returns its (return_code, stdout, stderr).
+        """
+        logger.debug('Running in FsShell worker: {0}'.format(' '.join(['hdfs', 'dfs'] + args)))
+        with self._lock:
+            if self.process is None or self.process.poll() is not None:
+                self._start()
+            try:
+                self.process.stdin.write((json.dumps(args) + '\n').encode('utf-8'))
+                self.process.stdin.flush()
+                header = self.process.stdout.readline().split()
+                if len(header) != 3:
+                    raise RuntimeError('FsShell worker died or sent an invalid answer')
+                return_code, stdout_length, stderr_length = [int(h) for h in header]
+                stdout = self._read(stdout_length)
+                stderr = self._read(stderr_length)
+            except (OSError, RuntimeError):
+                # Don't reuse a worker in an unknown state.
+                self._stop()
+                raise
+        return return_code, stdout, stderr
+
+    def _dfs(self, args, check_return_code=True):
+        return_code, stdout, stderr = self._run(args)
+        if check_return_code and return_code != 0:
+            raise RuntimeError("Command: {0} failed with error code: {1}"
+                               .format(' '.join(['hdfs', 'dfs'] + args), return_code), stdout, stderr)
+        return stdout.strip().decode()
+
+    def _admin(self, tool, args):
+        # Run by the worker too, rather than by a new JVM.
+        return self._dfs(['@' + tool] + args)
+
+    def _dfs_outputs(self, args):
+        return_code, stdout, stderr = self._run(args)
+        return stdout.strip().decode(), stderr.strip().decode()
+
+    def _dfs_lines(self, args, check_return_code=True):
+        # The worker answers with the whole command output at once.
+        return iter(self._dfs(args, check_return_code=check_return_code).splitlines())
+
+    def _stop(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.stdin.close()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+            self.process.stdout.close()
+            self.process = None
+
+    def close(self):
+        """
+        Stops the worker process, if running.
+        """
+        with self._lock:
+            self._stop()
@@ -19,18 +19,785 @@ Wikimedia Analytics Refinery python HDFS utility functions.
 See util.py, hive.py, druid.py in the same folder
 """
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dateutil import parser
+from datetime import datetime, timezone
+from enum import Enum
+import bz2
+import calendar
+import gzip
+import io
 import logging
 import os
 import glob
+import re
+import shutil
+import json
+import subprocess
+import tempfile
+import threading
+import time
 
-from refinery.util import sh
+from refinery.checksum import CRC_FUNCTIONS, file_checksum
+from refinery.util import read_properties_file, sh, sh_lines
 
 
 logger = logging.getLogger('hdfs-util')
 
 
+HDFS_CONFIG_ENV_VARIABLE = 'REFINERY_HDFS_CONFIG'
+
+# Maximum total length of the paths given to a single hdfs dfs command,
+# keeping well under the operating system limit on command lines.
+MAX_ARGUMENTS_LENGTH = 100000
+
+
+def chunk_arguments(arguments, max_length=MAX_ARGUMENTS_LENGTH):
+    """
+    Splits the arguments list into consecutive lists whose total length
+    (counting one separator per argument) doesn't exceed max_length.
+    An argument longer than max_length gets a list of its own.
+    """
+    chunks = []
+    chunk, chunk_length = [], 0
+    for argument in arguments:
+        if chunk and chunk_length + len(argument) + 1 > max_length:
+            chunks.append(chunk)
+            chunk, chunk_length = [], 0
+        chunk.append(argument)
+        chunk_length += len(argument) + 1
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class FileType(str, Enum):
+    """
+    Type of an HdfsFileStatus. Values compare equal to the 'f' and 'd'
+    file_type strings used by Hdfs.ls(with_details=True).
+    """
+    FILE = 'f'
+    DIRECTORY = 'd'
+
+
+class HdfsFileStatus(object):
+    """
+    Compact record describing a file or directory, as yielded by Hdfs.iter_ls.
+
+    Attributes:
+        path        : Full path
+        file_type   : FileType
+        size        : Size in bytes (int, 0 for directories)
+        mtime       : Modification time in seconds since epoch (int, UTC)
+        permission  : Permission string, e.g. rwxr-xr-x
+        replication : Replication factor (int, 0 for directories)
+        owner       : Owner user name
+        group       : Owner group name
+    """
+    __slots__ = ('path', 'file_type', 'size', 'mtime', 'permission', 'replication', 'owner', 'group')
+
+    def __init__(self, path, file_type, size, mtime, permission='', replication=0, owner='', group=''):
+        self.path = path
+        self.file_type = file_type
+        self.size = size
+        self.mtime = mtime
+        self.permission = permission
+        self.replication = replication
+        self.owner = owner
+        self.group = group
+
+    def is_directory(self):
+        return self.file_type is FileType.DIRECTORY
+
+    def __repr__(self):
+        return 'HdfsFileStatus({!r}, {}, size={}, mtime={})'.format(
+            self.path, self.file_type.name, self.size, self.mtime)
+
+
+class HdfsStreamReader(io.RawIOBase):
+    """
+    Raw binary reader over a backend stream (a command stdout pipe or an
+    HTTP response), to be wrapped in an io.BufferedReader.
+
+    Parameters:
+        stream : Binary file-like object the data is read from.
+        finish : Function called once with complete=True when the end of
+                 the stream is reached, raising a RuntimeError if the
+                 transfer failed, or with complete=False if the reader is
+                 closed before that.
+    """
+
+    def __init__(self, stream, finish):
+        super(HdfsStreamReader, self).__init__()
+        self.stream = stream
+        self._finish = finish
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._finish is None:
+            return 0
+        count = self.stream.readinto(buffer)
+        if not count:
+            self._finished(True)
+        return count
+
+    def _finished(self, complete):
+        finish, self._finish = self._finish, None
+        if finish is not None:
+            finish(complete)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._finished(False)
+            finally:
+                super(HdfsStreamReader, self).close()
+
+
+class _ClosingGzipFile(gzip.GzipFile):
+    """
+    GzipFile closing the file object it decompresses when closed.
+    """
+
+    def close(self):
+        source = self.fileobj
+        try:
+            super(_ClosingGzipFile, self).close()
+        finally:
+            if source is not None:
+                source.close()
+
+
+class _ClosingBZ2File(bz2.BZ2File):
+    """
+    BZ2File closing the file object it decompresses when closed.
+    """
+
+    def __init__(self, source):
+        super(_ClosingBZ2File, self).__init__(source)
+        self._source = source
+
+    def close(self):
+        try:
+            super(_ClosingBZ2File, self).close()
+        finally:
+            self._source.close()
+
+
+def parse_ls_lines(lines):
+    """
+    Parses `hdfs dfs -ls` output lines into HdfsFileStatus records, lazily.
+    The -ls output dates are expected to be in UTC.
+    """
+    # Many entries share the same modification minute.
+    mtimes = {}
+    for line in lines:
+        if not line or line.startswith('Found '):
+            continue
+        parts = line.split(None, 7)
+        if len(parts) < 8:
+            continue
+        date_time = parts[5] + parts[6]
+        mtime = mtimes.get(date_time)
+        if mtime is None:
+            date, time = parts[5], parts[6]
+            mtime = calendar.timegm((
+                int(date[0:4]), int(date[5:7]), int(date[8:10]),
+                int(time[0:2]), int(time[3:5]), 0))
+            if len(mtimes) < 10000:
+                mtimes[date_time] = mtime
+        is_dir = parts[0][0] == 'd'
+        yield HdfsFileStatus(
+            parts[7],
+            FileType.DIRECTORY if is_dir else FileType.FILE,
+            int(parts[4]),
+            mtime,
+            parts[0][1:],
+            0 if is_dir else int(parts[1]),
+            parts[2],
+            parts[3]
+        )
+
+
+class HdfsCliBackend(object):
+    """
+    Default Hdfs backend, running one `hdfs dfs` process per operation.
+
+    Every method here is a thin wrapper around the corresponding `hdfs dfs`
+    shell command, paying the Hadoop client JVM startup on each call.
+    """
+    # Generic options of -checksum, making it return checksums
+    # comparable to local ones (see checksum.py in the same folder).
+    checksum_options = ['-Ddfs.checksum.combine.mode=COMPOSITE_CRC']
+
+    def __init__(self, hdfs_command=None):
+        self.hdfs_command = list(hdfs_command) if hdfs_command else ['hdfs', 'dfs']
+
+    def _dfs(self, args, check_return_code=True):
+        return sh(self.hdfs_command + args, check_return_code=check_return_code)
+
+    def _dfs_lines(self, args, check_return_code=True):
+        return sh_lines(self.hdfs_command + args, check_return_code=check_return_code)
+
+    def _dfs_outputs(self, args):
+        """
+        Runs the command without checking its return code,
+        and returns its (stdout, stderr).
+        """
+        return sh(self.hdfs_command + args, check_return_code=False, return_stderr=True)
+
+    def _dfs_bulk(self, args, paths):
+        """
+        Runs the command on paths, chunked, and returns (lines, missing) where
+        lines are the output lines and missing the paths reported as not existing.
+        Raises a RuntimeError for any other error.
+        """
+        lines, missing = [], set()
+        # Generic options (-D) come before the command name.
+        command = next(arg for arg in args if not arg.startswith('-D'))
+        for chunk in chunk_arguments(paths):
+            stdout, stderr = self._dfs_outputs(args + chunk)
+            lines += [line for line in stdout.splitlines() if line]
+            for line in stderr.splitlines():
+                match = MISSING_PATH_PATTERN.search(line)
+                if match:
+                    missing.add(match.group(1))
+                elif line.startswith(command[1:] + ':'):
+                    raise RuntimeError('Command: {} failed: {}'.format(' '.join(args), stderr))
+        return lines, missing
+
+    def ls(self, paths, include_children=True):
+        options = [] if include_children else ['-d']
+        output = self._dfs(
+            ['-ls'] + options + paths,
+            # Not checking return code here so we don't
+            # fail paths do not exist.
+            check_return_code=False
+        )
+        return [
+            ls_parts_to_details(line.split()) for line in output.splitlines()
+            if line and not line.startswith('Found ')
+        ]
+
+    def iter_ls(self, paths, include_children=True, recursive=False):
+        options = ['-R'] if recursive else [] if include_children else ['-d']
+        for chunk in chunk_arguments(paths):
+            # Not checking return code, same as ls.
+            for status in parse_ls_lines(self._dfs_lines(['-ls'] + options + chunk, check_return_code=False)):
+                yield status
+
+    def rm(self, paths, recurse=True, skip_trash=True):
+        options = (['-R'] if recurse else []) + (['-skipTrash'] if skip_trash else [])
+        return '\n'.join(self._dfs(['-rm'] + options + chunk) for chunk in chunk_arguments(paths))
+
+    def rmdir(self, paths):
+        return self._dfs(['-rmdir'] + paths)
+
+    def mkdir(self, paths, create_parent=True):
+        options = ['-p'] if create_parent else []
+        return '\n'.join(self._dfs(['-mkdir'] + options + chunk) for chunk in chunk_arguments(paths))
+
+    def cp(self, from_path, to_path, force=False):
+        options = ['-f'] if force else []
+        self._dfs(['-cp'] + options + [from_path, to_path])
+
+    def mv(self, from_paths, to_path):
+        for chunk in chunk_arguments(from_paths):
+            self._dfs(['-mv'] + chunk + [to_path])
+
+    def put(self, local_paths, hdfs_path, force=False):
+        options = ['-f'] if force else []
+        for chunk in chunk_arguments(local_paths):
+            self._dfs(['-put'] + options + chunk + [hdfs_path])
+
+    def get(self, hdfs_paths, local_path, force=False):
+        options = ['-f'] if force else []
+        for chunk in chunk_arguments(hdfs_paths):
+            self._dfs(['-get'] + options + chunk + [local_path])
+
+    def cat(self, path):
+        return self._dfs(['-cat', path])
+
+    def open(self, path):
+        command = self.hdfs_command + ['-cat', path]
+        command_string = ' '.join(command)
+        logger.debug('Streaming: {0}'.format(command_string))
+        # stderr goes to a temporary file, see refinery.util.sh_lines
+        stderr_file = tempfile.TemporaryFile()
+        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file)
+
+        def finish(complete):
+            try:
+                if not complete and p.poll() is None:
+                    p.kill()
+                p.wait()
+                p.stdout.close()
+                if complete and p.returncode != 0:
+                    stderr_file.seek(0)
+                    raise RuntimeError("Command: {0} failed with error code: {1}"
+                                       .format(command_string, p.returncode), b'', stderr_file.read().strip())
+            finally:
+                stderr_file.close()
+
+        return HdfsStreamReader(p.stdout, finish)
+
+    def get_modified_datetime(self, path):
+        stat_str = self._dfs(['-stat', path])
+        date_str, time_str = stat_str.strip().split()
+        iso_datetime_str = date_str + 'T' + time_str + 'Z'
+        return parser.parse(iso_datetime_str)
+
+    def touchz(self, paths):
+        return self._dfs(['-touchz'] + paths)
+
+    def setrep(self, paths, replication):
+        for chunk in chunk_arguments(paths):
+            self._dfs(['-setrep', str(replication)] + chunk)
+
+    def _admin(self, tool, args):
+        """
+        Runs the hdfs admin tool (e.g. storagepolicies) with args, using the
+        hdfs executable of hdfs_command.
+        """
+        return sh([self.hdfs_command[0], tool] + args)
+
+    def set_storage_policy(self, paths, policy):
+        # hdfs storagepolicies takes a single path.
+        for path in paths:
+            self._admin('storagepolicies', ['-setStoragePolicy', '-path', path, '-policy', policy])
+
+    def dir_bytes_size(self, path):
+        return int(self._dfs(['-du', '-s', path]).split()[0])
+
+    def stat(self, paths):
+        lines, missing = self._dfs_bulk(['-stat', STAT_FORMAT], paths)
+        # -stat doesn't print paths: lines are those of existing paths, in order.
+        existing = [path for path in paths if path not in missing]
+        if len(lines) != len(existing):
+            raise RuntimeError('Unexpected -stat output for {}, are there globs?'.format(' '.join(paths)))
+        stats = {path: None for path in missing}
+        for path, line in zip(existing, lines):
+            file_type, size, replication, mtime = line.split('\t')
+            stats[path] = {
+                'file_type': 'd' if file_type == 'directory' else 'f',
+                'size': int(size),
+                'replication': int(replication),
+                'modified_datetime': datetime.fromtimestamp(int(mtime) // 1000, tz=timezone.utc),
+            }
+        return stats
+
+    def du(self, paths):
+        lines, missing = self._dfs_bulk(['-du', '-s'], paths)
+        sizes = {path: None for path in paths}
+        keys = output_path_keys(paths)
+        for line in lines:
+            # Hadoop 2.8+ adds the disk space consumed by replicas after the size.
+            size, path = line.split(None, 1)
+            parts = path.split(None, 1)
+            if len(parts) == 2 and parts[0].isdigit():
+                path = parts[1]
+            sizes[keys.get(path, path)] = int(size)
+        return sizes
+
+    def count(self, paths):
+        lines, missing = self._dfs_bulk(['-count'], paths)
+        counts = {path: None for path in paths}
+        keys = output_path_keys(paths)
+        for line in lines:
+            directory_count, file_count, content_size, path = line.split(None, 3)
+            counts[keys.get(path, path)] = {
+                'directory_count': int(directory_count),
+                'file_count': int(file_count),
+                'content_size': int(content_size),
+            }
+        return counts
+
+    def checksum(self, paths):
+        lines, missing = self._dfs_bulk(self.checksum_options + ['-checksum'], paths)
+        checksums = {path: None for path in paths}
+        keys = output_path_keys(paths)
+        for line in lines:
+            path, algorithm, checksum = line.rsplit('\t', 2)
+            checksums[keys.get(path, path)] = {'algorithm': algorithm, 'checksum': checksum}
+        return checksums
+
+
+# Format of -stat output lines parsed by HdfsCliBackend.stat
+STAT_FORMAT = '%F\t%b\t%r\t%Y'
+# Error line of commands run on a missing path
+MISSING_PATH_PATTERN = re.compile(r"`(.*)': No such file or directory")
+
+
+def output_path_keys(paths):
+    """
+    Returns a dictionnary mapping paths as printed by hdfs dfs
+    (without trailing slash) to the given paths.
+    """
+    return {path.rstrip('/') or '/': path for path in paths}
+
+
+def ls_parts_to_details(parts):
+    """
+    Converts a split line of `hdfs dfs -ls` output to the
+    dictionnary returned by Hdfs.ls(with_details=True).
+    """
+    return {
+        'file_type': 'f' if parts[0][0] == '-' else 'd',
+        'permission': parts[0][1:],
+        'replication': parts[1],
+        'owner': parts[2],
+        'group': parts[3],
+        'file_size': parts[4],
+        'modification_date': parts[5],
+        'modification_time': parts[6],
+        'path': parts[7]
+    }
+
+
+def backend_from_config(config):
+    """
+    Instanciates an Hdfs backend from a configuration dictionnary,
+    for instance read from a properties file using
+    refinery.util.read_properties_file. Supported keys:
+
+        hdfs.backend       : One of cli (default), fsshell, webhdfs or httpfs.
+        hdfs.command       : Command used by the cli backend (default: hdfs dfs).
+        fsshell.command    : Command starting the fsshell backend worker
+                             (default: see refinery.fsshell_worker).
+        webhdfs.url        : Base URL of the NameNode WebHDFS endpoint or of the
+                             HttpFS server, e.g. http://namenode.example.org:9870
+        webhdfs.user       : User to pass as user.name (pseudo authentication).
+        webhdfs.pool_size  : Maximum number of kept-alive connections per host.
+        webhdfs.timeout    : Socket timeout in seconds.
+    """
+    backend = config.get('hdfs.backend', 'cli')
+    if backend == 'cli':
+        command = config.get('hdfs.command')
+        return HdfsCliBackend(command.split() if command else None)
+    elif backend == 'fsshell':
+        # Imported here as refinery.fsshell_worker depends on this module.
+        from refinery.fsshell_worker import FsShellWorkerBackend
+        command = config.get('fsshell.command')
+        return FsShellWorkerBackend(command.split() if command else None)
+    elif backend in ('webhdfs', 'httpfs'):
+        # Imported here as refinery.webhdfs depends on this module.
+        from refinery.webhdfs import WebHdfsBackend
+        if not config.get('webhdfs.url'):
+            raise ValueError('webhdfs.url is mandatory for the {} hdfs backend'.format(backend))
+        return WebHdfsBackend(
+            config['webhdfs.url'],
+            user=config.get('webhdfs.user'),
+            httpfs=(backend == 'httpfs'),
+            pool_size=int(config.get('webhdfs.pool_size', 10)),
+            timeout=float(config.get('webhdfs.timeout', 60))
+        )
+    else:
+        raise ValueError('Unknown hdfs backend: {}'.format(backend))
+
+
+class HdfsListingCache(object):
+    """
+    Per-process cache of Hdfs listing and stat results, with a time-to-live
+    and a bounded number of entries (least recently used ones are evicted).
+
+    Entries are invalidated when a path they cover is modified through Hdfs:
+    an entry is dropped when one of its listed paths (up to its first glob)
+    and a modified path are the same, or one contains the other.
+
+    Parameters:
+        ttl                 : Time-to-live of entries in seconds.
+        max_entries         : Maximum number of cached entries.
+        max_listing_size    : Streamed listings (Hdfs.iter_ls) with more records
+                              than this are not cached.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000, max_listing_size=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_listing_size = max_listing_size
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, paths, value):
+        """
+        Caches value for key. paths are the HDFS paths the value depends on.
+        """
+        prefixes = [cache_prefix(path) for path in paths]
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, prefixes, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, paths):
+        """
+        Drops the entries depending on any of the given modified paths.
+        """
+        modified = [cache_prefix(path) for path in paths]
+        with self._lock:
+            stale = [
+                key for key, (_, prefixes, _) in self._entries.items()
+                if any(is_same_or_parent(p, m) or is_same_or_parent(m, p)
+                       for p in prefixes for m in modified)
+            ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters as a dictionnary.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+            }
+
+
+class RsyncManifest(object):
+    """
+    Persisted record of the files transferred by Hdfs.rsync, allowing an
+    interrupted rsync to resume without comparing nor copying again the files
+    verified by a previous run.
+
+    The manifest is a local file of JSON lines, one per file state change:
+    {"path": source path, "size": bytes, "mtime": seconds, "state": state}.
+    A file is 'copied' once its batch completed and 'verified' once its
+    destination has been checked, or 'failed' if that check failed. Lines
+    are appended as states change, the last one for a path being current.
+    A verified file is only skipped if its source size and mtime are unchanged.
+    Its destination is not checked again: a destination file changed or
+    removed after it was verified is not noticed by later runs using the
+    manifest.
+
+    Parameters:
+        path : Local path of the manifest file, created if missing.
+    """
+
+    COPIED = 'copied'
+    VERIFIED = 'verified'
+    FAILED = 'failed'
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line truncated by an interrupted run.
+                        continue
+                    self.entries[entry['path']] = entry
+
+    def is_verified(self, src_file):
+        """
+        Returns True if src_file (as returned by _get_local_files or _get_hdfs_files)
+        has been verified by a previous run and is unchanged since.
+        """
+        entry = self.entries.get(src_file['path'])
+        return (entry is not None and
+                entry['state'] == RsyncManifest.VERIFIED and
+                entry['size'] == src_file['file_size'] and
+                entry['mtime'] == src_file['mtime'])
+
+    def record(self, src_files, state):
+        """
+        Appends src_files with the given state to the manifest file.
+        """
+        with self._lock:
+            with open(self.path, 'a') as f:
+                for src_file in src_files:
+                    entry = {'path': src_file['path'], 'size': src_file['file_size'],
+                             'mtime': src_file['mtime'], 'state': state}
+                    self.entries[entry['path']] = entry
+                    f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def cache_prefix(path):
+    """
+    Returns the literal part of path used for cache invalidation: the path
+    without scheme and authority, cut before its first component with a glob.
+    """
+    if path.startswith('hdfs://'):
+        path = '/' + path.split('/', 3)[-1] if path.count('/') >= 3 else '/'
+    components = []
+    for component in path.rstrip('/').split('/'):
+        if any(c in component for c in '*?[{'):
+            break
+        components.append(component)
+    return '/'.join(components) or '/'
+
+
+def is_same_or_parent(parent, path):
+    """
+    Returns True if parent is path or one of its ancestors.
+    """
+    return path == parent or path.startswith(parent.rstrip('/') + '/')
+
+
+def walk_tree(iter_ls, root, max_depth=None, prune=None, workers=1):
+    """
+    Lazily yields the HdfsFileStatus of everything below root, listed with
+    iter_ls (a function with the signature of Hdfs.iter_ls).
+
+    Without max_depth nor prune, the tree is listed at once recursively.
+    Otherwise it is listed level by level, all the directories of a level
+    being listed together (split in workers groups listed in parallel).
+
+    Parameters:
+        root        : Path of the directory to walk.
+        max_depth   : If set, entries deeper than this are not listed
+                      (root children are at depth 1).
+        prune       : If set, function called with the HdfsFileStatus of
+                      each directory, returning True if its content should
+                      not be listed.
+        workers     : Number of groups of directories listed in parallel.
+    """
+    if max_depth is None and prune is None:
+        for status in iter_ls([root], recursive=True):
+            yield status
+        return
+
+    level, depth = [root], 1
+    while level and (max_depth is None or depth <= max_depth):
+        # Listing a file yields the file itself, not to be returned.
+        level_paths = set(level)
+        next_level = []
+        for status in _iter_ls_level(iter_ls, level, workers):
+            if status.path in level_paths:
+                continue
+            yield status
+            if (status.is_directory() and (max_depth is None or depth < max_depth) and
+                    (prune is None or not prune(status))):
+                next_level.append(status.path)
+        level, depth = next_level, depth + 1
+
+
+def _iter_ls_level(iter_ls, paths, workers):
+    """
+    Yields the statuses of paths content, listing workers groups
+    of paths in parallel when there are more than one.
+    """
+    if workers <= 1 or len(paths) == 1:
+        for status in iter_ls(paths):
+            yield status
+        return
+    group_size = -(-len(paths) // workers)
+    groups = [paths[i:i + group_size] for i in range(0, len(paths), group_size)]
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        for statuses in executor.map(lambda group: list(iter_ls(group)), groups):
+            for status in statuses:
+                yield status
+
+
+def epoch_seconds(dt):
+    """
+    Returns the seconds since epoch of dt, naive datetimes being considered UTC.
+    """
+    return calendar.timegm(dt.utctimetuple())
+
+
 class Hdfs(object):
+    """
+    HDFS utility functions.
+
+    Operations are delegated to a backend, by default HdfsCliBackend.
+    The backend can be chosen using Hdfs.set_backend, or by setting the
+    REFINERY_HDFS_CONFIG environment variable to the path of a properties
+    file as described in backend_from_config.
+
+    Listing and stat results can be cached for the process, see Hdfs.enable_cache.
+    """
+
+    _backend = None
+    _cache = None
+
+    @staticmethod
+    def backend():
+        """
+        Returns the backend currently in use, initializing it if needed.
+        """
+        if Hdfs._backend is None:
+            config_file = os.environ.get(HDFS_CONFIG_ENV_VARIABLE)
+            config = read_properties_file(config_file) if config_file else {}
+            Hdfs._backend = backend_from_config(config)
+        return Hdfs._backend
+
+    @staticmethod
+    def set_backend(backend):
+        """
+        Sets the backend to use for subsequent operations.
+
+        Parameters:
+            backend : A backend instance, or a configuration dictionnary
+                      passed to backend_from_config. None resets to default.
+        """
+        if isinstance(backend, dict):
+            backend = backend_from_config(backend)
+        Hdfs._backend = backend
+
+    @staticmethod
+    def enable_cache(ttl=60, max_entries=10000, max_listing_size=10000):
+        """
+        Enables caching of ls, iter_ls and get_modified_datetime results,
+        see HdfsListingCache. Paths modified through Hdfs (rm, rmdir, mv,
+        mkdir, cp, put, touchz) are invalidated automatically, but changes
+        made by other processes are only seen once entries expire.
+        """
+        Hdfs._cache = HdfsListingCache(ttl, max_entries, max_listing_size)
+
+    @staticmethod
+    def disable_cache():
+        Hdfs._cache = None
+
+    @staticmethod
+    def cache_stats():
+        """
+        Returns the cache hit/miss counters, or None if the cache is disabled.
+        """
+        return Hdfs._cache.stats() if Hdfs._cache is not None else None
+
+    @staticmethod
+    def _invalidate(paths):
+        if Hdfs._cache is not None:
+            Hdfs._cache.invalidate(paths)
+
     @staticmethod
     def ls(paths, include_children=True, with_details=False):
         """
@@ -47,35 +814,91 @@ class Hdfs(object):
         if isinstance(paths, str):
             paths = paths.split()
 
-        options = []
-        if not include_children:
-            options.append('-d')
-
-        split_lines = [
-            line.split() for line in sh(
-                ['hdfs', 'dfs', '-ls'] + options + paths,
-                # Not checking return code here so we don't
-                # fail paths do not exist.
-                check_return_code=False
-            ).splitlines() if not line.startswith('Found ')
-        ]
+        cache = Hdfs._cache
+        key = ('ls', tuple(paths), include_children)
+        details = cache.get(key) if cache is not None else None
+        if details is None:
+            details = Hdfs.backend().ls(paths, include_children=include_children)
+            if cache is not None:
+                cache.put(key, paths, details)
 
         if with_details:
-            return [
-                {
-                    'file_type': 'f' if parts[0][0] == '-' else 'd',
-                    'permission': parts[0][1:],
-                    'replication': parts[1],
-                    'owner': parts[2],
-                    'group': parts[3],
-                    'file_size': parts[4],
-                    'modification_date': parts[5],
-                    'modification_time': parts[6],
-                    'path': parts[7]
-                } for parts in split_lines
-            ]
+            if cache is not None:
+                # Don't let callers alter cached values.
+                return [dict(d) for d in details]
+            return details
         else:
-            return [parts[-1] for parts in split_lines]
+            return [d['path'] for d in details]
+
+    @staticmethod
+    def iter_ls(paths, include_children=True, recursive=False):
+        """
+        Lists paths like Hdfs.ls, but lazily yields HdfsFileStatus records
+        as the listing is read instead of building it in memory.
+
+        Parameters:
+            paths            : List or string paths to files to ls.  Can include shell globs.
+            include_children : If include_children is False, directories
+                               themselves are listed instead of their content.
+            recursive        : If True, directories content is listed
+                               recursively, as with hdfs dfs -ls -R.
+        """
+        if isinstance(paths, str):
+            paths = paths.split()
+
+        if Hdfs._cache is None:
+            return Hdfs.backend().iter_ls(paths, include_children=include_children, recursive=recursive)
+        return Hdfs._cached_iter_ls(Hdfs._cache, paths, include_children, recursive)
+
+    @staticmethod
+    def _cached_iter_ls(cache, paths, include_children, recursive):
+        key = ('iter_ls', tuple(paths), include_children, recursive)
+        statuses = cache.get(key)
+        if statuses is not None:
+            for status in statuses:
+                yield status
+            return
+        statuses = []
+        for status in Hdfs.backend().iter_ls(paths, include_children=include_children, recursive=recursive):
+            if statuses is not None:
+                statuses.append(status)
+                if len(statuses) > cache.max_listing_size:
+                    statuses = None
+            yield status
+        if statuses is not None:
+            cache.put(key, paths, statuses)
+
+    @staticmethod
+    def walk(root, max_depth=None, prune=None, workers=1):
+        """
+        Lazily yields the HdfsFileStatus of everything below root, in one
+        recursive listing if possible, level by level otherwise.
+        See walk_tree for parameters.
+        """
+        return walk_tree(Hdfs.iter_ls, root, max_depth=max_depth, prune=prune, workers=workers)
+
+    @staticmethod
+    def find(root, older_than=None, larger_than=None, name_regex=None, file_type=None,
+             max_depth=None, prune=None, workers=1):
+        """
+        Lazily yields the HdfsFileStatus of the entries below root matching
+        all the given filters (see Hdfs.walk for the other parameters).
+
+        Parameters:
+            older_than  : Modified before this datetime (naive ones being UTC).
+            larger_than : Bigger than this size in bytes.
+            name_regex  : Name (last path component) matching this regular
+                          expression (re.search), either a string or compiled.
+            file_type   : Of this FileType ('f' or 'd').
+        """
+        older_than = epoch_seconds(older_than) if older_than is not None else None
+        name_regex = re.compile(name_regex) if isinstance(name_regex, str) else name_regex
+        for status in Hdfs.walk(root, max_depth=max_depth, prune=prune, workers=workers):
+            if ((older_than is None or status.mtime < older_than) and
+                    (larger_than is None or status.size > larger_than) and
+                    (file_type is None or status.file_type == file_type) and
+                    (name_regex is None or name_regex.search(status.path.rsplit('/', 1)[-1]))):
+                yield status
 
     @staticmethod
     def rm(paths, recurse=True, skip_trash=True):
@@ -85,8 +908,10 @@ class Hdfs(object):
         if isinstance(paths, str):
             paths = paths.split()
 
-        options = (['-R'] if recurse else []) + (['-skipTrash'] if skip_trash else [])
-        return sh(['hdfs', 'dfs', '-rm'] + options + paths)
+        try:
+            return Hdfs.backend().rm(paths, recurse=recurse, skip_trash=skip_trash)
+        finally:
+            Hdfs._invalidate(paths)
 
     @staticmethod
     def rmdir(paths):
@@ -96,35 +921,47 @@ class Hdfs(object):
         if isinstance(paths, str):
             paths = paths.split()
 
-        return sh(['hdfs', 'dfs', '-rmdir'] + paths)
+        try:
+            return Hdfs.backend().rmdir(paths)
+        finally:
+            Hdfs._invalidate(paths)
 
+    @staticmethod
     def mkdir(paths, create_parent=True):
         """
         Runs hdfs dfs -mkdir -p on paths.
         """
-        options = ['-p'] if create_parent else []
         if isinstance(paths, str):
             paths = paths.split()
 
-        return sh(['hdfs', 'dfs', '-mkdir'] + options + paths)
+        try:
+            return Hdfs.backend().mkdir(paths, create_parent=create_parent)
+        finally:
+            Hdfs._invalidate(paths)
 
     @staticmethod
     def cp(fromPath, toPath, force=False):
         """
         Runs 'hdfs dfs -cp fromPath toPath' to copy a file.
         """
-        command = ['hdfs', 'dfs', '-cp', fromPath, toPath]
-        if force:
-            command.insert(3, '-f')
-        sh(command)
+        try:
+            Hdfs.backend().cp(fromPath, toPath, force=force)
+        finally:
+            Hdfs._invalidate([toPath])
 
     @staticmethod
-    def mv(from_paths, to_paths, inParent=True):
+    def mv(from_paths, to_paths, inParent=True, bulk=False):
         """
         Runs hdfs dfs -mv fromPath toPath for each values of from/to Paths.
         If inParent is True (default), the parent folder in each of the
         to_paths provide is used as destination. Set inParent parameter to
         False if the file/folder moved is also renamed.
+
+        If bulk is True, the moves are planned together: all the distinct
+        destination parents are created with a single mkdir -p, and when
+        inParent is True, sources sharing a destination parent are moved
+        by a single multi-source mv. This turns the 3 commands run per
+        path otherwise into roughly one per distinct destination parent.
         """
         if isinstance(from_paths, str):
             from_paths = from_paths.split()
@@ -135,30 +972,67 @@ class Hdfs(object):
         if len(from_paths) != len(to_paths):
             raise Exception('from_paths and to_paths size don\'t match in hdfs mv function')
 
+        if bulk:
+            return Hdfs._bulk_mv(from_paths, to_paths, inParent)
+
         for i in range(len(from_paths)) :
             toParent = '/'.join(to_paths[i].split('/')[:-1])
             if not Hdfs.ls(toParent, include_children=False):
                 Hdfs.mkdir(toParent)
-            if (inParent):
-                sh(['hdfs', 'dfs', '-mv', from_paths[i], toParent])
-            else:
-                sh(['hdfs', 'dfs', '-mv', from_paths[i], to_paths[i]])
+            try:
+                if (inParent):
+                    Hdfs.backend().mv([from_paths[i]], toParent)
+                else:
+                    Hdfs.backend().mv([from_paths[i]], to_paths[i])
+            finally:
+                Hdfs._invalidate([from_paths[i], to_paths[i]])
+
+    @staticmethod
+    def _bulk_mv(from_paths, to_paths, in_parent):
+        """
+        Moves from_paths to to_paths as described in Hdfs.mv with bulk=True.
+        """
+        # Sources grouped by destination parent, keeping the given order.
+        moves_by_parent = OrderedDict()
+        for from_path, to_path in zip(from_paths, to_paths):
+            to_parent = '/'.join(to_path.split('/')[:-1])
+            moves_by_parent.setdefault(to_parent, []).append((from_path, to_path))
+
+        logger.debug('Moving {} paths to {} distinct parents'.format(
+            len(from_paths), len(moves_by_parent)))
+        # mkdir -p doesn't fail on existing folders, no need to check them first.
+        Hdfs.mkdir(list(moves_by_parent.keys()), create_parent=True)
+
+        for to_parent, moves in moves_by_parent.items():
+            try:
+                if in_parent:
+                    Hdfs.backend().mv([from_path for from_path, _ in moves], to_parent)
+                else:
+                    for from_path, to_path in moves:
+                        Hdfs.backend().mv([from_path], to_path)
+            finally:
+                Hdfs._invalidate([to_parent] + [from_path for from_path, _ in moves])
 
     @staticmethod
     def put(local_path, hdfs_path, force=False):
         """
         Runs 'hdfs dfs -put local_path hdfs_path' to copy a local file over to hdfs.
+        local_path can also be a list of paths, hdfs_path then being a folder.
         """
-        options = ['-f'] if force else []
-        sh(['hdfs', 'dfs', '-put'] + options + [local_path, hdfs_path])
+        local_paths = [local_path] if isinstance(local_path, str) else local_path
+        try:
+            Hdfs.backend().put(local_paths, hdfs_path, force=force)
+        finally:
+            Hdfs._invalidate([hdfs_path])
 
     @staticmethod
     def get(hdfs_path, local_path, force=False):
         """
         Runs 'hdfs dfs -get hdfs_path local_path' to copy a local file over to hdfs.
+        hdfs_path can also be a list of paths, local_path then being a folder.
         """
-        options = ['-f'] if force else []
-        sh(['hdfs', 'dfs', '-get'] + options + [hdfs_path, local_path])
+        hdfs_paths = [hdfs_path] if isinstance(hdfs_path, str) else hdfs_path
+        Hdfs.backend().get(hdfs_paths, local_path, force=force)
 
     @staticmethod
     def cat(path):
@@ -166,18 +1040,56 @@ class Hdfs(object):
         Runs hdfs dfs -cat path and returns the contents of the file.
         Be careful with file size, it will be returned as an in-memory string.
         """
-        command = ['hdfs', 'dfs', '-cat', path]
-        return sh(command)
+        return Hdfs.backend().cat(path)
+
+    @staticmethod
+    def open(path, mode='rb', compression='infer', encoding='utf-8', buffer_size=io.DEFAULT_BUFFER_SIZE):
+        """
+        Opens an HDFS file for streaming reads (as hdfs dfs -cat path does), using
+        constant memory whatever the file size. Use it as a context manager, or
+        close it once done: closing before the end of the file aborts the transfer.
+        A RuntimeError is raised when reaching the end of the file if the
+        transfer failed.
+
+        Parameters:
+            path        : HDFS path of the file to read.
+            mode        : 'rb' to get a binary file object, 'r' to get a text one
+                          (iterating over either yields lines).
+            compression : 'gzip', 'bz2' or None. 'infer' decompresses .gz and
+                          .bz2 files, based on path extension.
+            encoding    : Encoding of the file in text mode.
+            buffer_size : Size of the read buffer.
+        """
+        if mode not in ('rb', 'r'):
+            raise ValueError('Invalid mode {}, should be one of rb, r'.format(mode))
+        if compression == 'infer':
+            compression = {'.gz': 'gzip', '.bz2': 'bz2'}.get(os.path.splitext(path)[1])
+        if compression not in ('gzip', 'bz2', None):
+            raise ValueError('Invalid compression {}, should be one of gzip, bz2, infer, None'.format(
+                compression))
+
+        stream = io.BufferedReader(Hdfs.backend().open(path), buffer_size=buffer_size)
+        if compression == 'gzip':
+            stream = _ClosingGzipFile(fileobj=stream, mode='rb')
+        elif compression == 'bz2':
+            stream = _ClosingBZ2File(stream)
+        if mode == 'r':
+            stream = io.TextIOWrapper(stream, encoding=encoding)
+        return stream
 
     @staticmethod
     def get_modified_datetime(path):
         """
         Runs 'hdfs dfs -stat' and returns the modified datetime for the given path.
         """
-        stat_str = sh(['hdfs', 'dfs', '-stat', path])
-        date_str, time_str = stat_str.strip().split()
-        iso_datetime_str = date_str + 'T' + time_str + 'Z'
-        return parser.parse(iso_datetime_str)
+        cache = Hdfs._cache
+        key = ('get_modified_datetime', path)
+        modified_datetime = cache.get(key) if cache is not None else None
+        if modified_datetime is None:
+            modified_datetime = Hdfs.backend().get_modified_datetime(path)
+            if cache is not None:
+                cache.put(key, [path], modified_datetime)
+        return modified_datetime
 
     @staticmethod
     def touchz(paths):
@@ -187,7 +1099,37 @@ class Hdfs(object):
         if isinstance(paths, str):
             paths = paths.split()
 
-        return sh(['hdfs', 'dfs', '-touchz'] + paths)
+        try:
+            return Hdfs.backend().touchz(paths)
+        finally:
+            Hdfs._invalidate(paths)
+
+    @staticmethod
+    def setrep(paths, replication):
+        """
+        Runs hdfs dfs -setrep on paths, setting the replication factor
+        of all the files they contain (recursively for folders).
+        """
+        if isinstance(paths, str):
+            paths = paths.split()
+
+        try:
+            return Hdfs.backend().setrep(paths, replication)
+        finally:
+            Hdfs._invalidate(paths)
+
+    @staticmethod
+    def set_storage_policy(paths, policy):
+        """
+        Runs hdfs storagepolicies -setStoragePolicy for each of paths
+        (in a single JVM with the FsShell worker backend).
+        Existing blocks are only moved to the storage types of the new
+        policy when running the HDFS mover (hdfs mover -p paths).
+        """
+        if isinstance(paths, str):
+            paths = paths.split()
+
+        return Hdfs.backend().set_storage_policy(paths, policy)
 
     @staticmethod
     def validate_path(path):
@@ -212,11 +1154,62 @@ class Hdfs(object):
         """
         Returns the size in bytes of a hdfs path
         """
-        return int(sh(['hdfs', 'dfs', '-du', '-s', path]).split()[0])
+        return Hdfs.backend().dir_bytes_size(path)
+
+    @staticmethod
+    def stat(paths):
+        """
+        Runs hdfs dfs -stat on many paths at once (globs are not supported).
+        Returns a dictionnary keyed by path, having for value None if the path
+        doesn't exist, and {'file_type', 'size', 'replication', 'modified_datetime'}
+        otherwise, file_type being 'd' or 'f' and modified_datetime in UTC.
+        """
+        if isinstance(paths, str):
+            paths = paths.split()
+        return Hdfs.backend().stat(paths)
+
+    @staticmethod
+    def du(paths):
+        """
+        Runs hdfs dfs -du -s on many paths at once (globs are not supported).
+        Returns a dictionnary keyed by path having for value the size in bytes
+        of the path, or None if it doesn't exist.
+        """
+        if isinstance(paths, str):
+            paths = paths.split()
+        return Hdfs.backend().du(paths)
+
+    @staticmethod
+    def count(paths):
+        """
+        Runs hdfs dfs -count on many paths at once (globs are not supported).
+        Returns a dictionnary keyed by path, having for value None if the path
+        doesn't exist, and {'directory_count', 'file_count', 'content_size'}
+        otherwise.
+        """
+        if isinstance(paths, str):
+            paths = paths.split()
+        return Hdfs.backend().count(paths)
 
     @staticmethod
-    def rsync(local_path, hdfs_path, local_to_hdfs=True,
-              should_delete=False, dry_run=True):
+    def checksum(paths):
+        """
+        Runs hdfs dfs -checksum on many files at once (globs are not supported),
+        in COMPOSITE_CRC mode so that checksums can be compared to the ones of
+        local files computed by refinery.checksum.file_checksum.
+        The WebHDFS backend can't choose the mode: its checksums are the
+        DataNodes' default, MD5-of-MD5-of-CRC unless configured otherwise.
+        Returns a dictionnary keyed by path, having for value None if the path
+        doesn't exist, and {'algorithm', 'checksum'} otherwise.
+        """
+        if isinstance(paths, str):
+            paths = paths.split()
+        return Hdfs.backend().checksum(paths)
+
+    @staticmethod
+    def rsync(local_path, hdfs_path, local_to_hdfs=True, should_delete=False,
+              dry_run=True, workers=1, batch_size=1, manifest_path=None, recursive=False,
+              checksum=False):
         """
         Copy files from source to destination (either local-to-hdfs or vice-versa
         depending on local_to_hdfs parameter) trying to minimise copies using
@@ -228,41 +1221,59 @@ class Hdfs(object):
         Both source and destination should be absolute.
         If should_delete is set to True, files in destination not present in source
         will be deleted.
-        WARNING: If a glob pattern is used at folder-level, files will be copied
-                 but not the folder hierarchy. This also means that if files have
-                 the same name in different globed-folders, only one will remain
-                 in the destination folder.
+        Files are copied in batches of up to batch_size files per put/get command
+        (also bounded by command line length), running up to workers batches
+        in parallel.
+        If manifest_path is set, transferred files are recorded in that local
+        file (see RsyncManifest): files verified by a previous run are skipped,
+        and only the files copied by this run are verified afterwards instead
+        of listing source and destination again.
+        If recursive is set to True, source and destination must both be folders,
+        and the whole source tree is mirrored in destination, files being matched
+        by their path relative to source and destination folders.
+        WARNING: If not recursive and a glob pattern is used at folder-level,
+                 files will be copied but not the folder hierarchy. This also
+                 means that if files have the same name in different globed-folders,
+                 only one will remain in the destination folder.
+        If checksum is set to True, files of same type and size in source and
+        destination are also compared using their COMPOSITE_CRC checksums (the
+        local one being computed, the HDFS one fetched without reading data),
+        and so are copied files when verified using the manifest. Files whose
+        HDFS checksum is not a COMPOSITE_CRC one are only compared by size.
 
         """
-        # Check destination being a folder
-        if ((local_to_hdfs and not Hdfs._check_hdfs_dir(hdfs_path)) or
-                (not local_to_hdfs and not Hdfs._check_local_dir(local_path))):
+        # Check destination being a folder, and source too if recursive
+        if ((local_to_hdfs or recursive) and not Hdfs._check_hdfs_dir(hdfs_path)) or \
+                ((not local_to_hdfs or recursive) and not Hdfs._check_local_dir(local_path)):
             return False
 
+        manifest = RsyncManifest(manifest_path) if manifest_path and not dry_run else None
+
         # Get files to copy by comparing src and dst files lists
         files_left_to_copy = Hdfs._files_left_to_copy(
-            local_path, hdfs_path, local_to_hdfs, should_delete, dry_run)
+            local_path, hdfs_path, local_to_hdfs, should_delete, dry_run, manifest, recursive, checksum)
         if len(files_left_to_copy) == 0:
             logger.info('No file to copy'.format(len(files_left_to_copy)))
             return True
 
-        # Define copy and dst_path depending on local_to_hdfs
-        if local_to_hdfs:
-            (copy, dst_path) = (Hdfs.put, hdfs_path)
-        else:
-            (copy, dst_path) = (Hdfs.get, local_path)
-
-        # Do the actual copy
-        logger.info('Copying {} files ...'.format(len(files_left_to_copy)))
-        for f in files_left_to_copy:
-            src_file = files_left_to_copy[f]['path']
-            logger.info('Copying {} to {}'.format(src_file, dst_path))
-            if not dry_run:
-                copy(src_file, dst_path)
+        # Do the actual copy, creating the missing folders first if recursive
+        dst_path = hdfs_path if local_to_hdfs else local_path
+        files_to_copy = files_left_to_copy
+        if recursive:
+            Hdfs._create_dirs([os.path.join(dst_path, name) for name, f in files_left_to_copy.items()
+                               if f['file_type'] == 'd'], local_to_hdfs, dry_run)
+            files_to_copy = {name: f for name, f in files_left_to_copy.items() if f['file_type'] != 'd'}
+        Hdfs._copy_files(files_to_copy, dst_path, local_to_hdfs,
+                         workers, batch_size, dry_run, manifest)
 
         # Check copy to return value
-        files_left_to_copy = Hdfs._files_left_to_copy(
-            local_path, hdfs_path, local_to_hdfs, should_delete, dry_run)
+        if manifest is not None:
+            files_left_to_copy = Hdfs._verify_copied_files(
+                files_left_to_copy, dst_path, local_to_hdfs, manifest, checksum)
+        else:
+            files_left_to_copy = Hdfs._files_left_to_copy(
+                local_path, hdfs_path, local_to_hdfs, should_delete, dry_run,
+                recursive=recursive, checksum=checksum)
         if len(files_left_to_copy) == 0:
             logger.info('Successfull copy')
             return True
@@ -271,13 +1282,119 @@ class Hdfs(object):
                          ','.join(files_left_to_copy))
             return False
 
+    @staticmethod
+    def _copy_files(files, dst_path, local_to_hdfs, workers, batch_size, dry_run, manifest=None):
+        """
+        Copies files (as returned by _files_left_to_copy) to the dst_path folder,
+        using put if local_to_hdfs and get otherwise. Each file is copied to
+        dst_path joined with its key, whose folders must exist.
+        Files are grouped by destination folder in batches of at most batch_size
+        files and bounded command length, and batches are run by a pool of
+        workers threads.
+        A failing batch (whatever the error, e.g. a WebHDFS connection reset)
+        is logged and doesn't stop the others.
+        Files of successful batches are recorded as copied in manifest, if any.
+        Returns the number of bytes copied, 0 if dry_run.
+        """
+        copy = Hdfs.put if local_to_hdfs else Hdfs.get
+        files_by_path = {f['path']: f for f in files.values()}
+        files_by_dir = OrderedDict()
+        # Biggest files first, so that a big file doesn't end up
+        # being copied alone at the end.
+        for name in sorted(files, key=lambda n: files[n]['file_size'], reverse=True):
+            target_dir = os.path.dirname(os.path.join(dst_path, name))
+            files_by_dir.setdefault(target_dir, []).append(files[name]['path'])
+        batches = []
+        batch_size = max(batch_size, 1)
+        for target_dir, paths in files_by_dir.items():
+            for i in range(0, len(paths), batch_size):
+                batches += [(chunk, target_dir) for chunk in chunk_arguments(paths[i:i + batch_size])]
+
+        def copy_batch(batch, target_dir):
+            logger.info('Copying {} to {}'.format(', '.join(batch), target_dir))
+            if dry_run:
+                return 0
+            copy(batch, target_dir)
+            if manifest is not None:
+                manifest.record([files_by_path[path] for path in batch], RsyncManifest.COPIED)
+            return sum(files_by_path[path]['file_size'] for path in batch)
+
+        logger.info('Copying {} files in {} batches using {} workers ...'.format(
+            len(files), len(batches), workers))
+        start = time.monotonic()
+        copied_bytes, failed_batches = 0, 0
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = [executor.submit(copy_batch, batch, target_dir) for batch, target_dir in batches]
+            for future in as_completed(futures):
+                try:
+                    copied_bytes += future.result()
+                except Exception:
+                    failed_batches += 1
+                    logger.exception('Copy batch failed')
+        if dry_run:
+            return copied_bytes
+        elapsed = max(time.monotonic() - start, 0.001)
+        logger.info('Copied {} bytes in {:.1f}s ({:.2f} MB/s), {} failed batches out of {}'.format(
+            copied_bytes, elapsed, copied_bytes / elapsed / 1024 / 1024, failed_batches, len(batches)))
+        return copied_bytes
+
+    @staticmethod
+    def _create_dirs(paths, local_to_hdfs, dry_run):
+        """
+        Creates the given destination folders (with their parents), on HDFS
+        if local_to_hdfs and locally otherwise.
+        """
+        if not paths:
+            return
+        logger.info('Creating {} folders'.format(len(paths)))
+        if dry_run:
+            return
+        if local_to_hdfs:
+            Hdfs.mkdir(paths, create_parent=True)
+        else:
+            for path in paths:
+                os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def _verify_copied_files(copied_files, dst_path, local_to_hdfs, manifest, checksum=False):
+        """
+        Checks that copied_files (as returned by _files_left_to_copy) are present
+        in the dst_path folder with the right type and size (and checksum if
+        checksum is True), recording each of them as verified or failed in manifest.
+        Returns the files that failed verification, keyed by name.
+        """
+        dst_paths = [os.path.join(dst_path, name) for name in copied_files]
+        if local_to_hdfs:
+            dst_files = {f.path: {'file_size': f.size, 'file_type': f.file_type.value}
+                         for f in Hdfs.iter_ls(dst_paths, include_children=False)}
+        else:
+            dst_files = Hdfs._get_local_files_by_path(dst_paths)
+
+        verified, failed = {}, {}
+        for name, src_file in copied_files.items():
+            dst_file = dst_files.get(os.path.join(dst_path, name))
+            if (dst_file is not None and
+                    dst_file['file_type'] == src_file['file_type'] and
+                    (dst_file['file_type'] == 'd' or
+                        dst_file['file_size'] == src_file['file_size'])):
+                verified[name] = (src_file, dict(dst_file, path=os.path.join(dst_path, name)))
+            else:
+                failed[name] = src_file
+        if checksum:
+            for name in Hdfs._different_checksums(verified, local_to_hdfs):
+                failed[name] = verified.pop(name)[0]
+        verified = [src_file for src_file, dst_file in verified.values()]
+        manifest.record(verified, RsyncManifest.VERIFIED)
+        manifest.record(list(failed.values()), RsyncManifest.FAILED)
+        return failed
+
     @staticmethod
     def _check_local_dir(local_path):
         """
         Returns True if given parameter is an existing local directory
         """
         if not os.path.isdir(local_path):
-            logger.error('Local destination folder ' + local_path +
+            logger.error('Local folder ' + local_path +
                          ' either doesn\'t exists or is not a directory')
             return False
         return True
@@ -289,14 +1406,15 @@ class Hdfs(object):
         """
         output_details = Hdfs.ls(hdfs_path, include_children=False, with_details=True)
         if not output_details or output_details[0]['file_type'] != 'd':
-            logger.error('HDFS destination folder ' + hdfs_path +
+            logger.error('HDFS folder ' + hdfs_path +
                          ' either doesn\'t exists or is not a directory')
             return False
         return True
 
     @staticmethod
     def _files_left_to_copy(local_path, hdfs_path, local_to_hdfs,
-                            should_delete, dry_run):
+                            should_delete, dry_run, manifest=None, recursive=False,
+                            checksum=False):
         """
         Builds the list of files to copy from source to destination.
         List files from source and destination and return only files
@@ -305,24 +1423,49 @@ class Hdfs(object):
         and destination. In case of a difference, destination file is overwritten.
         In case a file exists in destination folder but not in source, it is
         delete id should_delete is True, kept otherwise.
+        Source files verified in manifest, if any, are neither compared nor copied,
+        and the destination isn't listed at all if all of them are (unless
+        should_delete). Their destination is trusted: see RsyncManifest.
+        If checksum, files of same type and size are also compared by checksum.
+        If recursive, source and destination folders are listed recursively,
+        files being keyed by their relative path instead of their name.
         """
         logger.info('Building lists of files to rsync from {} to {}'.format(
             local_path if local_to_hdfs else hdfs_path,
             hdfs_path if local_to_hdfs else local_path))
 
-        # Get hdfs files
-        hdfs_files = Hdfs._get_hdfs_files(hdfs_path)
+        def list_hdfs():
+            if recursive:
+                return Hdfs._get_hdfs_tree(hdfs_path)
+            return Hdfs._get_hdfs_files(hdfs_path)
 
-        # Get local files using local_path as a glob except if it is a folder
-        local_glob = os.path.join(local_path, '*') if os.path.isdir(local_path) else local_path
-        local_files = Hdfs._get_local_files(local_glob)
+        def list_local():
+            if recursive:
+                return Hdfs._get_local_tree(local_path)
+            # Get local files using local_path as a glob except if it is a folder
+            local_glob = os.path.join(local_path, '*') if os.path.isdir(local_path) else local_path
+            return Hdfs._get_local_files(local_glob)
 
-        if local_to_hdfs:
-            (src_files, dst_files) = (local_files, hdfs_files)
-            rm = Hdfs.rm
-        else:
-            (src_files, dst_files) = (hdfs_files, local_files)
-            rm = os.remove
+        (list_src, list_dst) = (list_local, list_hdfs) if local_to_hdfs else (list_hdfs, list_local)
+        src_files = list_src()
+
+        verified = []
+        if manifest is not None:
+            verified = [name for name, f in src_files.items() if manifest.is_verified(f)]
+            if verified:
+                logger.info('Skipping {} files verified by a previous run'.format(len(verified)))
+            if len(verified) == len(src_files) and not should_delete:
+                # Nothing to compare the destination to.
+                return {}
+
+        dst_files = list_dst()
+        for name in verified:
+            src_files.pop(name)
+            dst_files.pop(name, None)
+
+        # Deletions are done at once after the comparison
+        paths_to_delete = []
+        matching_files = {}
 
         for existing_file in dst_files:
             dst_file = dst_files[existing_file]
@@ -333,54 +1476,169 @@ class Hdfs(object):
                 if (dst_file['file_type'] == src_file['file_type'] and
                         (dst_file['file_type'] == 'd' or
                             dst_file['file_size'] == src_file['file_size'])):
-                    src_files.pop(existing_file, None)
+                    matching_files[existing_file] = (src_files.pop(existing_file), dst_file)
                 # Corrupted file - delete if should_delete or raise error
                 else:
                     logger.info('Deleting {} '.format(dst_files[existing_file]['path']) +
                                 'for being different from its source conterpart ' +
                                 '(incorrect file type or size)')
-                    if not dry_run:
-                        rm(dst_files[existing_file]['path'])
+                    paths_to_delete.append(dst_files[existing_file]['path'])
             # file not present in to_be_imported list, delete if should_delete
             elif should_delete:
                 logger.info('Deleting {} '.format(dst_files[existing_file]['path']) +
                             'for not being in the import list')
-                if not dry_run:
-                    rm(dst_files[existing_file]['path'])
+                paths_to_delete.append(dst_files[existing_file]['path'])
             else:
                 logger.info('File {} '.format(dst_files[existing_file]['path']) +
                             'is not in the import list')
 
+        if checksum:
+            for name in Hdfs._different_checksums(matching_files, local_to_hdfs):
+                src_file, dst_file = matching_files.pop(name)
+                logger.info('Deleting {} '.format(dst_file['path']) +
+                            'for being different from its source conterpart ' +
+                            '(incorrect checksum)')
+                paths_to_delete.append(dst_file['path'])
+                src_files[name] = src_file
+
+        if recursive:
+            # Folders content is deleted with them: sorted by path
+            # components, descendants directly follow their folder.
+            kept_paths = []
+            for path in sorted(paths_to_delete, key=lambda p: p.split('/')):
+                if not kept_paths or not is_same_or_parent(kept_paths[-1], path):
+                    kept_paths.append(path)
+            paths_to_delete = kept_paths
+
+        if paths_to_delete and not dry_run:
+            if local_to_hdfs:
+                Hdfs.rm(paths_to_delete)
+            else:
+                for path in paths_to_delete:
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+
+        if manifest is not None:
+            manifest.record([src_file for src_file, dst_file in matching_files.values()],
+                            RsyncManifest.VERIFIED)
+
         return src_files
 
+    @staticmethod
+    def _different_checksums(file_pairs, local_to_hdfs):
+        """
+        Compares the checksums of files of a dictionnary of (src_file, dst_file)
+        values (as returned by _get_local_files and _get_hdfs_files), fetching
+        the HDFS ones at once and computing the local ones.
+        Returns the keys of the pairs of regular files whose checksums differ.
+        HDFS checksums that can't be computed locally (not COMPOSITE_CRC ones)
+        are ignored with a warning, their files being only compared by size.
+        """
+        file_pairs = {name: pair for name, pair in file_pairs.items() if pair[0]['file_type'] == 'f'}
+        if not file_pairs:
+            return []
+        logger.info('Comparing checksums of {} files'.format(len(file_pairs)))
+        hdfs_index, local_index = (1, 0) if local_to_hdfs else (0, 1)
+        hdfs_checksums = Hdfs.checksum([pair[hdfs_index]['path'] for pair in file_pairs.values()])
+        different = []
+        unsupported = set()
+        for name, pair in sorted(file_pairs.items()):
+            hdfs_checksum = hdfs_checksums[pair[hdfs_index]['path']]
+            if hdfs_checksum is not None and hdfs_checksum['algorithm'] not in CRC_FUNCTIONS:
+                unsupported.add(hdfs_checksum['algorithm'])
+            elif (hdfs_checksum is None or
+                    file_checksum(pair[local_index]['path'], hdfs_checksum['algorithm']) != hdfs_checksum):
+                different.append(name)
+        if unsupported:
+            logger.warning('HDFS checksums of algorithm {} can\'t be compared to local files, '
+                           'these files were only compared by size (is dfs.checksum.combine.mode '
+                           'set to COMPOSITE_CRC?)'.format(', '.join(sorted(unsupported))))
+        return different
+
     @staticmethod
     def _get_hdfs_files(hdfs_path):
         """
         List HDFS-files in path/glob parameter.
         Return a dictionnary keyed by filename and having dictionnary values
-        of {'path', 'file_type', 'file_size'} (same as _get_local_files)
+        of {'path', 'file_type', 'file_size', 'mtime'} (same as _get_local_files)
         """
         hdfs_files = {}
         # HDFS-ls works with path and globs
-        for f in Hdfs.ls(hdfs_path, with_details=True):
-            path = f['path']
-            file_size = int(f['file_size'])
-            file_type = f['file_type']
-            fname = os.path.basename(path)
-            hdfs_files[fname] = {'path': path, 'file_size': file_size, 'file_type': file_type}
+        for f in Hdfs.iter_ls(hdfs_path):
+            fname = os.path.basename(f.path)
+            hdfs_files[fname] = {'path': f.path, 'file_size': f.size,
+                                 'file_type': f.file_type.value, 'mtime': f.mtime}
+        return hdfs_files
+
+    @staticmethod
+    def _get_hdfs_tree(hdfs_path):
+        """
+        Recursively list the HDFS folder hdfs_path with a single listing.
+        Return a dictionnary keyed by path relative to hdfs_path, with the
+        same values as _get_hdfs_files.
+        """
+        hdfs_files = {}
+        root = hdfs_path.rstrip('/') + '/'
+        for f in Hdfs.iter_ls(hdfs_path, recursive=True):
+            hdfs_files[f.path[len(root):]] = {'path': f.path, 'file_size': f.size,
+                                              'file_type': f.file_type.value, 'mtime': f.mtime}
         return hdfs_files
 
+    @staticmethod
+    def _get_local_tree(local_path):
+        """
+        Recursively list the local folder local_path using os.scandir.
+        Return a dictionnary keyed by path relative to local_path, with the
+        same values as _get_local_files.
+        """
+        local_files = {}
+        folders = [(local_path, '')]
+        while folders:
+            (folder, relative_folder) = folders.pop()
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    relative_path = relative_folder + entry.name
+                    stat = entry.stat()
+                    is_dir = entry.is_dir()
+                    local_files[relative_path] = {
+                        'path': entry.path, 'file_size': 0 if is_dir else stat.st_size,
+                        'file_type': 'd' if is_dir else 'f', 'mtime': int(stat.st_mtime)}
+                    if is_dir and not entry.is_symlink():
+                        folders.append((entry.path, relative_path + '/'))
+        return local_files
+
     @staticmethod
     def _get_local_files(local_glob):
         """
         List local-files in path/glob parameter.
         Return a dictionnary keyed by filename and having dictionnary values
-        of {'path', 'file_type', 'file_size'} (same as _get_hdfs_files)
+        of {'path', 'file_type', 'file_size', 'mtime'} (same as _get_hdfs_files)
+        """
+        return Hdfs._get_local_files_from_paths(glob.glob(local_glob))
+
+    @staticmethod
+    def _get_local_files_from_paths(paths):
+        """
+        Same as _get_local_files for a list of paths, missing ones being ignored.
+        """
+        return {os.path.basename(path): local_file
+                for path, local_file in Hdfs._get_local_files_by_path(paths).items()}
+
+    @staticmethod
+    def _get_local_files_by_path(paths):
+        """
+        Same as _get_local_files_from_paths, but keyed by path: paths of
+        different folders can share their name.
         """
         local_files = {}
-        for f in glob.glob(local_glob):
-            fname = os.path.basename(f)
-            file_size = os.path.getsize(f)
+        for f in paths:
+            try:
+                stat = os.stat(f)
+            except FileNotFoundError:
+                continue
             file_type = 'd' if os.path.isdir(f) else 'f'
-            local_files[fname] = {'path': f, 'file_size': file_size, 'file_type': file_type}
+            local_files[f] = {'path': f, 'file_size': stat.st_size,
+                              'file_type': file_type, 'mtime': int(stat.st_mtime)}
         return local_files
@@ -20,34 +20,74 @@ See util.py, hdfs.py, druid.py in the same folder
 """
 
 from collections import defaultdict, OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dateutil import parser
 import datetime
+import functools
+import itertools
 import logging
 import os
 import re
+import sys
 import tempfile
+import uuid
 
 from urllib.parse import urlparse
+from refinery.hdfs import Hdfs
+from refinery.hive_metastore import metastore_backend_from_environment
+from refinery.partition_catalog import partition_catalog_from_environment
 from refinery.util import sh
 
 
 logger = logging.getLogger('hive-util')
 
 
+# Hive variable set before each statement of a prefetch script, and printed
+# back with SET to delimit the output of the statement, see Hive.prefetch.
+PREFETCH_MARKER_VARIABLE = 'refinery.prefetch.marker'
+
+# Maximum size in characters of a single ALTER TABLE DROP PARTITION
+# statement, and of a script of such statements run in one Hive session.
+DROP_PARTITIONS_MAX_STATEMENT_SIZE = 16 * 1024
+DROP_PARTITIONS_MAX_SCRIPT_SIZE = 256 * 1024
+
+# A key, comparator and value literal of a partition spec, e.g. `year`<=2022
+partition_spec_clause_regex = re.compile(r'^\s*`?(\w+)`?\s*(<=|>=|<>|!=|=|<|>)\s*(.*?)\s*$')
+
+
 class Hive(object):
     """
     A convience object for running hive queries via the Hive CLI.
     Most of the methods here work with table and partition DDL.
 
+    If a metastore backend is given (or configured through the
+    REFINERY_HIVE_CONFIG environment variable, see refinery.hive_metastore),
+    tables, table metadata and partitions are read from it instead of
+    launching the Hive CLI. Other queries are still run through the Hive CLI.
+    Partitions read from the metastore can also be kept in an on-disk
+    catalog refreshed incrementally, see refinery.partition_catalog.
+
     Parameters:
         database    : The Hive database name to use
         options     : Other options to be passed directly to the Hive CLI.
+        metastore   : A HiveMetastoreBackend, by default the one configured
+                      by the environment if any.
+        catalog     : A PartitionCatalog (needing a metastore), by default the
+                      one configured by the environment if any.
     """
 
     partition_desc_separator = '/'
     partition_spec_separator = ','
 
-    def __init__(self, database='default', options=''):
+    # Statement fetching each kind of table information cached in self.tables
+    prefetch_statements = {
+        'metadata': 'DESCRIBE FORMATTED {0};',
+        'partitions': 'SHOW PARTITIONS {0};',
+        'schema': 'SHOW CREATE TABLE {0};',
+    }
+
+    def __init__(self, database='default', options='', metastore=None, catalog=None):
         self.database   = database
         if options:
             self.options    = options.split()
@@ -56,9 +96,15 @@ class Hive(object):
 
         self.hivecmd = ['hive'] + self.options + ['--service', 'cli', '--database', self.database]
         self.tables  = {}
+        self.metastore = metastore if metastore is not None else metastore_backend_from_environment()
+        self.catalog = catalog if catalog is not None else partition_catalog_from_environment()
+        if self.catalog is not None and self.metastore is None:
+            raise ValueError('A partition catalog can only be used with a Hive metastore backend')
 
     def _tables_get(self):
         """Returns a list of tables in the current database"""
+        if self.metastore is not None:
+            return self.metastore.tables(self.database)
         return self.query('SET hive.cli.print.header=false; SHOW TABLES').splitlines()
 
     def _tables_init(self, force=False):
@@ -111,25 +157,48 @@ class Hive(object):
 
     def table_metadata(self, table):
         """
-        Parses the output of DESCRIBE FORMATTED and stores the
-        metadata as a dict in self.tables[table]['metadata'].
+        Parses the output of DESCRIBE FORMATTED (or reads the metastore)
+        and stores the metadata as a dict in self.tables[table]['metadata'].
         """
         self._tables_init()
 
+        if 'metadata' not in self.tables[table].keys() and self.metastore is not None:
+            self.tables[table]['metadata'] = self.metastore.table_metadata(self.database, table)
+
         if 'metadata' not in self.tables[table].keys():
-            self.tables[table]['metadata'] = {}
             q = 'SET hive.cli.print.header=false; DESCRIBE FORMATTED {0};'.format(table)
-            for line in self.query(q).splitlines():
-                try:
-                    key, value = line.split(':', 1)
-                    if value:
-                        self.tables[table]['metadata'][key.strip()] = value.strip()
-                except ValueError:
-                    # not at least two elements in line
-                    pass
+            self.tables[table]['metadata'] = self._metadata_from_describe(self.query(q))
 
         return self.tables[table]['metadata']
 
+    @staticmethod
+    def _metadata_from_describe(output):
+        """
+        Returns the key: value pairs of DESCRIBE FORMATTED output as a dict,
+        with the partition key names of the Partition Information section
+        as a list in 'Partition Keys'.
+        """
+        metadata = {'Partition Keys': []}
+        in_partition_information = False
+        for line in output.splitlines():
+            if line.startswith('#'):
+                in_partition_information = (
+                    line.startswith('# Partition Information') or
+                    (in_partition_information and line.startswith('# col_name')))
+                continue
+            if in_partition_information:
+                if line.strip():
+                    metadata['Partition Keys'].append(line.split()[0])
+                continue
+            try:
+                key, value = line.split(':', 1)
+                if value:
+                    metadata[key.strip()] = value.strip()
+            except ValueError:
+                # not at least two elements in line
+                pass
+        return metadata
+
     def table_location(self, table, strip_nameservice=False):
         """Returns the table's base location by looking at the table's CREATE schema."""
         self._tables_init()
@@ -153,7 +222,12 @@ class Hive(object):
         # Cache results for later.
         # If we don't know the partitions yet, get them now.
         if 'partitions' not in self.tables[table].keys():
-            partition_descs = self.query('SET hive.cli.print.header=false; SHOW PARTITIONS {0};'.format(table)).splitlines()
+            if self.catalog is not None:
+                partition_descs = [desc for desc, _ in self.catalog.partitions(self.metastore, self.database, table)]
+            elif self.metastore is not None:
+                partition_descs = [desc for desc, _ in self.metastore.partitions(self.database, table)]
+            else:
+                partition_descs = self.query('SET hive.cli.print.header=false; SHOW PARTITIONS {0};'.format(table)).splitlines()
             # Convert the desc format to spec format and return that
             self.tables[table]['partitions'] = [
                 self.partition_spec_from_partition_desc(p)
@@ -162,29 +236,261 @@ class Hive(object):
 
         return self.tables[table]['partitions']
 
-    def partitions(self, table):
+    def prefetch(self, tables, what=('metadata', 'partitions')):
+        """
+        Fetches and caches in self.tables the given information of all tables
+        at once, running a single Hive script instead of one Hive CLI
+        invocation per table and information. Information already cached
+        is not fetched again, and tables not in the database are ignored.
+
+        The output of each statement of the script is preceded by the value
+        of a Hive variable, set and printed with SET just before the statement,
+        made of a random token and of the table and information fetched.
+
+        Parameters:
+            tables : List of table names.
+            what   : Information to fetch, among metadata, partitions and schema.
+        """
+        unknown = set(what) - set(Hive.prefetch_statements)
+        if unknown:
+            raise ValueError('Cannot prefetch {0}'.format(', '.join(sorted(unknown))))
+        self._tables_init()
+
+        missing = [
+            (table, kind) for table in tables if table in self.tables
+            for kind in sorted(what) if kind not in self.tables[table]
+        ]
+        if not missing:
+            return
+        if self.metastore is not None:
+            # No Hive CLI is launched: the information is read table by table.
+            fetchers = {'metadata': self.table_metadata, 'partitions': self.partition_specs,
+                        'schema': self.table_schema}
+            for table, kind in missing:
+                fetchers[kind](table)
+            return
+
+        token = uuid.uuid4().hex
+        statements = ['SET hive.cli.print.header=false;']
+        for table, kind in missing:
+            statements += [
+                'SET {0}={1}:{2}:{3};'.format(PREFETCH_MARKER_VARIABLE, token, kind, table),
+                'SET {0};'.format(PREFETCH_MARKER_VARIABLE),
+                Hive.prefetch_statements[kind].format(table),
+            ]
+        logger.debug('Prefetching {0} of {1} tables.'.format(', '.join(sorted(what)), len(tables)))
+        out = self.query('\n'.join(statements), use_tempfile=True)
+
+        marker_prefix = '{0}={1}:'.format(PREFETCH_MARKER_VARIABLE, token)
+        outputs = {}
+        current = None
+        for line in out.splitlines():
+            if line.startswith(marker_prefix):
+                current = tuple(line[len(marker_prefix):].split(':', 1))
+                outputs[current] = []
+            elif current is not None:
+                outputs[current].append(line)
+
+        for (kind, table), lines in outputs.items():
+            if kind == 'metadata':
+                self.tables[table]['metadata'] = self._metadata_from_describe('\n'.join(lines))
+            elif kind == 'partitions':
+                self.tables[table]['partitions'] = [
+                    self.partition_spec_from_partition_desc(p) for p in lines if p]
+            else:
+                self.tables[table]['schema'] = '\n'.join(lines).strip()
+
+    def partition_keys(self, table):
+        """Returns the list of the partition key names of table, in order."""
+        return self.table_metadata(table).get('Partition Keys', [])
+
+    def partitions_from_layout(self, table, workers=1):
+        """
+        Returns a list of HivePartitions for the given Hive table, built from the
+        key=value/... partition directories found under the table location
+        instead of asking Hive. Directories not following the layout of the
+        table partition keys are ignored.
+
+        Parameters:
+            table   : The Hive table name.
+            workers : Number of directory listings run in parallel, see Hdfs.walk.
+
+        Returns:
+            A list of HivePartition dicts, sorted by partition desc.
+        """
+        keys = self.partition_keys(table)
+        if not keys:
+            return []
+        location = self.table_location(table, strip_nameservice=True).rstrip('/')
+
+        def layout_dirs(status):
+            # Returns the partition directory names from location to status.
+            return status.path[len(location):].strip('/').split('/')
+
+        def prune(status):
+            dirs = layout_dirs(status)
+            return not dirs[-1].startswith(keys[len(dirs) - 1] + '=')
+
+        partitions = []
+        for status in Hdfs.walk(location, max_depth=len(keys), prune=prune, workers=workers):
+            dirs = layout_dirs(status)
+            if (status.is_directory() and len(dirs) == len(keys) and
+                    all(d.startswith(key + '=') for d, key in zip(dirs, keys))):
+                partitions.append(HivePartition(HivePartition.desc_separator.join(dirs)))
+        return sorted(partitions, key=lambda p: p.desc())
+
+    def partitions_layout_diff(self, table, workers=1):
+        """
+        Compares the partitions known by Hive for the given table with the ones
+        found in its location by partitions_from_layout.
+        Partitions located outside of the table layout are reported as dangling.
+
+        Returns:
+            A tuple (orphan_directories, dangling_partitions) of HivePartition
+            lists, the first ones having a directory but no Hive partition,
+            the second ones a Hive partition but no directory.
+        """
+        in_layout = dict((p.desc(), p) for p in self.partitions_from_layout(table, workers))
+        in_hive = dict((p.desc(), p) for p in self.partitions(table))
+        return (
+            [in_layout[desc] for desc in sorted(set(in_layout) - set(in_hive))],
+            [in_hive[desc] for desc in sorted(set(in_hive) - set(in_layout))],
+        )
+
+    def partitions(self, table, compact=False):
         """
         Returns a list of HivePartitions for the given Hive table.
 
+        Parameters:
+            table   : The Hive table name.
+            compact : If True, returns CompactHivePartitions instead, using
+                      much less memory. Being immutable, they are cached and
+                      shared by subsequent calls.
+
         Returns:
             A list of HivePartition dicts
         """
 
         # Cache results for later.
         # If we don't know the partitions yet, get them now.
-        return [HivePartition(p) for p in self.partition_specs(table)]
-
-    def drop_partitions(self, table, partition_specs):
+        partition_specs = self.partition_specs(table)
+        if not compact:
+            return [HivePartition(p) for p in partition_specs]
+        if 'compact_partitions' not in self.tables[table].keys():
+            self.tables[table]['compact_partitions'] = [CompactHivePartition(p) for p in partition_specs]
+        return list(self.tables[table]['compact_partitions'])
+
+    def drop_partitions(self, table, partition_specs, compress=False, workers=1,
+                        max_statement_size=DROP_PARTITIONS_MAX_STATEMENT_SIZE,
+                        max_script_size=DROP_PARTITIONS_MAX_SCRIPT_SIZE):
         """
-        Runs ALTER TABLE table DROP PARTITION ... for each of the partition_specs.
+        Runs ALTER TABLE table DROP PARTITION ... for the partition_specs,
+        using the scripts planned by drop_partitions_scripts. Scripts are
+        run in at most workers parallel Hive sessions, and a RuntimeError is
+        raised once they are all done if any of them failed.
+
+        Returns:
+            The concatenated stdout of the scripts.
         """
-        if partition_specs:
-            q = self.drop_partitions_ddl(table, partition_specs)
+        if not partition_specs:
+            logger.info("Not dropping any partitions for table {0}.  No partition datetimes were given.".format(table))
+            return
+
+        scripts = self.drop_partitions_scripts(
+            table, partition_specs, compress, max_statement_size, max_script_size)
+        outputs = [None] * len(scripts)
+        failures = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
             # This query could be large if there are many partiitons to drop.
             # Use a tempfile when dropping partitions.
-            return self.query(q, use_tempfile=True)
-        else:
-            logger.info("Not dropping any partitions for table {0}.  No partition datetimes were given.".format(table))
+            futures = dict(
+                (executor.submit(self.query, script, use_tempfile=True), i)
+                for i, script in enumerate(scripts)
+            )
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    outputs[futures[future]] = future.result()
+                except Exception:
+                    logger.exception('ERROR dropping partitions of {0}'.format(table))
+                    failures += 1
+                logger.info('Ran {0}/{1} scripts dropping partitions of {2}'.format(done, len(scripts), table))
+
+        # Partitions are fetched again when next needed.
+        self.tables.get(table, {}).pop('partitions', None)
+        self.tables.get(table, {}).pop('compact_partitions', None)
+        if failures:
+            raise RuntimeError('{0} of the {1} scripts dropping partitions of {2} failed'.format(
+                failures, len(scripts), table))
+        return '\n'.join(outputs)
+
+    def drop_partitions_scripts(self, table, partition_specs, compress=False,
+                                max_statement_size=DROP_PARTITIONS_MAX_STATEMENT_SIZE,
+                                max_script_size=DROP_PARTITIONS_MAX_SCRIPT_SIZE):
+        """
+        Returns the list of Hive scripts dropping partition_specs from table.
+        Each script is at most max_script_size characters, and is made of
+        ALTER TABLE DROP PARTITION statements of at most max_statement_size
+        characters, each dropping as many partitions as fit.
+
+        If compress is True, the specs are first compressed against the
+        current partitions of the table, see compress_partition_specs. The
+        resulting ranges also drop the partitions they match that are added
+        after the table partitions were listed: only compress specs of
+        partitions no job is adding anymore (e.g. old ones).
+        """
+        if compress:
+            partition_specs = Hive.compress_partition_specs(partition_specs, self.partition_specs(table))
+
+        prefix = 'ALTER TABLE {0} DROP IF EXISTS '.format(table)
+        statements, clauses = [], []
+        for spec in sorted(partition_specs):
+            clause = 'PARTITION ({0})'.format(spec)
+            if clauses and len(prefix) + len(', '.join(clauses + [clause])) + 1 > max_statement_size:
+                statements.append(prefix + ', '.join(clauses) + ';')
+                clauses = []
+            clauses.append(clause)
+        if clauses:
+            statements.append(prefix + ', '.join(clauses) + ';')
+
+        scripts, script = [], []
+        for statement in statements:
+            if script and len('\n'.join(script + [statement])) > max_script_size:
+                scripts.append('\n'.join(script))
+                script = []
+            script.append(statement)
+        if script:
+            scripts.append('\n'.join(script))
+        return scripts
+
+    @staticmethod
+    def compress_partition_specs(partition_specs, existing_specs):
+        """
+        Returns a list of partition specs dropping the same partitions as
+        partition_specs, given the existing_specs of the table, using as few
+        specs as possible:
+          - a spec with a partial key prefix stands for all the partitions
+            under it when they are all dropped, e.g. `year`=2022,
+          - the first values of a key (in Hive comparison order) all of whose
+            partitions are dropped are grouped in a range, e.g. `year`<=2022
+            or `year`=2023,`month`<=4.
+        Specs using other comparators than = are kept as is, and all the
+        specs are kept as is if partitions don't have the same keys.
+        """
+        parsed = []
+        kept = []
+        for spec in partition_specs:
+            clauses = _parse_partition_spec(spec)
+            if clauses is None:
+                kept.append(spec)
+            else:
+                parsed.append(clauses)
+        existing = [_parse_partition_spec(spec) for spec in existing_specs]
+
+        keys = set(tuple(k for k, _ in p) for p in parsed + existing if p is not None)
+        if not parsed or len(keys) != 1 or None in existing:
+            return list(partition_specs)
+        compressed = _compress_partitions(set(parsed), set(existing), 0, [])
+        return kept + [Hive.partition_spec_separator.join(clauses) for clauses in compressed]
 
     def drop_partitions_ddl(self, table, partition_specs):
         """
@@ -367,6 +673,144 @@ class Hive(object):
         return sh(cmd, check_return_code)
 
 
+def _parse_partition_spec(spec):
+    """
+    Returns the tuple of (key, value literal) of a spec made only of key=value
+    clauses (e.g. `year`=2023,`month`=5 or webrequest_source='text'), None
+    if it has other comparators.
+    """
+    clauses = []
+    for clause in spec.split(Hive.partition_spec_separator):
+        match = partition_spec_clause_regex.match(clause)
+        if match is None or match.group(2) != '=':
+            return None
+        clauses.append((match.group(1), match.group(3)))
+    return tuple(clauses)
+
+
+def _literal_sort_key(literals):
+    """
+    Returns the function sorting value literals the way Hive compares them:
+    as numbers if they all are integers, as strings otherwise.
+    """
+    if all(literal.isdigit() for literal in literals):
+        return int
+    return lambda literal: literal.strip('\'"')
+
+
+def _compress_partitions(drop, existing, depth, prefix):
+    """
+    Returns lists of spec clauses dropping the partitions in drop, sharing
+    the clauses of prefix for their depth first keys, see
+    Hive.compress_partition_specs.
+    """
+    key = next(iter(drop))[depth][0]
+    drop_by_value, existing_by_value = defaultdict(set), defaultdict(set)
+    for partition in drop:
+        drop_by_value[partition[depth][1]].add(partition)
+    for partition in existing:
+        existing_by_value[partition[depth][1]].add(partition)
+
+    def fully_dropped(value):
+        return value in drop_by_value and existing_by_value[value] <= drop_by_value[value]
+
+    values = set(drop_by_value) | set(existing_by_value)
+    values = sorted(values, key=_literal_sort_key(values))
+    first_values = list(itertools.takewhile(fully_dropped, values))
+
+    clauses = []
+    if len(first_values) > 1:
+        clauses.append(prefix + ['`{0}`<={1}'.format(key, first_values[-1])])
+        values = values[len(first_values):]
+    for value in values:
+        value_clauses = prefix + ['`{0}`={1}'.format(key, value)]
+        if fully_dropped(value):
+            clauses.append(value_clauses)
+        elif value in drop_by_value:
+            clauses += _compress_partitions(
+                drop_by_value[value], existing_by_value[value], depth + 1, value_clauses)
+    return clauses
+
+
+# Partition keys holding (part of) the partition datetime
+DATETIME_PARTITION_KEYS = frozenset(['snapshot', 'dt', 'date', 'year', 'month', 'day', 'hour', 'minute'])
+
+# Keys of partitions whose datetime is made of integer values, in order
+INTEGER_DATETIME_PARTITION_KEYS = ('year', 'month', 'day', 'hour')
+
+# Single keys whose value is a YYYY-MM[-DD] date, and the YYYY-MM-DD-HH hour key
+DATE_PARTITION_KEYS = frozenset(['snapshot', 'dt', 'date', 'day', 'month'])
+date_value_regex = re.compile(r'^(\d{4})-(\d{1,2})(?:-(\d{1,2}))?$')
+hour_value_regex = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})-(\d{1,2})$')
+
+
+def _fast_partition_datetime(items):
+    """
+    Returns the datetime of the partition datetime items if they follow one
+    of the supported schemes, None otherwise. Raises a ValueError if
+    values are out of range.
+    """
+    keys = tuple(k for k, _ in items)
+    values = [v for _, v in items]
+    if (keys and keys == INTEGER_DATETIME_PARTITION_KEYS[:len(keys)] and
+            len(values[0]) == 4 and all(v.isdigit() for v in values)):
+        # year=YYYY[/month=M[/day=D[/hour=H]]]
+        parts = [int(v) for v in values] + [1, 1, 0][len(values) - 1:]
+        return datetime.datetime(*parts)
+    if len(keys) == 1 and keys[0] in DATE_PARTITION_KEYS:
+        match = date_value_regex.match(values[0])
+        if match:
+            year, month, day = match.groups()
+            return datetime.datetime(int(year), int(month), int(day or 1))
+    if keys == ('hour',):
+        match = hour_value_regex.match(values[0])
+        if match:
+            return datetime.datetime(*[int(v) for v in match.groups()])
+    return None
+
+
+def _dateutil_partition_datetime(items):
+    """
+    Returns the datetime of the partition datetime items, joining their
+    values to be parsed by dateutil.
+    """
+    transformers = defaultdict(lambda: lambda x: x, {
+        # 2018-5-15-05 is valid, but 2018-5-15-5 is not.  Prefix with 0 to mak
+        # parser happy.
+        'hour': lambda hour: "%02d" % (int(hour))
+    })
+    values = [transformers[k](v) for k, v in items]
+
+    # the date parser also only likes things that are zero-prefixed.
+    # so
+    return parser.parse(
+        '-'.join(map(str, values)),
+        fuzzy=True,
+        default=datetime.datetime(2000, 1, 1, 0, 0)
+    )
+
+
+@functools.lru_cache(maxsize=65536)
+def partition_datetime(items):
+    """
+    Returns the datetime of a partition given the tuple of its (key, value)
+    items whose key is in DATETIME_PARTITION_KEYS, in order.
+
+    The supported schemes (see HivePartition.datetime) are parsed as
+    integers, other layouts falling back to dateutil's fuzzy parser.
+    Results are memoized: partitions sharing their datetime items (e.g.
+    the ones of a same hour in different datacenters) are parsed once.
+    """
+    try:
+        dt = _fast_partition_datetime(items)
+    except ValueError:
+        # Let dateutil make sense (or fail) of out of range values.
+        dt = None
+    if dt is None:
+        dt = _dateutil_partition_datetime(items)
+    return dt
+
+
 class HivePartition(OrderedDict):
     partition_regex          = re.compile(r'(\w+)=["\']?([\w\-.]+)["\']?')
     camus_regex              = re.compile(r'.*/hourly/(?P<year>\d+)\/(?P<month>\d+)\/(?P<day>\d+)\/(?P<hour>\d+)')
@@ -382,6 +826,13 @@ class HivePartition(OrderedDict):
     }
 
     def __init__(self, partition_string):
+        super(HivePartition, self).__init__(HivePartition.parse(partition_string))
+
+    @staticmethod
+    def parse(partition_string):
+        """
+        Returns the list of (key, value) of a partition desc, spec or path.
+        """
 
         # If we see an '=', assume this is a Hive style partition desc or spec.
         if '=' in partition_string:
@@ -401,7 +852,7 @@ class HivePartition(OrderedDict):
                     )
                 )
 
-        super(HivePartition, self).__init__(partitions)
+        return partitions
 
     def datetime(self):
         """
@@ -419,23 +870,11 @@ class HivePartition(OrderedDict):
         snapshot=YYYY-MM-DD    (represents the start of the week)
         snapshot=YYYY-MM       (represents the start of the month)
         ...
+
+        See partition_datetime.
         """
         # partitions can have non-datetime components
-        relevant_partition_keys = set(['snapshot', 'dt', 'date', 'year', 'month', 'day', 'hour', 'minute'])
-        transformers = defaultdict(lambda: lambda x: x, {
-            # 2018-5-15-05 is valid, but 2018-5-15-5 is not.  Prefix with 0 to mak
-            # parser happy.
-            'hour': lambda hour: "%02d" % (int(hour))
-        })
-        values = [transformers[k](self[k]) for k in self.keys() if k in relevant_partition_keys]
-
-        # the date parser also only likes things that are zero-prefixed.
-        # so
-        return parser.parse(
-            '-'.join(map(str, values)),
-            fuzzy=True,
-            default=datetime.datetime(2000, 1, 1, 0, 0)
-        )
+        return partition_datetime(tuple((k, self[k]) for k in self.keys() if k in DATETIME_PARTITION_KEYS))
 
     def list(self, hql=False):
         """
@@ -520,3 +959,92 @@ class HivePartition(OrderedDict):
                 return None
         else:
             return None
+
+
+@functools.total_ordering
+class CompactHivePartition(Mapping):
+    """
+    Immutable alternative to HivePartition, having the same methods but
+    using a fraction of its memory: keys and values are stored in two
+    interned tuples, the keys tuple being shared by all the partitions
+    of a table. Partitions are hashable, and ordered by values then keys
+    (as strings). Strings (spec, desc, path...) are only rendered on demand.
+    """
+    __slots__ = ('_keys', '_values', '_hash')
+
+    # Interned keys tuples, by keys
+    _keys_tuples = {}
+
+    def __init__(self, partition_string):
+        partitions = HivePartition.parse(partition_string)
+        self._set([k for k, _ in partitions], [v for _, v in partitions])
+
+    @classmethod
+    def from_items(cls, keys, values):
+        """Returns the CompactHivePartition having the given keys and values."""
+        partition = cls.__new__(cls)
+        partition._set(keys, values)
+        return partition
+
+    def _set(self, keys, values):
+        keys = tuple(keys)
+        keys_tuple = CompactHivePartition._keys_tuples.get(keys)
+        if keys_tuple is None:
+            keys_tuple = tuple(sys.intern(k) for k in keys)
+            CompactHivePartition._keys_tuples[keys_tuple] = keys_tuple
+        self._keys = keys_tuple
+        self._values = tuple(sys.intern(v) for v in values)
+        self._hash = None
+
+    def __getitem__(self, key):
+        try:
+            return self._values[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((self._keys, self._values))
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, CompactHivePartition):
+            return self._values == other._values and self._keys == other._keys
+        return Mapping.__eq__(self, other)
+
+    def __lt__(self, other):
+        if not isinstance(other, CompactHivePartition):
+            return NotImplemented
+        return (self._values, self._keys) < (other._values, other._keys)
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, self.desc())
+
+    def keys(self):
+        return self._keys
+
+    def values(self):
+        return self._values
+
+    def items(self):
+        return list(zip(self._keys, self._values))
+
+    # Rendering and datetime methods, only reading the partition as a mapping
+    datetime = HivePartition.datetime
+    list = HivePartition.list
+    desc = HivePartition.desc
+    spec = HivePartition.spec
+    path = HivePartition.path
+    camus_path = HivePartition.camus_path
+    glob = HivePartition.glob
+    contains_snapshot = HivePartition.contains_snapshot
+    snapshot_period = HivePartition.snapshot_period
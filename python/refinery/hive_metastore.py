@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Wikimedia Analytics Refinery python Hive metastore client.
+
+Reads table and partition metadata directly from the database backing the
+Hive metastore, through pooled DB-API connections, instead of launching
+the Hive CLI (and its JVM and session) for every query:
+
+    metastore = HiveMetastoreBackend.from_config({
+        'metastore.host': 'an-coord1001.eqiad.wmnet',
+        'metastore.user': 'hive',
+        'metastore.password_file': '/etc/hive/metastore-password',
+    })
+    hive = Hive('wmf', metastore=metastore)
+    hive.partition_specs('webrequest')  # No hive CLI launched
+
+Only reads go through the metastore database: DDL statements (dropping
+partitions for instance) are still run through Hive, so that Hive keeps
+handling locks, statistics and external table semantics.
+
+See hive.py in the same folder
+"""
+
+import functools
+import logging
+import os
+import queue
+
+from contextlib import contextmanager
+
+from refinery.util import read_properties_file
+
+
+logger = logging.getLogger('hive-metastore')
+
+
+# Environment variable containing the path of a properties file
+# configuring the Hive metastore backend, see HiveMetastoreBackend.from_config
+HIVE_CONFIG_ENV_VARIABLE = 'REFINERY_HIVE_CONFIG'
+
+# DB-API parameter markers, by paramstyle
+PARAMETER_MARKERS = {
+    'qmark': '?',
+    'format': '%s',
+    'pyformat': '%s',
+}
+
+
+class HiveMetastoreBackend(object):
+    """
+    Read-only client of the Hive metastore database (MySQL in production),
+    keeping a pool of open connections shared by threads.
+    Database, table and partition names are compared lowercased, as
+    stored by the metastore.
+
+    Parameters:
+        connect    : Function taking no argument and returning a new DB-API
+                     connection to the metastore database.
+        paramstyle : DB-API paramstyle of the driver, qmark or format.
+        pool_size  : Maximum number of idle connections kept open.
+    """
+
+    def __init__(self, connect, paramstyle='format', pool_size=4):
+        if paramstyle not in PARAMETER_MARKERS:
+            raise ValueError('Unsupported DB-API paramstyle {}'.format(paramstyle))
+        self._connect = connect
+        self._marker = PARAMETER_MARKERS[paramstyle]
+        self._pool = queue.LifoQueue(pool_size)
+
+    @staticmethod
+    def from_config(config):
+        """
+        Instanciates a HiveMetastoreBackend connecting to a MySQL metastore
+        database with pymysql, from a configuration dictionnary. Supported keys:
+
+            metastore.host          : Host of the metastore database (mandatory).
+            metastore.port          : Port of the metastore database (default: 3306).
+            metastore.database      : Name of the metastore database (default: hive_metastore).
+            metastore.user          : User to connect as.
+            metastore.password_file : File containing the password of user.
+            metastore.pool_size     : Maximum number of idle connections kept open.
+        """
+        if not config.get('metastore.host'):
+            raise ValueError('metastore.host is mandatory for the metastore hive backend')
+        try:
+            import pymysql
+        except ImportError:
+            raise RuntimeError('The metastore hive backend needs the pymysql package')
+
+        password = None
+        if config.get('metastore.password_file'):
+            with open(config['metastore.password_file']) as f:
+                password = f.read().strip()
+
+        def connect():
+            return pymysql.connect(
+                host=config['metastore.host'],
+                port=int(config.get('metastore.port', 3306)),
+                database=config.get('metastore.database', 'hive_metastore'),
+                user=config.get('metastore.user'),
+                password=password,
+                autocommit=True
+            )
+
+        return HiveMetastoreBackend(
+            connect, paramstyle=pymysql.paramstyle, pool_size=int(config.get('metastore.pool_size', 4)))
+
+    @contextmanager
+    def _cursor(self):
+        """
+        Yields a cursor of a pooled connection. Connections having raised
+        an error are closed instead of being given back to the pool.
+        """
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            connection = self._connect()
+        try:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+        except Exception:
+            connection.close()
+            raise
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _fetch(self, query, parameters):
+        logger.debug('Querying the Hive metastore with {} {}'.format(query, parameters))
+        with self._cursor() as cursor:
+            cursor.execute(query.format(p=self._marker), parameters)
+            return cursor.fetchall()
+
+    def close(self):
+        """Closes the pooled connections."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def tables(self, database):
+        """
+        Returns the sorted list of the table names of database.
+        """
+        rows = self._fetch(
+            'SELECT t.TBL_NAME FROM TBLS t JOIN DBS d ON t.DB_ID = d.DB_ID '
+            'WHERE d.NAME = {p} ORDER BY t.TBL_NAME',
+            (database.lower(),))
+        return [row[0] for row in rows]
+
+    def table_metadata(self, database, table):
+        """
+        Returns the metadata of table as a dictionnary using the keys of
+        DESCRIBE FORMATTED output (Database, Owner, Location, Table Type,
+        InputFormat and OutputFormat), Table Parameters being a dictionnary,
+        and Partition Keys the ordered list of the partition key names.
+        Returns None if the table doesn't exist.
+        """
+        rows = self._fetch(
+            'SELECT t.TBL_ID, d.NAME, t.OWNER, s.LOCATION, t.TBL_TYPE, s.INPUT_FORMAT, s.OUTPUT_FORMAT '
+            'FROM TBLS t JOIN DBS d ON t.DB_ID = d.DB_ID LEFT JOIN SDS s ON t.SD_ID = s.SD_ID '
+            'WHERE d.NAME = {p} AND t.TBL_NAME = {p}',
+            (database.lower(), table.lower()))
+        if not rows:
+            return None
+        table_id, database_name, owner, location, table_type, input_format, output_format = rows[0]
+
+        parameters = self._fetch(
+            'SELECT PARAM_KEY, PARAM_VALUE FROM TABLE_PARAMS WHERE TBL_ID = {p}', (table_id,))
+        partition_keys = self._fetch(
+            'SELECT PKEY_NAME FROM PARTITION_KEYS WHERE TBL_ID = {p} ORDER BY INTEGER_IDX', (table_id,))
+        return {
+            'Database': database_name,
+            'Owner': owner,
+            'Location': location,
+            'Table Type': table_type,
+            'InputFormat': input_format,
+            'OutputFormat': output_format,
+            'Table Parameters': dict(parameters),
+            'Partition Keys': [row[0] for row in partition_keys],
+        }
+
+    def table_id(self, database, table):
+        """
+        Returns the metastore id of table, changing when the table is dropped
+        and created again, or None if the table doesn't exist.
+        """
+        rows = self._fetch(
+            'SELECT t.TBL_ID FROM TBLS t JOIN DBS d ON t.DB_ID = d.DB_ID '
+            'WHERE d.NAME = {p} AND t.TBL_NAME = {p}',
+            (database.lower(), table.lower()))
+        return rows[0][0] if rows else None
+
+    def partitions_after(self, table_id, partition_id=0):
+        """
+        Returns the partitions of the table with id table_id whose id is greater
+        than partition_id, as a list of (partition id, partition desc, location)
+        tuples sorted by id. Partition ids are increasing for a single metastore
+        instance, so these are mostly the partitions added since partition_id was
+        (several instances allocate ids by blocks, see PartitionCatalog.refresh).
+        """
+        return [tuple(row) for row in self._fetch(
+            'SELECT p.PART_ID, p.PART_NAME, s.LOCATION FROM PARTITIONS p '
+            'LEFT JOIN SDS s ON p.SD_ID = s.SD_ID '
+            'WHERE p.TBL_ID = {p} AND p.PART_ID > {p} ORDER BY p.PART_ID',
+            (table_id, partition_id))]
+
+    def partition_count(self, table_id):
+        """Returns the number of partitions of the table with id table_id."""
+        return self._fetch('SELECT COUNT(*) FROM PARTITIONS WHERE TBL_ID = {p}', (table_id,))[0][0]
+
+    def partition_ids(self, table_id):
+        """Returns the set of the partition ids of the table with id table_id."""
+        return set(row[0] for row in self._fetch(
+            'SELECT PART_ID FROM PARTITIONS WHERE TBL_ID = {p}', (table_id,)))
+
+    def partitions_by_ids(self, table_id, partition_ids, chunk_size=1000):
+        """
+        Returns the partitions of the table with id table_id whose id is in
+        partition_ids, like partitions_after, fetched chunk_size at a time.
+        """
+        partition_ids = sorted(partition_ids)
+        partitions = []
+        for start in range(0, len(partition_ids), chunk_size):
+            chunk = partition_ids[start:start + chunk_size]
+            partitions += [tuple(row) for row in self._fetch(
+                'SELECT p.PART_ID, p.PART_NAME, s.LOCATION FROM PARTITIONS p '
+                'LEFT JOIN SDS s ON p.SD_ID = s.SD_ID '
+                'WHERE p.TBL_ID = {{p}} AND p.PART_ID IN ({0}) ORDER BY p.PART_ID'.format(
+                    ', '.join(['{p}'] * len(chunk))),
+                (table_id,) + tuple(chunk))]
+        return partitions
+
+    def partitions(self, database, table):
+        """
+        Returns the partitions of table sorted by name, as a list of
+        (partition desc, location) tuples, partition descs being formatted
+        as in SHOW PARTITIONS output (e.g. year=2023/month=1).
+        """
+        return [tuple(row) for row in self._fetch(
+            'SELECT p.PART_NAME, s.LOCATION FROM PARTITIONS p '
+            'JOIN TBLS t ON p.TBL_ID = t.TBL_ID JOIN DBS d ON t.DB_ID = d.DB_ID '
+            'LEFT JOIN SDS s ON p.SD_ID = s.SD_ID '
+            'WHERE d.NAME = {p} AND t.TBL_NAME = {p} ORDER BY p.PART_NAME',
+            (database.lower(), table.lower()))]
+
+
+@functools.lru_cache(maxsize=None)
+def metastore_backend_from_environment():
+    """
+    Returns a HiveMetastoreBackend configured by the properties file whose
+    path is in the REFINERY_HIVE_CONFIG environment variable if its
+    hive.backend property is metastore, None otherwise (hive.backend
+    being cli by default). The backend is shared by the whole process.
+    """
+    config_file = os.environ.get(HIVE_CONFIG_ENV_VARIABLE)
+    config = read_properties_file(config_file) if config_file else {}
+    backend = config.get('hive.backend', 'cli')
+    if backend == 'cli':
+        return None
+    elif backend == 'metastore':
+        return HiveMetastoreBackend.from_config(config)
+    else:
+        raise ValueError('Unknown hive backend: {}'.format(backend))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Wikimedia Analytics Refinery python on-disk Hive partition catalog.
+
+Keeps the partitions of Hive tables in a local SQLite file, so that
+repeated runs of a job (e.g. a daily retention cron) only fetch from the
+Hive metastore the partitions added since the previous run:
+
+    catalog = PartitionCatalog('/var/cache/refinery/partitions.sqlite')
+    hive = Hive('wmf', metastore=metastore, catalog=catalog)
+    hive.partition_specs('webrequest')
+
+Metastore partition ids are increasing, so new partitions are mostly the
+ones having an id greater than the greatest one in the catalog. Once they
+are added, the catalog and the metastore have the same number of partitions
+unless some were dropped, or were added with lower ids (metastore instances
+sharing a database allocate ids by blocks). Only then are all the partition
+ids of the table fetched, to remove the dropped partitions from the catalog
+and add the missing ones. As a drop and a late addition can compensate each
+other, partition ids are also compared once every full_sync_interval. A
+table dropped and created again gets a new id, and is fetched entirely.
+
+See hive_metastore.py in the same folder
+"""
+
+import functools
+import logging
+import os
+import sqlite3
+import time
+
+from refinery.hive_metastore import HIVE_CONFIG_ENV_VARIABLE
+from refinery.util import read_properties_file
+
+
+logger = logging.getLogger('partition-catalog')
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog_tables (
+    database_name TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    table_id INTEGER NOT NULL,
+    PRIMARY KEY (database_name, table_name)
+);
+CREATE TABLE IF NOT EXISTS catalog_partitions (
+    table_id INTEGER NOT NULL,
+    partition_id INTEGER NOT NULL,
+    partition_desc TEXT NOT NULL,
+    location TEXT,
+    PRIMARY KEY (table_id, partition_id)
+);
+CREATE TABLE IF NOT EXISTS catalog_full_syncs (
+    table_id INTEGER PRIMARY KEY,
+    synced_at REAL NOT NULL
+);
+"""
+
+
+class PartitionCatalog(object):
+    """
+    Partitions of Hive tables stored in a SQLite file, refreshed
+    incrementally from a HiveMetastoreBackend.
+    The file can be shared by processes, SQLite locking it while updated.
+
+    Parameters:
+        path               : Path of the SQLite file, created if needed.
+        timeout            : Seconds to wait for a lock held by another process.
+        full_sync_interval : Seconds after which the partition ids of a table
+                             are compared to the metastore ones on refresh.
+    """
+
+    def __init__(self, path, timeout=60, full_sync_interval=24 * 3600):
+        self.path = path
+        self.full_sync_interval = full_sync_interval
+        self.connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _table_id(self, database, table):
+        row = self.connection.execute(
+            'SELECT table_id FROM catalog_tables WHERE database_name = ? AND table_name = ?',
+            (database, table)).fetchone()
+        return row[0] if row else None
+
+    def forget(self, database, table):
+        """Removes table from the catalog."""
+        database, table = database.lower(), table.lower()
+        with self.connection:
+            table_id = self._table_id(database, table)
+            self.connection.execute(
+                'DELETE FROM catalog_tables WHERE database_name = ? AND table_name = ?', (database, table))
+            self.connection.execute('DELETE FROM catalog_partitions WHERE table_id = ?', (table_id,))
+            self.connection.execute('DELETE FROM catalog_full_syncs WHERE table_id = ?', (table_id,))
+
+    def _insert(self, table_id, partitions):
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO catalog_partitions VALUES (?, ?, ?, ?)',
+            [(table_id, partition_id, desc, location) for partition_id, desc, location in partitions])
+
+    def refresh(self, metastore, database, table):
+        """
+        Updates the partitions of table from metastore, returning the numbers
+        of (added, removed) partitions.
+        """
+        database, table = database.lower(), table.lower()
+        table_id = metastore.table_id(database, table)
+        if table_id != self._table_id(database, table):
+            self.forget(database, table)
+        if table_id is None:
+            return 0, 0
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO catalog_tables VALUES (?, ?, ?)', (database, table, table_id))
+            last_id, count = self.connection.execute(
+                'SELECT COALESCE(MAX(partition_id), 0), COUNT(*) FROM catalog_partitions WHERE table_id = ?',
+                (table_id,)).fetchone()
+
+            row = self.connection.execute(
+                'SELECT synced_at FROM catalog_full_syncs WHERE table_id = ?', (table_id,)).fetchone()
+            now = time.time()
+            # A table fetched from scratch is in sync.
+            synced_at = now if count == 0 else row[0] if row else None
+
+            added = metastore.partitions_after(table_id, last_id)
+            self._insert(table_id, added)
+
+            removed = []
+            if (synced_at is None or now - synced_at >= self.full_sync_interval or
+                    count + len(added) != metastore.partition_count(table_id)):
+                existing = metastore.partition_ids(table_id)
+                cataloged = set(row[0] for row in self.connection.execute(
+                    'SELECT partition_id FROM catalog_partitions WHERE table_id = ?', (table_id,)))
+                removed = sorted(cataloged - existing)
+                self.connection.executemany(
+                    'DELETE FROM catalog_partitions WHERE table_id = ? AND partition_id = ?',
+                    [(table_id, partition_id) for partition_id in removed])
+                missing = metastore.partitions_by_ids(table_id, existing - cataloged)
+                self._insert(table_id, missing)
+                added += missing
+                synced_at = now
+            self.connection.execute(
+                'INSERT OR REPLACE INTO catalog_full_syncs VALUES (?, ?)', (table_id, synced_at))
+
+        logger.debug('Refreshed partitions of {0}.{1}: {2} added, {3} removed'.format(
+            database, table, len(added), len(removed)))
+        return len(added), len(removed)
+
+    def partitions(self, metastore, database, table):
+        """
+        Refreshes table and returns its partitions like
+        HiveMetastoreBackend.partitions, as (partition desc, location) tuples
+        sorted by partition desc.
+        """
+        self.refresh(metastore, database, table)
+        return [tuple(row) for row in self.connection.execute(
+            'SELECT p.partition_desc, p.location FROM catalog_partitions p '
+            'JOIN catalog_tables t ON p.table_id = t.table_id '
+            'WHERE t.database_name = ? AND t.table_name = ? ORDER BY p.partition_desc',
+            (database.lower(), table.lower()))]
+
+
+@functools.lru_cache(maxsize=None)
+def partition_catalog_from_environment():
+    """
+    Returns a PartitionCatalog stored in the file set by the
+    hive.partition_catalog property of the properties file whose path
+    is in the REFINERY_HIVE_CONFIG environment variable, None if unset.
+    """
+    config_file = os.environ.get(HIVE_CONFIG_ENV_VARIABLE)
+    config = read_properties_file(config_file) if config_file else {}
+    if not config.get('hive.partition_catalog'):
+        return None
+    return PartitionCatalog(config['hive.partition_catalog'])
@@ -17,11 +17,13 @@
 """
 Wikimedia Analytics Refinery sqoop python helpers
 """
+import asyncio
 import sys
 import logging
 import re
 
 from subprocess import check_call, DEVNULL
+from refinery.async_hdfs import AsyncHdfs
 from refinery.hdfs import Hdfs
 from refinery.util import is_yarn_application_running, get_dbnames_from_mw_config
 
@@ -1475,27 +1477,47 @@ def check_already_running_or_exit(yarn_job_name_prefix):
 
 
 def check_hdfs_path_or_exit(tables, table_path_template, tmp_base_path, force, dry_run):
-    safe = True
     logger.info('Checking HDFS paths')
-    for table in tables:
-        table_path = table_path_template.format(table=table)
-        tmp_table_path = table_path_to_tmp_path(table_path, tmp_base_path)
-
-        # Delete temporary folder if it exists in any case
-        if Hdfs.ls(tmp_table_path, include_children=False):
-            if not dry_run:
-                Hdfs.rm(tmp_table_path)
-            logger.info('temporary path {} deleted from HDFS.'.format(tmp_table_path))
-
-        # Check if real folder exist and delee it if --force flag is on
-        if Hdfs.ls(table_path, include_children=False):
-            if force:
-                if not dry_run:
-                    Hdfs.rm(table_path)
-                logger.info('Forcing: {} deleted from HDFS.'.format(table_path))
-            else:
-                logger.error('{} already exists in HDFS.'.format(table_path))
-                safe = False
-
+    table_paths = [table_path_template.format(table=table) for table in tables]
+    results = asyncio.run(_check_hdfs_paths(table_paths, tmp_base_path, force, dry_run))
+    safe = all(results)
     if not safe:
         sys.exit(1)
+
+
+async def _check_hdfs_paths(table_paths, tmp_base_path, force, dry_run):
+    """
+    Runs _check_hdfs_path for all table paths concurrently.
+    """
+    return await asyncio.gather(*[
+        _check_hdfs_path(table_path, tmp_base_path, force, dry_run)
+        for table_path in table_paths
+    ])
+
+
+async def _check_hdfs_path(table_path, tmp_base_path, force, dry_run):
+    """
+    Deletes the temporary folder of table_path if it exists, and table_path
+    itself if force is set. Returns False if table_path exists and is not
+    deleted, True otherwise.
+    """
+    tmp_table_path = table_path_to_tmp_path(table_path, tmp_base_path)
+    tmp_exists, exists = await asyncio.gather(
+        AsyncHdfs.exists(tmp_table_path), AsyncHdfs.exists(table_path))
+
+    # Delete temporary folder if it exists in any case
+    if tmp_exists:
+        if not dry_run:
+            await AsyncHdfs.rm(tmp_table_path)
+        logger.info('temporary path {} deleted from HDFS.'.format(tmp_table_path))
+
+    # Check if real folder exist and delee it if --force flag is on
+    if exists:
+        if force:
+            if not dry_run:
+                await AsyncHdfs.rm(table_path)
+            logger.info('Forcing: {} deleted from HDFS.'.format(table_path))
+        else:
+            logger.error('{} already exists in HDFS.'.format(table_path))
+            return False
+    return True
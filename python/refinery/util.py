@@ -23,6 +23,7 @@ import dns.resolver
 import logging
 import os
 import subprocess
+import tempfile
 import glob
 import functools
 import operator
@@ -134,6 +135,40 @@ def sh(command, check_return_code=True, strip_output=True, return_stderr=False):
         return stdout.decode()
 
 
+def sh_lines(command, check_return_code=True):
+    """
+    Executes a command and yields its stdout decoded lines (without line
+    terminators) as they are produced, instead of buffering the whole output.
+
+    Parameters
+        command             : The command to run, as an array.
+        check_return_code   : If the command does not exit with 0, a RuntimeError
+                              will be raised once its output has been consumed.
+
+    If the generator is closed before the output is exhausted, the command
+    is terminated.
+    """
+    command_string = ' '.join(command)
+    logger.debug('Running: {0}'.format(command_string))
+    # stderr goes to a temporary file so that it can't fill up a pipe
+    # and block the command while stdout is being read.
+    with tempfile.TemporaryFile() as stderr_file:
+        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file)
+        try:
+            for line in p.stdout:
+                yield line.decode().rstrip('\r\n')
+            p.wait()
+        finally:
+            if p.poll() is None:
+                p.kill()
+                p.wait()
+            p.stdout.close()
+        if check_return_code and p.returncode != 0:
+            stderr_file.seek(0)
+            raise RuntimeError("Command: {0} failed with error code: {1}"
+                               .format(command_string, p.returncode), b'', stderr_file.read().strip())
+
+
 def get_dbnames_from_mw_config(filenames,
                               mw_config_path=MW_CONFIG_PATH,
                               mw_config_dblists_folder=MW_CONFIG_DBLISTS_FOLDER,
@@ -0,0 +1,699 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Wikimedia Analytics Refinery python WebHDFS/HttpFS Hdfs backend.
+
+Talks to the WebHDFS REST API of the NameNode (or to an HttpFS server)
+over pooled, kept-alive HTTP connections, avoiding the Hadoop client
+JVM startup paid by the default cli backend on every call.
+
+Only pseudo authentication (user.name) and delegation tokens are supported.
+
+See hdfs.py in the same folder
+"""
+
+import datetime
+import fnmatch
+import http.client
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import socket
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode, urlparse
+
+from refinery.hdfs import FileType, HdfsFileStatus, HdfsStreamReader
+
+
+logger = logging.getLogger('webhdfs-util')
+
+WEBHDFS_PREFIX = '/webhdfs/v1'
+GLOB_CHARACTERS = re.compile(r'[*?\[{]')
+BUFFER_SIZE = 1024 * 1024
+
+
+class NoDelayHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTPConnection disabling Nagle's algorithm, as requests are sent in
+    several writes (headers then body) on long-lived connections.
+    """
+
+    def connect(self):
+        super(NoDelayHTTPConnection, self).connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class NoDelayHTTPSConnection(http.client.HTTPSConnection):
+
+    def connect(self):
+        super(NoDelayHTTPSConnection, self).connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class HTTPConnectionPool(object):
+    """
+    Thread-safe pool of kept-alive HTTP connections, keyed by host.
+
+    Parameters:
+        pool_size : Maximum number of idle connections kept per host.
+        timeout   : Socket timeout in seconds.
+    """
+
+    def __init__(self, pool_size=10, timeout=60):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _host_pool(self, scheme, netloc):
+        with self._lock:
+            return self._pools.setdefault((scheme, netloc), queue.LifoQueue(self.pool_size))
+
+    def _connection(self, scheme, netloc):
+        try:
+            return self._host_pool(scheme, netloc).get_nowait(), True
+        except queue.Empty:
+            connection_class = NoDelayHTTPSConnection if scheme == 'https' else NoDelayHTTPConnection
+            return connection_class(netloc, timeout=self.timeout), False
+
+    def release(self, scheme, netloc, connection):
+        """
+        Gives back a connection whose last response has been fully read.
+        """
+        try:
+            self._host_pool(scheme, netloc).put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Sends a request and returns (response, release) where response is the
+        http.client.HTTPResponse and release a function to call once the
+        response body has been read entirely, giving the connection back to
+        the pool (or with reuse=False to close it, when the body was not
+        read). A request sent on a reused connection that turns out to have
+        been closed by the server is retried once on a new connection.
+        """
+        parsed = urlparse(url)
+        target = parsed.path + ('?' + parsed.query if parsed.query else '')
+        connection, reused = self._connection(parsed.scheme, parsed.netloc)
+        try:
+            connection.request(method, target, body=body, headers=headers or {})
+            response = connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            connection.close()
+            if not reused or (body is not None and not isinstance(body, bytes)):
+                raise
+            connection, reused = self._connection(parsed.scheme, parsed.netloc)
+            connection.request(method, target, body=body, headers=headers or {})
+            response = connection.getresponse()
+
+        def release(reuse=True):
+            if response.will_close or not reuse:
+                connection.close()
+            else:
+                self.release(parsed.scheme, parsed.netloc, connection)
+
+        return response, release
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
+
+
+class WebHdfsBackend(object):
+    """
+    Hdfs backend using the WebHDFS REST API (or HttpFS).
+
+    Parameters:
+        url        : Base URL of the WebHDFS/HttpFS endpoint,
+                     e.g. http://namenode.example.org:9870
+        user       : User name passed as user.name for pseudo authentication.
+        delegation : Optional delegation token.
+        httpfs     : Set to True when talking to an HttpFS server, so that file
+                     uploads are sent in a single request instead of
+                     following the NameNode redirection to a DataNode.
+        pool_size  : Maximum number of kept-alive connections per host.
+        timeout    : Socket timeout in seconds.
+    """
+
+    def __init__(self, url, user=None, delegation=None, httpfs=False,
+                 pool_size=10, timeout=60):
+        self.url = url.rstrip('/')
+        self.user = user
+        self.delegation = delegation
+        self.httpfs = httpfs
+        self.pool = HTTPConnectionPool(pool_size=pool_size, timeout=timeout)
+
+    # HTTP plumbing
+
+    def _url(self, path, op, **params):
+        if path.startswith('hdfs://'):
+            path = urlparse(path).path
+        query = {'op': op}
+        if self.user:
+            query['user.name'] = self.user
+        if self.delegation:
+            query['delegation'] = self.delegation
+        query.update({k: str(v).lower() if isinstance(v, bool) else v for k, v in params.items()})
+        return '{}{}{}?{}'.format(self.url, WEBHDFS_PREFIX, quote(path), urlencode(query))
+
+    @staticmethod
+    def _raise_for_status(response, data, method, url):
+        if response.status < 400:
+            return
+        try:
+            remote = json.loads(data.decode('utf-8'))['RemoteException']
+            message = '{}: {}'.format(remote.get('exception'), remote.get('message'))
+        except (ValueError, KeyError, TypeError):
+            remote = {}
+            message = data.decode('utf-8', 'replace')
+        error = RuntimeError('WebHDFS {} {} failed with status {}: {}'.format(
+            method, url, response.status, message))
+        error.exception = remote.get('exception')
+        raise error
+
+    def _call(self, method, path, op, body=None, **params):
+        """
+        Runs a WebHDFS operation not involving DataNodes and returns its decoded JSON.
+        """
+        url = self._url(path, op, **params)
+        logger.debug('{} WebHDFS request to {}'.format(method, url))
+        response, release = self.pool.request(method, url, body=body)
+        data = response.read()
+        release()
+        self._raise_for_status(response, data, method, url)
+        return json.loads(data.decode('utf-8')) if data else {}
+
+    def _open(self, path, **params):
+        """
+        Opens path for reading, following the redirection to a DataNode.
+        Returns (response, release), see HTTPConnectionPool.request.
+        """
+        url = self._url(path, 'OPEN', **params)
+        logger.debug('GET WebHDFS request to {}'.format(url))
+        for _ in range(2):
+            response, release = self.pool.request('GET', url)
+            if response.status in (301, 302, 303, 307):
+                url = response.getheader('Location')
+                response.read()
+                release()
+                continue
+            if response.status >= 400:
+                data = response.read()
+                release()
+                self._raise_for_status(response, data, 'GET', url)
+            return response, release
+        raise RuntimeError('WebHDFS OPEN of {} redirected too many times'.format(path))
+
+    def _create(self, path, data, overwrite=False, length=None):
+        """
+        Creates path with data (bytes or a file-like object).
+        """
+        headers = {'Content-Type': 'application/octet-stream'}
+        if length is not None:
+            headers['Content-Length'] = str(length)
+        if self.httpfs:
+            url = self._url(path, 'CREATE', overwrite=overwrite, data=True)
+        else:
+            # The NameNode answers with a redirection to the DataNode to write to.
+            url = self._url(path, 'CREATE', overwrite=overwrite)
+            response, release = self.pool.request('PUT', url, headers={'Content-Length': '0'})
+            content = response.read()
+            release()
+            self._raise_for_status(response, content, 'PUT', url)
+            if response.status == 307:
+                url = response.getheader('Location')
+        logger.debug('PUT WebHDFS request to {}'.format(url))
+        response, release = self.pool.request('PUT', url, body=data, headers=headers)
+        content = response.read()
+        release()
+        self._raise_for_status(response, content, 'PUT', url)
+
+    # Status helpers
+
+    def _status(self, path):
+        """
+        Returns the FileStatus dict of path, or None if it doesn't exist.
+        """
+        try:
+            return self._call('GET', path, 'GETFILESTATUS')['FileStatus']
+        except RuntimeError as e:
+            if getattr(e, 'exception', None) == 'FileNotFoundException':
+                return None
+            raise
+
+    def _list(self, path):
+        """
+        Returns the list of FileStatus dicts of path's children, with path set.
+        """
+        statuses = self._call('GET', path, 'LISTSTATUS')['FileStatuses']['FileStatus']
+        for status in statuses:
+            status['path'] = os.path.join(path, status['pathSuffix']) if status['pathSuffix'] else path
+        return statuses
+
+    def _iter_list(self, path):
+        """
+        Yields the FileStatus dicts of path's children, with path set,
+        fetching them in batches with LISTSTATUS_BATCH.
+        """
+        start_after = None
+        while True:
+            params = {} if start_after is None else {'startAfter': start_after}
+            listing = self._call('GET', path, 'LISTSTATUS_BATCH', **params)['DirectoryListing']
+            statuses = listing['partialListing']['FileStatuses']['FileStatus']
+            for status in statuses:
+                status['path'] = os.path.join(path, status['pathSuffix']) if status['pathSuffix'] else path
+                yield status
+            if not statuses or not listing['remainingEntries']:
+                return
+            start_after = statuses[-1]['pathSuffix']
+
+    def _glob(self, path):
+        """
+        Expands shell globs in path, returning a list of FileStatus dicts (with path set).
+        Paths without globs that don't exist result in an empty list.
+        Returned paths keep the scheme and authority of path if it has some,
+        as hdfs dfs does.
+        """
+        if not GLOB_CHARACTERS.search(path):
+            status = self._status(path)
+            if status is None:
+                return []
+            status['path'] = path
+            return [status]
+
+        prefix = ''
+        if path.startswith('hdfs://'):
+            parsed = urlparse(path)
+            prefix, path = '{}://{}'.format(parsed.scheme, parsed.netloc), parsed.path
+
+        statuses = [{'path': '/', 'type': 'DIRECTORY'}]
+        for component in [c for c in path.split('/') if c]:
+            patterns = expand_braces(component)
+            expanded = []
+            for status in statuses:
+                if status['type'] != 'DIRECTORY':
+                    continue
+                if any(GLOB_CHARACTERS.search(p) for p in patterns):
+                    try:
+                        children = self._list(status['path'])
+                    except RuntimeError as e:
+                        if getattr(e, 'exception', None) == 'FileNotFoundException':
+                            continue
+                        raise
+                    expanded += [c for c in children
+                                 if any(fnmatch.fnmatchcase(c['pathSuffix'], p) for p in patterns)]
+                else:
+                    for pattern in patterns:
+                        child_path = os.path.join(status['path'], pattern)
+                        child = self._status(child_path)
+                        if child is not None:
+                            child['path'] = child_path
+                            expanded.append(child)
+            statuses = expanded
+        for status in statuses:
+            status['path'] = prefix + status['path']
+        return sorted(statuses, key=lambda s: s['path'])
+
+    def _glob_or_fail(self, path, command):
+        statuses = self._glob(path)
+        if not statuses:
+            raise RuntimeError('{}: `{}\': No such file or directory'.format(command, path))
+        return statuses
+
+    def _trash_path(self, path):
+        home = self._call('GET', '/', 'GETHOMEDIRECTORY')['Path']
+        return os.path.join(home, '.Trash', 'Current', urlparse(path).path.lstrip('/'))
+
+    # Backend operations
+
+    def ls(self, paths, include_children=True):
+        details = []
+        for path in paths:
+            for status in self._glob(path):
+                if include_children and status['type'] == 'DIRECTORY':
+                    details += [status_to_details(s) for s in self._list(status['path'])]
+                else:
+                    details.append(status_to_details(status))
+        return details
+
+    def iter_ls(self, paths, include_children=True, recursive=False):
+        for path in paths:
+            for status in self._glob(path):
+                if (include_children or recursive) and status['type'] == 'DIRECTORY':
+                    for child in self._iter_tree(status['path'], recursive):
+                        yield status_to_record(child)
+                else:
+                    yield status_to_record(status)
+
+    def _iter_tree(self, path, recursive):
+        """
+        Yields the FileStatus dicts of path's children and, if recursive,
+        of their own children right after each of them (as ls -R does).
+        """
+        for status in self._iter_list(path):
+            yield status
+            if recursive and status['type'] == 'DIRECTORY':
+                for child in self._iter_tree(status['path'], recursive):
+                    yield child
+
+    def rm(self, paths, recurse=True, skip_trash=True):
+        for path in paths:
+            for status in self._glob_or_fail(path, 'rm'):
+                if status['type'] == 'DIRECTORY' and not recurse:
+                    raise RuntimeError('rm: `{}\': Is a directory'.format(status['path']))
+                if skip_trash:
+                    self._call('DELETE', status['path'], 'DELETE', recursive=recurse)
+                else:
+                    trash_path = self._trash_path(status['path'])
+                    if self._status(trash_path) is not None:
+                        trash_path += str(int(time.time() * 1000))
+                    self._call('PUT', os.path.dirname(trash_path), 'MKDIRS')
+                    self._call('PUT', status['path'], 'RENAME', destination=trash_path)
+                logger.debug('Deleted {}'.format(status['path']))
+        return ''
+
+    def rmdir(self, paths):
+        for path in paths:
+            for status in self._glob_or_fail(path, 'rmdir'):
+                if status['type'] != 'DIRECTORY':
+                    raise RuntimeError('rmdir: `{}\': Is not a directory'.format(status['path']))
+                self._call('DELETE', status['path'], 'DELETE', recursive=False)
+        return ''
+
+    def mkdir(self, paths, create_parent=True):
+        for path in paths:
+            if not create_parent:
+                parent = os.path.dirname(path.rstrip('/'))
+                if self._status(parent) is None:
+                    raise RuntimeError('mkdir: `{}\': No such file or directory'.format(parent))
+                if self._status(path) is not None:
+                    raise RuntimeError('mkdir: `{}\': File exists'.format(path))
+            self._call('PUT', path, 'MKDIRS')
+        return ''
+
+    def cp(self, from_path, to_path, force=False):
+        for status in self._glob_or_fail(from_path, 'cp'):
+            self._copy_status(status, self._target_path(status['path'], to_path), force)
+
+    def _copy_status(self, status, to_path, force):
+        if status['type'] == 'DIRECTORY':
+            self._call('PUT', to_path, 'MKDIRS')
+            for child in self._list(status['path']):
+                self._copy_status(child, os.path.join(to_path, child['pathSuffix']), force)
+        else:
+            response, release = self._open(status['path'])
+            try:
+                self._create(to_path, response, overwrite=force, length=status['length'])
+            finally:
+                response.read()
+                release()
+
+    def _is_dir(self, path):
+        status = self._status(path)
+        return status is not None and status['type'] == 'DIRECTORY'
+
+    def _target_path(self, from_path, to_path):
+        """
+        Returns to_path, or to_path/basename(from_path) if to_path is an existing directory.
+        """
+        if self._is_dir(to_path):
+            return os.path.join(to_path, os.path.basename(from_path.rstrip('/')))
+        return to_path
+
+    def mv(self, from_paths, to_path):
+        statuses = [status for from_path in from_paths
+                    for status in self._glob_or_fail(from_path, 'mv')]
+        to_is_dir = self._is_dir(to_path)
+        if len(statuses) > 1 and not to_is_dir:
+            raise RuntimeError('mv: `{}\': Is not a directory'.format(to_path))
+        for status in statuses:
+            target = os.path.join(to_path, os.path.basename(status['path'].rstrip('/'))) if to_is_dir else to_path
+            if not self._call('PUT', status['path'], 'RENAME', destination=target)['boolean']:
+                raise RuntimeError('mv: failed to rename `{}\' to `{}\''.format(status['path'], target))
+
+    def put(self, local_paths, hdfs_path, force=False):
+        if len(local_paths) > 1 and not self._is_dir(hdfs_path):
+            raise RuntimeError('put: `{}\': Is not a directory'.format(hdfs_path))
+        for local_path in local_paths:
+            self._put_path(local_path, hdfs_path, force)
+
+    def _put_path(self, local_path, hdfs_path, force):
+        if not os.path.exists(local_path):
+            raise RuntimeError('put: `{}\': No such file or directory'.format(local_path))
+        target = self._target_path(local_path, hdfs_path)
+        if os.path.isdir(local_path):
+            self._call('PUT', target, 'MKDIRS')
+            for name in sorted(os.listdir(local_path)):
+                self._put_path(os.path.join(local_path, name), target, force)
+        else:
+            with open(local_path, 'rb') as f:
+                self._create(target, f, overwrite=force, length=os.path.getsize(local_path))
+
+    def get(self, hdfs_paths, local_path, force=False):
+        statuses = [status for hdfs_path in hdfs_paths
+                    for status in self._glob_or_fail(hdfs_path, 'get')]
+        if len(statuses) > 1 and not os.path.isdir(local_path):
+            raise RuntimeError('get: `{}\': Is not a directory'.format(local_path))
+        for status in statuses:
+            target = local_path
+            if os.path.isdir(local_path):
+                target = os.path.join(local_path, os.path.basename(status['path'].rstrip('/')))
+            self._get_status(status, target, force)
+
+    def _get_status(self, status, local_path, force):
+        if status['type'] == 'DIRECTORY':
+            os.makedirs(local_path, exist_ok=True)
+            for child in self._list(status['path']):
+                self._get_status(child, os.path.join(local_path, child['pathSuffix']), force)
+            return
+        if os.path.exists(local_path) and not force:
+            raise RuntimeError('get: `{}\': File exists'.format(local_path))
+        response, release = self._open(status['path'])
+        with open(local_path, 'wb') as f:
+            shutil.copyfileobj(response, f, BUFFER_SIZE)
+        release()
+
+    def cat(self, path):
+        contents = []
+        for status in self._glob_or_fail(path, 'cat'):
+            response, release = self._open(status['path'])
+            contents.append(response.read())
+            release()
+        # Stripped and decoded like refinery.util.sh output.
+        return b''.join(contents).strip().decode()
+
+    def open(self, path):
+        statuses = self._glob_or_fail(path, 'cat')
+        if len(statuses) > 1:
+            raise RuntimeError('cat: `{}\': Matches more than one file'.format(path))
+        if statuses[0]['type'] == 'DIRECTORY':
+            raise RuntimeError('cat: `{}\': Is a directory'.format(path))
+        response, release = self._open(statuses[0]['path'])
+
+        def finish(complete):
+            if not complete:
+                response.close()
+            release(reuse=complete)
+
+        return HdfsStreamReader(response, finish)
+
+    def get_modified_datetime(self, path):
+        status = self._glob_or_fail(path, 'stat')[0]
+        return datetime.datetime.fromtimestamp(
+            status['modificationTime'] // 1000, tz=datetime.timezone.utc)
+
+    def touchz(self, paths):
+        for path in paths:
+            status = self._status(path)
+            if status is None:
+                self._create(path, b'', length=0)
+            elif status['type'] == 'DIRECTORY' or status['length'] != 0:
+                raise RuntimeError('touchz: `{}\': Not a zero-length file'.format(path))
+        return ''
+
+    def setrep(self, paths, replication):
+        # SETREPLICATION only applies to files, and is skipped for the ones
+        # already having the right replication.
+        for status in self.iter_ls(paths, recursive=True):
+            if not status.is_directory() and status.replication != replication:
+                self._call('PUT', status.path, 'SETREPLICATION', replication=replication)
+
+    def set_storage_policy(self, paths, policy):
+        for path in paths:
+            self._call('PUT', path, 'SETSTORAGEPOLICY', storagepolicy=policy)
+
+    def dir_bytes_size(self, path):
+        return sum(
+            self._call('GET', status['path'], 'GETCONTENTSUMMARY')['ContentSummary']['length']
+            for status in self._glob_or_fail(path, 'du')
+        )
+
+    def stat(self, paths):
+        stats = {}
+        for path in paths:
+            status = self._status(path)
+            stats[path] = None if status is None else {
+                'file_type': 'd' if status['type'] == 'DIRECTORY' else 'f',
+                'size': status['length'],
+                'replication': status['replication'],
+                'modified_datetime': datetime.datetime.fromtimestamp(
+                    status['modificationTime'] // 1000, tz=datetime.timezone.utc),
+            }
+        return stats
+
+    def _content_summary(self, path):
+        """
+        Returns the ContentSummary dict of path, or None if it doesn't exist.
+        """
+        try:
+            return self._call('GET', path, 'GETCONTENTSUMMARY')['ContentSummary']
+        except RuntimeError as e:
+            if getattr(e, 'exception', None) == 'FileNotFoundException':
+                return None
+            raise
+
+    def du(self, paths):
+        sizes = {}
+        for path in paths:
+            summary = self._content_summary(path)
+            sizes[path] = None if summary is None else summary['length']
+        return sizes
+
+    def count(self, paths):
+        counts = {}
+        for path in paths:
+            summary = self._content_summary(path)
+            counts[path] = None if summary is None else {
+                'directory_count': summary['directoryCount'],
+                'file_count': summary['fileCount'],
+                'content_size': summary['length'],
+            }
+        return counts
+
+    def _file_checksum(self, path):
+        """
+        Returns the FileChecksum dict of path, or None if it doesn't exist.
+        The NameNode redirects to a DataNode computing the checksum.
+        """
+        url = self._url(path, 'GETFILECHECKSUM')
+        for _ in range(2):
+            response, release = self.pool.request('GET', url)
+            data = response.read()
+            release()
+            if response.status in (301, 302, 303, 307):
+                url = response.getheader('Location')
+                continue
+            try:
+                self._raise_for_status(response, data, 'GET', url)
+            except RuntimeError as e:
+                if getattr(e, 'exception', None) == 'FileNotFoundException':
+                    return None
+                raise
+            return json.loads(data.decode('utf-8'))['FileChecksum']
+        raise RuntimeError('WebHDFS GETFILECHECKSUM of {} redirected too many times'.format(path))
+
+    def checksum(self, paths):
+        # GETFILECHECKSUM takes a request to the NameNode and one to a DataNode
+        # per file: files are fetched in parallel, over the pooled connections.
+        # The combine mode can't be requested through WebHDFS, checksums are
+        # COMPOSITE_CRC ones only if the DataNodes are configured so.
+        paths = list(paths)
+        if not paths:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(len(paths), self.pool.pool_size)) as executor:
+            file_checksums = list(executor.map(self._file_checksum, paths))
+        return {
+            path: None if file_checksum is None else {
+                'algorithm': file_checksum['algorithm'],
+                'checksum': file_checksum['bytes'],
+            }
+            for path, file_checksum in zip(paths, file_checksums)
+        }
+
+
+def status_to_details(status):
+    """
+    Converts a WebHDFS FileStatus dict (with path set) to the
+    dictionnary returned by Hdfs.ls(with_details=True).
+    """
+    is_dir = status['type'] == 'DIRECTORY'
+    modification = datetime.datetime.fromtimestamp(status['modificationTime'] // 1000, tz=datetime.timezone.utc)
+    return {
+        'file_type': 'd' if is_dir else 'f',
+        'permission': permission_string(status['permission']),
+        'replication': '-' if is_dir else str(status['replication']),
+        'owner': status['owner'],
+        'group': status['group'],
+        'file_size': str(status['length']),
+        'modification_date': modification.strftime('%Y-%m-%d'),
+        'modification_time': modification.strftime('%H:%M'),
+        'path': status['path']
+    }
+
+
+def status_to_record(status):
+    """
+    Converts a WebHDFS FileStatus dict (with path set) to an HdfsFileStatus.
+    """
+    is_dir = status['type'] == 'DIRECTORY'
+    return HdfsFileStatus(
+        status['path'],
+        FileType.DIRECTORY if is_dir else FileType.FILE,
+        status['length'],
+        status['modificationTime'] // 1000,
+        permission_string(status['permission']),
+        status['replication'],
+        status['owner'],
+        status['group']
+    )
+
+
+def permission_string(octal_permission):
+    """
+    Converts an octal permission string, e.g. 755, to its symbolic form, e.g. rwxr-xr-x
+    """
+    mode = int(octal_permission, 8)
+    symbols = ''
+    for shift in (6, 3, 0):
+        bits = (mode >> shift) & 7
+        symbols += ('r' if bits & 4 else '-') + ('w' if bits & 2 else '-') + ('x' if bits & 1 else '-')
+    if mode & 0o1000:
+        symbols = symbols[:-1] + ('t' if symbols[-1] == 'x' else 'T')
+    return symbols
+
+
+def expand_braces(pattern):
+    """
+    Expands the first level of shell braces, e.g. a{b,c}d returns [abd, acd].
+    """
+    match = re.search(r'\{([^{}]*)\}', pattern)
+    if not match:
+        return [pattern]
+    expanded = []
+    for alternative in match.group(1).split(','):
+        expanded += expand_braces(pattern[:match.start()] + alternative + pattern[match.end():])
+    return expanded
@@ -0,0 +1,29 @@
+"""
+Stand-in for the FsShell worker of refinery.fsshell_worker, speaking the same
+protocol. It answers -ls with a single line whose owner is the worker pid,
+admin tools requests with their arguments, fails any -rm, and exits on -exit.
+"""
+
+import json
+import os
+import sys
+
+
+def answer(code, stdout=b'', stderr=b''):
+    sys.stdout.buffer.write('{} {} {}\n'.format(code, len(stdout), len(stderr)).encode())
+    sys.stdout.buffer.write(stdout + stderr)
+    sys.stdout.buffer.flush()
+
+
+for line in sys.stdin:
+    args = json.loads(line)
+    if args[0] == '-ls':
+        answer(0, '-rw-r--r--   3 {} hadoop  42 2023-04-13 08:13 {}\n'.format(os.getpid(), args[-1]).encode())
+    elif args[0] == '-rm':
+        answer(1, stderr='rm: `{}\': No such file or directory\n'.format(args[-1]).encode())
+    elif args[0].startswith('@'):
+        answer(0, json.dumps(args).encode())
+    elif args[0] == '-exit':
+        sys.exit(0)
+    else:
+        answer(0)
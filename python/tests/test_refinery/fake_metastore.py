@@ -0,0 +1,113 @@
+"""
+Local stand-in for the Hive metastore database, backed by an in-memory
+SQLite database having the subset of the metastore schema read by
+refinery.hive_metastore. Ids are never reused, as in the metastore.
+"""
+
+import itertools
+import sqlite3
+
+from refinery.hive_metastore import HiveMetastoreBackend
+
+
+SCHEMA = """
+CREATE TABLE DBS (DB_ID INTEGER PRIMARY KEY, NAME TEXT, DB_LOCATION_URI TEXT);
+CREATE TABLE SDS (SD_ID INTEGER PRIMARY KEY, LOCATION TEXT, INPUT_FORMAT TEXT, OUTPUT_FORMAT TEXT);
+CREATE TABLE TBLS (TBL_ID INTEGER PRIMARY KEY AUTOINCREMENT, DB_ID INTEGER, SD_ID INTEGER, TBL_NAME TEXT,
+                   TBL_TYPE TEXT, OWNER TEXT);
+CREATE TABLE TABLE_PARAMS (TBL_ID INTEGER, PARAM_KEY TEXT, PARAM_VALUE TEXT);
+CREATE TABLE PARTITION_KEYS (TBL_ID INTEGER, PKEY_NAME TEXT, PKEY_TYPE TEXT, INTEGER_IDX INTEGER);
+CREATE TABLE PARTITIONS (PART_ID INTEGER PRIMARY KEY AUTOINCREMENT, TBL_ID INTEGER, SD_ID INTEGER, PART_NAME TEXT);
+"""
+
+_database_names = itertools.count()
+
+
+class FakeMetastore(object):
+    """
+    Usage:
+        metastore = FakeMetastore()
+        metastore.add_table('wmf', 'webrequest', '/wmf/data/wmf/webrequest', ['year', 'month'])
+        metastore.add_partition('wmf', 'webrequest', 'year=2023/month=1')
+        hive = Hive('wmf', metastore=metastore.backend())
+        ...
+        metastore.close()
+    """
+
+    def __init__(self):
+        self.uri = 'file:fake-metastore-{}?mode=memory&cache=shared'.format(next(_database_names))
+        # The in-memory database lives as long as a connection to it is open.
+        self.db = self.connect()
+        self.db.executescript(SCHEMA)
+        self.connections = 0
+
+    def connect(self):
+        return sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+
+    def _counting_connect(self):
+        self.connections += 1
+        return self.connect()
+
+    def backend(self, pool_size=4):
+        """Returns a HiveMetastoreBackend reading this metastore."""
+        return HiveMetastoreBackend(self._counting_connect, paramstyle='qmark', pool_size=pool_size)
+
+    def close(self):
+        self.db.close()
+
+    def _insert(self, table, **values):
+        cursor = self.db.execute('INSERT INTO {} ({}) VALUES ({})'.format(
+            table, ', '.join(values), ', '.join('?' * len(values))), tuple(values.values()))
+        self.db.commit()
+        return cursor.lastrowid
+
+    def _database_id(self, database):
+        row = self.db.execute('SELECT DB_ID FROM DBS WHERE NAME = ?', (database,)).fetchone()
+        if row is not None:
+            return row[0]
+        return self._insert('DBS', NAME=database, DB_LOCATION_URI='/user/hive/warehouse/' + database)
+
+    def _table_id(self, database, table):
+        return self.db.execute(
+            'SELECT TBL_ID FROM TBLS JOIN DBS ON TBLS.DB_ID = DBS.DB_ID WHERE NAME = ? AND TBL_NAME = ?',
+            (database, table)).fetchone()[0]
+
+    def add_table(self, database, table, location, partition_keys=(), table_type='EXTERNAL_TABLE',
+                  owner='analytics', parameters=None):
+        sd_id = self._insert('SDS', LOCATION=location,
+                             INPUT_FORMAT='org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat',
+                             OUTPUT_FORMAT='org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat')
+        table_id = self._insert('TBLS', DB_ID=self._database_id(database), SD_ID=sd_id,
+                                TBL_NAME=table, TBL_TYPE=table_type, OWNER=owner)
+        for key, value in (parameters or {}).items():
+            self._insert('TABLE_PARAMS', TBL_ID=table_id, PARAM_KEY=key, PARAM_VALUE=value)
+        for index, key in enumerate(partition_keys):
+            self._insert('PARTITION_KEYS', TBL_ID=table_id, PKEY_NAME=key, PKEY_TYPE='string', INTEGER_IDX=index)
+
+    def add_partition(self, database, table, desc, location=None, partition_id=None):
+        """
+        Adds the partition desc (e.g. year=2023/month=1) to table, located by
+        default in the table location. Its id is the next one unless given
+        (as a metastore instance allocating ids from its own block would do).
+        """
+        table_id = self._table_id(database, table)
+        if location is None:
+            table_location = self.db.execute(
+                'SELECT LOCATION FROM SDS JOIN TBLS ON SDS.SD_ID = TBLS.SD_ID WHERE TBL_ID = ?',
+                (table_id,)).fetchone()[0]
+            location = table_location + '/' + desc
+        sd_id = self._insert('SDS', LOCATION=location)
+        values = {} if partition_id is None else {'PART_ID': partition_id}
+        self._insert('PARTITIONS', TBL_ID=table_id, SD_ID=sd_id, PART_NAME=desc, **values)
+
+    def drop_partition(self, database, table, desc):
+        self.db.execute('DELETE FROM PARTITIONS WHERE TBL_ID = ? AND PART_NAME = ?',
+                        (self._table_id(database, table), desc))
+        self.db.commit()
+
+    def drop_table(self, database, table):
+        table_id = self._table_id(database, table)
+        self.db.execute('DELETE FROM PARTITIONS WHERE TBL_ID = ?', (table_id,))
+        self.db.execute('DELETE FROM PARTITION_KEYS WHERE TBL_ID = ?', (table_id,))
+        self.db.execute('DELETE FROM TBLS WHERE TBL_ID = ?', (table_id,))
+        self.db.commit()
@@ -0,0 +1,273 @@
+"""
+Local stand-in for a WebHDFS NameNode, serving a temporary local directory.
+
+Implements the subset of the WebHDFS REST API used by refinery.webhdfs,
+including the NameNode to DataNode redirection for OPEN, CREATE and
+GETFILECHECKSUM.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from refinery.checksum import file_checksum
+
+
+class FakeWebHdfsServer(object):
+    """
+    Usage:
+        server = FakeWebHdfsServer()
+        server.start()
+        backend = WebHdfsBackend(server.url, user='test')
+        ...
+        server.stop()
+    """
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='fake-webhdfs-')
+        self.requests = []
+        self.replication = {}
+        self.storage_policies = {}
+        self.list_batch_size = 1000
+        # The dfs.checksum.combine.mode of the DataNodes, COMPOSITE_CRC or MD5MD5CRC
+        self.checksum_combine_mode = 'MD5MD5CRC'
+        handler = type('Handler', (FakeWebHdfsHandler,), {'fake': self})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def local(self, path):
+        """Returns the local path backing the given HDFS path."""
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def ops(self):
+        """Returns the list of WebHDFS operations received so far."""
+        return [op for op, _ in self.requests]
+
+
+class FakeWebHdfsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload=None, headers=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_bytes(self, data):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, exception, message):
+        self._send(status, {'RemoteException': {'exception': exception, 'message': message}})
+
+    def _body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            data = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return data
+                data += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _status(self, hdfs_path, local_path):
+        stat = os.stat(local_path)
+        is_dir = os.path.isdir(local_path)
+        return {
+            'pathSuffix': '',
+            'type': 'DIRECTORY' if is_dir else 'FILE',
+            'length': 0 if is_dir else stat.st_size,
+            'owner': 'hdfs',
+            'group': 'hadoop',
+            'permission': '755' if is_dir else '644',
+            'modificationTime': int(stat.st_mtime * 1000),
+            'accessTime': int(stat.st_atime * 1000),
+            'blockSize': 0 if is_dir else 134217728,
+            'replication': 0 if is_dir else self.fake.replication.get(hdfs_path, 3),
+        }
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        op = params.get('op')
+        hdfs_path = unquote(url.path[len('/webhdfs/v1'):]) or '/'
+        local = self.fake.local(hdfs_path)
+        # Requests redirected to the "DataNode" have the datanode parameter set.
+        if 'datanode' not in params:
+            self.fake.requests.append((op, hdfs_path))
+        handler = getattr(self, 'op_' + (op or '').lower(), None)
+        if handler is None:
+            return self._error(400, 'IllegalArgumentException', 'Unsupported op {}'.format(op))
+        if op not in ('MKDIRS', 'CREATE', 'RENAME', 'GETHOMEDIRECTORY') and not os.path.exists(local):
+            return self._error(404, 'FileNotFoundException', 'File does not exist: ' + hdfs_path)
+        handler(hdfs_path, local, params)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def op_gethomedirectory(self, hdfs_path, local, params):
+        self._send(200, {'Path': '/user/' + params.get('user.name', 'hdfs')})
+
+    def op_getfilestatus(self, hdfs_path, local, params):
+        self._send(200, {'FileStatus': self._status(hdfs_path, local)})
+
+    def op_liststatus(self, hdfs_path, local, params):
+        if os.path.isdir(local):
+            statuses = []
+            for name in sorted(os.listdir(local)):
+                status = self._status(os.path.join(hdfs_path, name), os.path.join(local, name))
+                status['pathSuffix'] = name
+                statuses.append(status)
+        else:
+            statuses = [self._status(hdfs_path, local)]
+        self._send(200, {'FileStatuses': {'FileStatus': statuses}})
+
+    def op_liststatus_batch(self, hdfs_path, local, params):
+        names = sorted(os.listdir(local)) if os.path.isdir(local) else ['']
+        if 'startAfter' in params:
+            names = [n for n in names if n > params['startAfter']]
+        batch = names[:self.fake.list_batch_size]
+        statuses = []
+        for name in batch:
+            if name:
+                status = self._status(os.path.join(hdfs_path, name), os.path.join(local, name))
+            else:
+                status = self._status(hdfs_path, local)
+            status['pathSuffix'] = name
+            statuses.append(status)
+        self._send(200, {'DirectoryListing': {
+            'partialListing': {'FileStatuses': {'FileStatus': statuses}},
+            'remainingEntries': len(names) - len(batch)}})
+
+    def op_getcontentsummary(self, hdfs_path, local, params):
+        length, files, dirs = 0, 0, 0
+        if os.path.isdir(local):
+            for root, dirnames, filenames in os.walk(local):
+                dirs += 1
+                files += len(filenames)
+                length += sum(os.path.getsize(os.path.join(root, f)) for f in filenames)
+        else:
+            files, length = 1, os.path.getsize(local)
+        self._send(200, {'ContentSummary': {
+            'length': length, 'fileCount': files, 'directoryCount': dirs,
+            'quota': -1, 'spaceConsumed': length * 3, 'spaceQuota': -1}})
+
+    def op_mkdirs(self, hdfs_path, local, params):
+        if os.path.isfile(local):
+            return self._error(403, 'FileAlreadyExistsException', 'Path is a file: ' + hdfs_path)
+        os.makedirs(local, exist_ok=True)
+        self._send(200, {'boolean': True})
+
+    def op_delete(self, hdfs_path, local, params):
+        if os.path.isdir(local):
+            if params.get('recursive') == 'true':
+                shutil.rmtree(local)
+            elif os.listdir(local):
+                return self._error(403, 'PathIsNotEmptyDirectoryException', hdfs_path + ' is non empty')
+            else:
+                os.rmdir(local)
+        else:
+            os.remove(local)
+        self._send(200, {'boolean': True})
+
+    def op_rename(self, hdfs_path, local, params):
+        destination = params['destination']
+        local_destination = self.fake.local(destination)
+        if not os.path.exists(local) or not os.path.isdir(os.path.dirname(local_destination)):
+            return self._send(200, {'boolean': False})
+        if os.path.isdir(local_destination):
+            local_destination = os.path.join(local_destination, os.path.basename(local))
+        if os.path.exists(local_destination):
+            return self._send(200, {'boolean': False})
+        os.rename(local, local_destination)
+        self._send(200, {'boolean': True})
+
+    def op_open(self, hdfs_path, local, params):
+        if 'datanode' not in params:
+            location = '{}{}&datanode=true'.format(self.fake.url, self.path)
+            return self._send(307, headers={'Location': location})
+        with open(local, 'rb') as f:
+            f.seek(int(params.get('offset', 0)))
+            length = params.get('length')
+            data = f.read(int(length)) if length is not None else f.read()
+        self._send_bytes(data)
+
+    def op_setreplication(self, hdfs_path, local, params):
+        if os.path.isdir(local):
+            return self._send(200, {'boolean': False})
+        self.fake.replication[hdfs_path] = int(params['replication'])
+        self._send(200, {'boolean': True})
+
+    def op_setstoragepolicy(self, hdfs_path, local, params):
+        self.fake.storage_policies[hdfs_path] = params['storagepolicy']
+        self._send(200)
+
+    def op_getfilechecksum(self, hdfs_path, local, params):
+        if 'datanode' not in params:
+            location = '{}{}&datanode=true'.format(self.fake.url, self.path)
+            return self._send(307, headers={'Location': location})
+        if os.path.isdir(local):
+            return self._error(404, 'FileNotFoundException', 'Path is not a file: ' + hdfs_path)
+        if self.fake.checksum_combine_mode == 'COMPOSITE_CRC':
+            checksum = file_checksum(local)
+            return self._send(200, {'FileChecksum': {
+                'algorithm': checksum['algorithm'], 'bytes': checksum['checksum'], 'length': 4}})
+        # Not the actual MD5 of the block MD5s, but of the same form.
+        with open(local, 'rb') as f:
+            md5 = hashlib.md5(f.read()).hexdigest()
+        self._send(200, {'FileChecksum': {
+            'algorithm': 'MD5-of-0MD5-of-512CRC32C', 'bytes': '00000200' + '0' * 16 + md5, 'length': 28}})
+
+    def op_create(self, hdfs_path, local, params):
+        if 'datanode' not in params and params.get('data') != 'true':
+            self._body()
+            if os.path.exists(local) and params.get('overwrite') != 'true':
+                return self._error(403, 'FileAlreadyExistsException', hdfs_path + ' already exists')
+            location = '{}{}&datanode=true'.format(self.fake.url, self.path)
+            return self._send(307, headers={'Location': location})
+        data = self._body()
+        if os.path.exists(local) and params.get('overwrite') != 'true':
+            return self._error(403, 'FileAlreadyExistsException', hdfs_path + ' already exists')
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        with open(local, 'wb') as f:
+            f.write(data)
+        self._send(201, headers={'Location': 'hdfs://' + hdfs_path})
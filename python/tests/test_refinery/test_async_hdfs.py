@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+from unittest import TestCase
+
+from refinery.async_hdfs import AsyncHdfs
+from refinery.hdfs import Hdfs
+from refinery.sqoop import check_hdfs_path_or_exit
+
+
+class SlowBackend(object):
+    """
+    Backend answering ls after a delay, recording the maximum number
+    of concurrent calls.
+    """
+
+    def __init__(self, existing_paths, delay=0.05):
+        self.existing_paths = existing_paths
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self.removed = []
+        self.lock = threading.Lock()
+
+    def ls(self, paths, include_children=True):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        return [{'file_type': 'd', 'path': path} for path in paths if path in self.existing_paths]
+
+    def rm(self, paths, recurse=True, skip_trash=True):
+        self.removed += paths
+
+
+class TestAsyncHdfs(TestCase):
+    def setUp(self):
+        self.backend = SlowBackend({'/wmf/data/1', '/wmf/tmp/wmf/data/2'})
+        Hdfs.set_backend(self.backend)
+        AsyncHdfs.set_concurrency(8)
+
+    def tearDown(self):
+        Hdfs.set_backend(None)
+        AsyncHdfs.set_concurrency(16)
+
+    def test_concurrent_exists(self):
+        async def check(paths):
+            return await asyncio.gather(*[AsyncHdfs.exists(path) for path in paths])
+
+        paths = ['/wmf/data/{}'.format(i) for i in range(32)]
+        start = time.monotonic()
+        exists = asyncio.run(check(paths))
+        elapsed = time.monotonic() - start
+        self.assertEqual([p for p, e in zip(paths, exists) if e], ['/wmf/data/1'])
+        self.assertEqual(self.backend.max_running, 8)
+        # 4 rounds of 8 concurrent calls, instead of 32 serial ones.
+        self.assertLess(elapsed, 32 * self.backend.delay / 2)
+
+    def test_check_hdfs_path_or_exit(self):
+        check_hdfs_path_or_exit([2, 3], '/wmf/data/{table}', '/wmf/tmp', False, False)
+        self.assertEqual(self.backend.removed, ['/wmf/tmp/wmf/data/2'])
+        with self.assertRaises(SystemExit):
+            check_hdfs_path_or_exit([1], '/wmf/data/{table}', '/wmf/tmp', False, False)
+        check_hdfs_path_or_exit([1], '/wmf/data/{table}', '/wmf/tmp', True, False)
+        self.assertEqual(self.backend.removed, ['/wmf/tmp/wmf/data/2', '/wmf/data/1'])
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import zlib
+from unittest import TestCase
+
+from refinery.checksum import (COMPOSITE_CRC32, COMPOSITE_CRC32C, _crc32c_python,
+                               crc32c, file_checksum)
+
+
+class TestChecksum(TestCase):
+    def setUp(self):
+        f, self.path = tempfile.mkstemp()
+        with os.fdopen(f, 'wb') as f:
+            f.write(b'123456789' * 1000)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_crc32c(self):
+        self.assertEqual(crc32c(b'123456789'), 0xE3069283)
+        self.assertEqual(_crc32c_python(b'123456789'), 0xE3069283)
+        self.assertEqual(crc32c(b'6789', crc32c(b'12345')), 0xE3069283)
+        self.assertEqual(crc32c(b''), 0)
+
+    def test_file_checksum_is_chunk_size_independent(self):
+        expected = {'algorithm': COMPOSITE_CRC32C,
+                    'checksum': '{:08x}'.format(crc32c(b'123456789' * 1000))}
+        self.assertEqual(file_checksum(self.path), expected)
+        self.assertEqual(file_checksum(self.path, buffer_size=7), expected)
+
+    def test_file_checksum_crc32(self):
+        self.assertEqual(file_checksum(self.path, COMPOSITE_CRC32)['checksum'],
+                         '{:08x}'.format(zlib.crc32(b'123456789' * 1000)))
+
+    def test_unsupported_algorithm(self):
+        self.assertRaises(ValueError, file_checksum, self.path, 'MD5-of-0MD5-of-512CRC32C')
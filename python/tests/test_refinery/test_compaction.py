@@ -0,0 +1,144 @@
+import os
+import shutil
+from unittest import TestCase
+from mock import patch
+
+from fake_webhdfs import FakeWebHdfsServer
+from refinery.compaction import (compact_partitions, find_partitions_to_compact,
+                                 merge_tool_command, partition_tmp_paths, plan_merges)
+from refinery.hdfs import FileType, Hdfs, HdfsFileStatus
+from refinery.webhdfs import WebHdfsBackend
+
+
+class TestCompaction(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeWebHdfsServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.backend = WebHdfsBackend(self.server.url, user='analytics')
+        Hdfs.set_backend(self.backend)
+        # Partition a has 3 small files, b a single big one.
+        for partition, sizes in [('a', [10, 20, 30]), ('b', [1000])]:
+            path = self.server.local('/data/table/wiki_db={}'.format(partition))
+            os.makedirs(path)
+            for i, size in enumerate(sizes):
+                with open(os.path.join(path, 'part-m-{:05d}.avro'.format(i)), 'w') as f:
+                    f.write(str(i) * size)
+            open(os.path.join(path, '_SUCCESS'), 'w').close()
+
+    def tearDown(self):
+        Hdfs.set_backend(None)
+        self.backend.pool.close()
+        for path in ['/data', '/tmp', '/user']:
+            shutil.rmtree(self.server.local(path), ignore_errors=True)
+
+    def concat(self, command, **kwargs):
+        # Stand-in for the merge tool: concatenates inputs into output.
+        inputs, output = command[4:-1], command[-1]
+        with open(self.server.local(output), 'w') as out:
+            for path in inputs:
+                with open(self.server.local(path)) as f:
+                    out.write(f.read())
+
+    def test_merge_tool_command(self):
+        self.assertEqual(merge_tool_command('parquet', 'tools.jar'),
+                         ['hadoop', 'jar', 'tools.jar', 'merge'])
+        self.assertRaises(ValueError, merge_tool_command, 'text', 'tools.jar')
+
+    def test_partition_tmp_paths(self):
+        self.assertEqual(partition_tmp_paths('/data/table/wiki_db=a', '/tmp/compaction'),
+                         ('/tmp/compaction/merged/data/table/wiki_db=a',
+                          '/tmp/compaction/backup/data/table/wiki_db=a'))
+        self.assertEqual(partition_tmp_paths('hdfs://analytics-hadoop/data/t/p=1', '/tmp/c')[0],
+                         '/tmp/c/merged/analytics-hadoop/data/t/p=1')
+        self.assertNotEqual(partition_tmp_paths('/data/table/wiki_db=a-b', '/tmp/c'),
+                            partition_tmp_paths('/data/table/wiki_db=ab', '/tmp/c'))
+
+    def test_plan_merges(self):
+        files = [HdfsFileStatus('/p/{}'.format(i), FileType.FILE, size, 0)
+                 for i, size in enumerate([5, 5, 20, 3, 3])]
+        self.assertEqual([[f.path for f in group] for group in plan_merges(files, 10)],
+                         [['/p/0', '/p/1'], ['/p/2'], ['/p/3', '/p/4']])
+
+    def test_find_partitions_to_compact(self):
+        partitions = find_partitions_to_compact('/data/table/wiki_db=*', min_average_size=100)
+        self.assertEqual(list(partitions), ['/data/table/wiki_db=a'])
+        self.assertEqual(len(partitions['/data/table/wiki_db=a']), 3)
+
+    def test_partitions_with_folders_are_not_compacted(self):
+        os.makedirs(self.server.local('/data/table/wiki_db=a/_temporary/0'))
+        self.assertEqual(find_partitions_to_compact('/data/table/wiki_db=*', min_average_size=100), {})
+
+    @patch('refinery.compaction.check_call')
+    def test_compaction_of_partition_with_new_folder_fails(self, check_call):
+        def concat_while_written(command, **kwargs):
+            self.concat(command)
+            os.makedirs(self.server.local('/data/table/wiki_db=a/sub'))
+
+        check_call.side_effect = concat_while_written
+        partitions = find_partitions_to_compact('/data/table/wiki_db=*', min_average_size=100)
+        failed = compact_partitions(partitions, merge_tool_command('avrodata', 'tools.jar'),
+                                    target_size=1000, tmp_base_path='/tmp/compaction')
+        self.assertEqual(failed, ['/data/table/wiki_db=a'])
+        self.assertEqual(len(Hdfs.ls('/data/table/wiki_db=a')), 5)
+
+    @patch('refinery.compaction.check_call')
+    def test_compact_partitions(self, check_call):
+        check_call.side_effect = self.concat
+        partitions = find_partitions_to_compact('/data/table/wiki_db=*', min_average_size=100)
+        failed = compact_partitions(partitions, merge_tool_command('avrodata', 'tools.jar'),
+                                    target_size=35, tmp_base_path='/tmp/compaction', workers=2)
+        self.assertEqual(failed, [])
+        self.assertEqual(check_call.call_count, 1)
+        self.assertEqual(Hdfs.ls('/data/table/wiki_db=a'), [
+            '/data/table/wiki_db=a/_SUCCESS',
+            '/data/table/wiki_db=a/part-c-00000.avro',
+            '/data/table/wiki_db=a/part-c-00001.avro'])
+        self.assertEqual(Hdfs.cat('/data/table/wiki_db=a/part-c-00000.avro'), '0' * 10 + '1' * 20)
+        self.assertEqual(list(Hdfs.find('/tmp/compaction', file_type=FileType.FILE)), [])
+        # The original partition is in the trash
+        self.assertEqual(len(Hdfs.ls(
+            '/user/analytics/.Trash/Current/tmp/compaction/backup/data/table/wiki_db=a')), 4)
+
+    @patch('refinery.compaction.check_call')
+    def test_compaction_with_truncated_merge_fails(self, check_call):
+        def truncated_concat(command, **kwargs):
+            self.concat(command)
+            with open(self.server.local(command[-1]), 'w') as f:
+                f.write('0')
+
+        check_call.side_effect = truncated_concat
+        partitions = find_partitions_to_compact('/data/table/wiki_db=*', min_average_size=100)
+        failed = compact_partitions(partitions, merge_tool_command('avrodata', 'tools.jar'),
+                                    target_size=1000, tmp_base_path='/tmp/compaction')
+        self.assertEqual(failed, ['/data/table/wiki_db=a'])
+        self.assertEqual(len(Hdfs.ls('/data/table/wiki_db=a')), 4)
+        self.assertEqual(list(Hdfs.find('/tmp/compaction', file_type=FileType.FILE)), [])
+
+    @patch('refinery.compaction.check_call')
+    def test_compaction_of_changed_partition_fails(self, check_call):
+        def concat_while_written(command, **kwargs):
+            self.concat(command)
+            with open(self.server.local('/data/table/wiki_db=a/part-m-00003.avro'), 'w') as f:
+                f.write('late')
+
+        check_call.side_effect = concat_while_written
+        partitions = find_partitions_to_compact('/data/table/wiki_db=*', min_average_size=100)
+        failed = compact_partitions(partitions, merge_tool_command('avrodata', 'tools.jar'),
+                                    target_size=1000, tmp_base_path='/tmp/compaction')
+        self.assertEqual(failed, ['/data/table/wiki_db=a'])
+        self.assertEqual(len(Hdfs.ls('/data/table/wiki_db=a')), 5)
+
+    @patch('refinery.compaction.check_call', side_effect=RuntimeError('merge failed'))
+    def test_failed_compaction_leaves_partition_untouched(self, check_call):
+        partitions = find_partitions_to_compact('/data/table/wiki_db=*', min_average_size=100)
+        failed = compact_partitions(partitions, merge_tool_command('avrodata', 'tools.jar'),
+                                    target_size=1000, tmp_base_path='/tmp/compaction')
+        self.assertEqual(failed, ['/data/table/wiki_db=a'])
+        self.assertEqual(len(Hdfs.ls('/data/table/wiki_db=a')), 4)
+        self.assertEqual(list(Hdfs.find('/tmp/compaction', file_type=FileType.FILE)), [])
@@ -0,0 +1,70 @@
+from unittest import TestCase
+from mock import patch
+
+from refinery.flag_waiter import (FlagsTimeoutError, existing_flags, iter_appearing_flags,
+                                  wait_for_flags)
+from refinery.hdfs import FileType, Hdfs, HdfsFileStatus
+
+
+class FakeBackend(object):
+    """
+    Backend listing the files of a set of paths, recording listed
+    and stat-ed paths.
+    """
+
+    def __init__(self, files):
+        self.files = set(files)
+        self.listings = []
+        self.stats = []
+
+    def stat(self, paths):
+        self.stats.append(paths)
+        return {path: {} if path in self.files else None for path in paths}
+
+    def iter_ls(self, paths, include_children=True, recursive=False):
+        self.listings.append(paths)
+        for path in sorted(self.files):
+            if path.rsplit('/', 1)[0] in paths:
+                yield HdfsFileStatus(path, FileType.FILE, 0, 0)
+
+
+class TestFlagWaiter(TestCase):
+    def setUp(self):
+        self.backend = FakeBackend(['/wmf/a/_SUCCESS', '/wmf/a/part-0', '/wmf/b/part-0'])
+        Hdfs.set_backend(self.backend)
+
+    def tearDown(self):
+        Hdfs.set_backend(None)
+
+    def test_existing_flags_grouped_by_parent(self):
+        self.backend.files.add('/wmf/c/_IMPORTED')
+        self.assertEqual(existing_flags([
+            '/wmf/a/_SUCCESS', '/wmf/b/_SUCCESS', '/wmf/c/_SUCCESS', '/wmf/c/_IMPORTED',
+            '/wmf/d/_SUCCESS', '/wmf/d/_IMPORTED']), {'/wmf/a/_SUCCESS', '/wmf/c/_IMPORTED'})
+        self.assertEqual(self.backend.listings, [['/wmf/c', '/wmf/d']])
+        self.assertEqual(self.backend.stats, [['/wmf/a/_SUCCESS', '/wmf/b/_SUCCESS']])
+
+    @patch('refinery.flag_waiter.time.sleep')
+    def test_iter_appearing_flags_with_backoff(self, sleep):
+        # Flags appear while sleeping.
+        appearing = [[], ['/wmf/b/_SUCCESS'], [], ['/wmf/c/_SUCCESS']]
+        sleep.side_effect = lambda seconds: self.backend.files.update(appearing.pop(0))
+        flags = iter_appearing_flags(['/wmf/a/_SUCCESS', '/wmf/b/_SUCCESS', '/wmf/c/_SUCCESS'],
+                                     initial_interval=1, backoff=3)
+        self.assertEqual(list(flags), ['/wmf/a/_SUCCESS', '/wmf/b/_SUCCESS', '/wmf/c/_SUCCESS'])
+        self.assertEqual([c[0][0] for c in sleep.call_args_list], [1, 3, 1, 3])
+        # Found flags are not polled again.
+        self.assertEqual(self.backend.stats[-1], ['/wmf/c/_SUCCESS'])
+
+    @patch('refinery.flag_waiter.time')
+    def test_timeout(self, time):
+        time.monotonic.side_effect = [0, 5, 11]
+        callback_paths = []
+        self.assertFalse(wait_for_flags(['/wmf/a/_SUCCESS', '/wmf/b/_SUCCESS'],
+                                        callback=callback_paths.append, timeout=10))
+        self.assertEqual(callback_paths, ['/wmf/a/_SUCCESS'])
+        time.sleep.assert_called_once_with(5)
+        time.monotonic.side_effect = [0, 11]
+        with self.assertRaises(FlagsTimeoutError) as context:
+            list(iter_appearing_flags(['/wmf/b/_SUCCESS'], timeout=10))
+        self.assertEqual(context.exception.missing, {'/wmf/b/_SUCCESS'})
@@ -0,0 +1,148 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from mock import patch
+
+from refinery.fsimage import FsImageIndex, build_index, convert_to_tsv
+from refinery.hdfs import FileType
+
+
+def inode(inode_id, inode_type, name, mtime, permission, blocks=(), replication=3):
+    blocks_xml = ''.join('<block><id>{}</id><genstamp>1</genstamp><numBytes>{}</numBytes></block>'.format(
+        inode_id * 10 + i, size) for i, size in enumerate(blocks))
+    if inode_type == 'FILE':
+        return ('<inode><id>{}</id><type>FILE</type><name>{}</name><replication>{}</replication>'
+                '<mtime>{}</mtime><atime>{}</atime><preferredBlockSize>134217728</preferredBlockSize>'
+                '<permission>{}</permission><blocks>{}</blocks><storagePolicyId>0</storagePolicyId></inode>'
+                ).format(inode_id, name, replication, mtime, mtime, permission, blocks_xml)
+    return ('<inode><id>{}</id><type>{}</type><name>{}</name><mtime>{}</mtime>'
+            '<permission>{}</permission><nsquota>-1</nsquota><dsquota>-1</dsquota></inode>'
+            ).format(inode_id, inode_type, name, mtime, permission)
+
+
+# 2022-01-01 and 2022-06-01 in milliseconds
+OLD, NEW = 1640995200000, 1654041600000
+
+FSIMAGE_XML = ''.join([
+    '<?xml version="1.0"?><fsimage><version><layoutVersion>-64</layoutVersion></version>',
+    '<NameSection><namespaceId>1</namespaceId></NameSection>',
+    '<INodeSection><lastInodeId>16395</lastInodeId><numInodes>9</numInodes>',
+    inode(16385, 'DIRECTORY', '', NEW, 'hdfs:hadoop:0755'),
+    inode(16386, 'DIRECTORY', 'wmf', NEW, 'hdfs:hadoop:0755'),
+    inode(16387, 'DIRECTORY', 'data', NEW, 'analytics:analytics-privatedata-users:0750'),
+    inode(16388, 'FILE', 'a', OLD, 'analytics:hadoop:0644', blocks=[100, 50]),
+    inode(16389, 'DIRECTORY', 'b', OLD, 'analytics:hadoop:0755'),
+    inode(16390, 'FILE', 'part-0', OLD, 'hdfs:hadoop:0644', blocks=[10], replication=2),
+    inode(16391, 'FILE', 'b-c', NEW, 'analytics:hadoop:0644', blocks=[1]),
+    inode(16392, 'SYMLINK', 'link', NEW, 'hdfs:hadoop:0777'),
+    inode(16393, 'DIRECTORY', 'tmp', NEW, 'hdfs:hadoop:1777'),
+    '</INodeSection>',
+    '<INodeDirectorySection>',
+    '<directory><parent>16385</parent><child>16393</child><child>16386</child></directory>',
+    '<directory><parent>16386</parent><child>16387</child><child>16392</child></directory>',
+    '<directory><parent>16387</parent><child>16391</child><child>16389</child><child>16388</child></directory>',
+    '<directory><parent>16389</parent><child>16390</child></directory>',
+    '</INodeDirectorySection>',
+    '<SnapshotDiffSection><dirDiffEntry><deleted><inode>16390</inode></deleted></dirDiffEntry></SnapshotDiffSection>',
+    '</fsimage>',
+])
+
+
+class TestFsImageIndex(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.tmp_dir, 'fsimage.idx')
+        self.assertEqual(build_index(io.BytesIO(FSIMAGE_XML.encode('utf-8')), self.index_path), 8)
+        self.index = FsImageIndex(self.index_path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_ls(self):
+        self.assertEqual([s.path for s in self.index.ls('/')], ['/tmp', '/wmf'])
+        statuses = self.index.ls('/wmf/data/')
+        self.assertEqual([s.path for s in statuses], ['/wmf/data/a', '/wmf/data/b', '/wmf/data/b-c'])
+        self.assertEqual(statuses[0].file_type, FileType.FILE)
+        self.assertEqual(statuses[0].size, 150)
+        self.assertEqual(statuses[0].mtime, OLD // 1000)
+        self.assertEqual(statuses[0].permission, 'rw-r--r--')
+        self.assertEqual((statuses[0].owner, statuses[0].group), ('analytics', 'hadoop'))
+        self.assertEqual(statuses[1].file_type, 'd')
+        self.assertEqual(self.index.ls('/wmf/data', include_children=False)[0].permission, 'rwxr-x---')
+        self.assertEqual(self.index.stat('/tmp').permission, 'rwxrwxrwt')
+        self.assertEqual(self.index.ls('/wmf/data/a')[0].path, '/wmf/data/a')
+        self.assertEqual(self.index.ls('/wmf/missing'), [])
+        self.assertIsNone(self.index.stat('/wmf/link'))
+
+    def test_du_and_count(self):
+        self.assertEqual(self.index.du('/'), 161)
+        self.assertEqual(self.index.du('/wmf/data/b'), 10)
+        self.assertIsNone(self.index.du('/missing'))
+        self.assertEqual(self.index.count('/wmf'),
+                         {'directory_count': 3, 'file_count': 3, 'content_size': 161})
+
+    def test_find(self):
+        self.assertEqual([s.path for s in self.index.find('/wmf', older_than=datetime(2022, 3, 1))],
+                         ['/wmf/data/a', '/wmf/data/b', '/wmf/data/b/part-0'])
+        self.assertEqual([s.path for s in self.index.find(file_type=FileType.DIRECTORY)],
+                         ['/', '/tmp', '/wmf', '/wmf/data', '/wmf/data/b'])
+
+    def test_usage_by_owner(self):
+        self.assertEqual(self.index.usage_by_owner(), {
+            'analytics': {'file_count': 2, 'content_size': 151, 'space_consumed': 453},
+            'hdfs': {'file_count': 1, 'content_size': 10, 'space_consumed': 20},
+        })
+
+    def test_invalid_index(self):
+        with open(self.index_path + '.bad', 'wb') as f:
+            f.write(b'not an index')
+        self.assertRaises(ValueError, FsImageIndex, self.index_path + '.bad')
+
+
+class TestConvertToTsv(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_rows(self, folder):
+        rows = []
+        for name in sorted(os.listdir(folder)):
+            with gzip.open(os.path.join(folder, name), 'rt') as f:
+                rows += [line.rstrip('\n').split('\t') for line in f]
+        return rows
+
+    def test_convert_to_tsv(self):
+        xml = FSIMAGE_XML.replace('<name>b-c</name>', '<name>b\tc</name>')
+        counts = convert_to_tsv(io.BytesIO(xml.encode('utf-8')), self.tmp_dir, rows_per_chunk=4, to_hdfs=False)
+        self.assertEqual(counts, {'inodes': 9, 'directories': 8})
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmp_dir, 'inodes'))),
+                         ['part-00000.tsv.gz', 'part-00001.tsv.gz', 'part-00002.tsv.gz'])
+        inodes = self.read_rows(os.path.join(self.tmp_dir, 'inodes'))
+        self.assertEqual(inodes[3], ['16388', 'FILE', 'a', '3', str(OLD), str(OLD), '134217728',
+                                     'analytics', 'hadoop', '0644', '150', '2', '', '', '0'])
+        self.assertEqual(inodes[6][2], 'b\\tc')
+        self.assertEqual(inodes[0][:3], ['16385', 'DIRECTORY', ''])
+        self.assertEqual(inodes[0][12:14], ['-1', '-1'])
+        directories = self.read_rows(os.path.join(self.tmp_dir, 'directories'))
+        self.assertEqual(directories[:3], [['16385', '16393'], ['16385', '16386'], ['16386', '16387']])
+
+    @patch('refinery.fsimage.Hdfs')
+    def test_convert_to_hdfs(self, hdfs):
+        convert_to_tsv(io.BytesIO(FSIMAGE_XML.encode('utf-8')), '/wmf/data/fsimage', rows_per_chunk=5)
+        hdfs.mkdir.assert_any_call('/wmf/data/fsimage/inodes', create_parent=True)
+        self.assertEqual([c[0][1] for c in hdfs.put.call_args_list], [
+            '/wmf/data/fsimage/inodes/part-00000.tsv.gz',
+            '/wmf/data/fsimage/directories/part-00000.tsv.gz',
+            '/wmf/data/fsimage/directories/part-00001.tsv.gz',
+            '/wmf/data/fsimage/inodes/part-00001.tsv.gz',
+        ])
+        # Local chunks are removed once uploaded
+        self.assertFalse(any(os.path.exists(c[0][0]) for c in hdfs.put.call_args_list))
@@ -0,0 +1,576 @@
+import bz2
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timezone
+from unittest import TestCase
+from mock import patch
+
+from fake_webhdfs import FakeWebHdfsServer
+from refinery.checksum import file_checksum
+from refinery.fsshell_worker import FsShellWorkerBackend
+from refinery.hdfs import (FileType, Hdfs, HdfsCliBackend, HdfsListingCache,
+                           RsyncManifest, backend_from_config, cache_prefix,
+                           chunk_arguments)
+from refinery.webhdfs import WebHdfsBackend, expand_braces, permission_string
+
+
+LS_OUTPUT = '''Found 2 items
+drwxr-xr-x   - hdfs hadoop          0 2023-04-13 08:12 /wmf/data/dataset/2023
+-rw-r--r--   3 hdfs hadoop       1234 2023-04-13 08:13 /wmf/data/dataset/_SUCCESS'''
+
+
+class TestHdfsCliBackend(TestCase):
+    def setUp(self):
+        Hdfs.set_backend(HdfsCliBackend())
+
+    def tearDown(self):
+        Hdfs.set_backend(None)
+
+    @patch('refinery.hdfs.sh', return_value=LS_OUTPUT)
+    def test_ls(self, sh):
+        self.assertEqual(
+            Hdfs.ls('/wmf/data/dataset'),
+            ['/wmf/data/dataset/2023', '/wmf/data/dataset/_SUCCESS'])
+        sh.assert_called_with(['hdfs', 'dfs', '-ls', '/wmf/data/dataset'], check_return_code=False)
+
+    @patch('refinery.hdfs.sh', return_value=LS_OUTPUT)
+    def test_ls_with_details(self, sh):
+        details = Hdfs.ls('/wmf/data/dataset', include_children=False, with_details=True)
+        sh.assert_called_with(['hdfs', 'dfs', '-ls', '-d', '/wmf/data/dataset'], check_return_code=False)
+        self.assertEqual(details[1], {
+            'file_type': 'f',
+            'permission': 'rw-r--r--',
+            'replication': '3',
+            'owner': 'hdfs',
+            'group': 'hadoop',
+            'file_size': '1234',
+            'modification_date': '2023-04-13',
+            'modification_time': '08:13',
+            'path': '/wmf/data/dataset/_SUCCESS'
+        })
+
+    @patch('refinery.hdfs.sh_lines', return_value=iter(LS_OUTPUT.splitlines()))
+    def test_iter_ls(self, sh_lines):
+        statuses = Hdfs.iter_ls('/wmf/data/dataset')
+        self.assertFalse(sh_lines.called)
+        statuses = list(statuses)
+        sh_lines.assert_called_with(['hdfs', 'dfs', '-ls', '/wmf/data/dataset'], check_return_code=False)
+        self.assertEqual([s.path for s in statuses], ['/wmf/data/dataset/2023', '/wmf/data/dataset/_SUCCESS'])
+        self.assertEqual(statuses[0].file_type, FileType.DIRECTORY)
+        self.assertTrue(statuses[0].is_directory())
+        self.assertEqual(statuses[1].file_type, 'f')
+        self.assertEqual(statuses[1].size, 1234)
+        self.assertEqual(statuses[1].replication, 3)
+        self.assertEqual(statuses[1].mtime, int(datetime(2023, 4, 13, 8, 13, tzinfo=timezone.utc).timestamp()))
+
+    @patch('refinery.hdfs.sh', return_value='')
+    def test_rm(self, sh):
+        Hdfs.rm('/a /b', skip_trash=False)
+        sh.assert_called_with(['hdfs', 'dfs', '-rm', '-R', '/a', '/b'], check_return_code=True)
+
+    @patch('refinery.hdfs.sh', return_value='')
+    def test_bulk_mv(self, sh):
+        Hdfs.mv(
+            ['/tmp/a/1', '/tmp/a/2', '/tmp/b/1'],
+            ['/data/a/1', '/data/a/2', '/data/b/1'],
+            bulk=True)
+        self.assertEqual([c[0][0] for c in sh.call_args_list], [
+            ['hdfs', 'dfs', '-mkdir', '-p', '/data/a', '/data/b'],
+            ['hdfs', 'dfs', '-mv', '/tmp/a/1', '/tmp/a/2', '/data/a'],
+            ['hdfs', 'dfs', '-mv', '/tmp/b/1', '/data/b'],
+        ])
+
+    @patch('refinery.hdfs.sh', return_value='')
+    def test_bulk_mv_renaming(self, sh):
+        Hdfs.mv(['/tmp/a', '/tmp/b'], ['/data/x/a2', '/data/x/b2'], inParent=False, bulk=True)
+        self.assertEqual([c[0][0] for c in sh.call_args_list], [
+            ['hdfs', 'dfs', '-mkdir', '-p', '/data/x'],
+            ['hdfs', 'dfs', '-mv', '/tmp/a', '/data/x/a2'],
+            ['hdfs', 'dfs', '-mv', '/tmp/b', '/data/x/b2'],
+        ])
+
+    @patch('refinery.hdfs.sh', return_value='')
+    def test_put_multiple_files(self, sh):
+        Hdfs.put(['/tmp/a', '/tmp/b'], '/data', force=True)
+        sh.assert_called_with(['hdfs', 'dfs', '-put', '-f', '/tmp/a', '/tmp/b', '/data'],
+                              check_return_code=True)
+
+    @patch('refinery.hdfs.sh_lines', return_value=iter(LS_OUTPUT.splitlines()[1:]))
+    def test_recursive_hdfs_tree(self, sh_lines):
+        self.assertEqual(sorted(Hdfs._get_hdfs_tree('/wmf/data/dataset/')), ['2023', '_SUCCESS'])
+        sh_lines.assert_called_with(['hdfs', 'dfs', '-ls', '-R', '/wmf/data/dataset/'], check_return_code=False)
+
+    def test_open(self):
+        # A backend whose `-cat path` runs the local cat.
+        Hdfs.set_backend(HdfsCliBackend(['sh', '-c', 'shift; cat "$@"', 'sh']))
+        local_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, local_dir)
+        path = os.path.join(local_dir, 'data.tsv.gz')
+        with gzip.open(path, 'wt') as f:
+            for i in range(10000):
+                f.write('{}\tvalue\n'.format(i))
+
+        with Hdfs.open(path, 'r') as f:
+            self.assertEqual(next(f), '0\tvalue\n')
+            self.assertEqual(sum(1 for _ in f), 9999)
+        with Hdfs.open(path, compression=None) as f:
+            self.assertEqual(f.read(2), b'\x1f\x8b')
+        with Hdfs.open(os.path.join(local_dir, 'missing')) as f:
+            self.assertRaises(RuntimeError, f.read)
+        self.assertRaises(ValueError, Hdfs.open, path, 'w')
+
+    @patch('refinery.hdfs.sh', return_value=(
+        'directory\t0\t0\t1681373520000\nregular file\t1234\t3\t1681373580000',
+        "stat: `/wmf/missing': No such file or directory"))
+    def test_stat(self, sh):
+        stats = Hdfs.stat(['/wmf/data/dataset/2023', '/wmf/missing', '/wmf/data/dataset/_SUCCESS'])
+        sh.assert_called_once_with(
+            ['hdfs', 'dfs', '-stat', '%F\t%b\t%r\t%Y', '/wmf/data/dataset/2023',
+             '/wmf/missing', '/wmf/data/dataset/_SUCCESS'],
+            check_return_code=False, return_stderr=True)
+        self.assertIsNone(stats['/wmf/missing'])
+        self.assertEqual(stats['/wmf/data/dataset/2023']['file_type'], 'd')
+        self.assertEqual(stats['/wmf/data/dataset/_SUCCESS'], {
+            'file_type': 'f', 'size': 1234, 'replication': 3,
+            'modified_datetime': datetime(2023, 4, 13, 8, 13, tzinfo=timezone.utc)})
+
+    @patch('refinery.hdfs.sh', return_value=('', "stat: Permission denied: user=nobody"))
+    def test_stat_error(self, sh):
+        self.assertRaises(RuntimeError, Hdfs.stat, '/wmf/data')
+
+    @patch('refinery.hdfs.sh')
+    def test_du_and_count(self, sh):
+        sh.return_value = ('1234  3702  /wmf/data/a\n0  0  /wmf/data/b c',
+                           "du: `/wmf/missing': No such file or directory")
+        self.assertEqual(Hdfs.du(['/wmf/data/a/', '/wmf/data/b c', '/wmf/missing']),
+                         {'/wmf/data/a/': 1234, '/wmf/data/b c': 0, '/wmf/missing': None})
+        sh.return_value = ('           2            3               1234 /wmf/data/a', '')
+        self.assertEqual(Hdfs.count('/wmf/data/a /wmf/missing'), {
+            '/wmf/data/a': {'directory_count': 2, 'file_count': 3, 'content_size': 1234},
+            '/wmf/missing': None})
+
+    @patch('refinery.hdfs.sh', return_value=(
+        '/wmf/data/a\tCOMPOSITE-CRC32C\te3069283',
+        "checksum: `/wmf/missing': No such file or directory"))
+    def test_checksum(self, sh):
+        self.assertEqual(Hdfs.checksum('/wmf/data/a /wmf/missing'), {
+            '/wmf/data/a': {'algorithm': 'COMPOSITE-CRC32C', 'checksum': 'e3069283'},
+            '/wmf/missing': None})
+        sh.assert_called_once_with(
+            ['hdfs', 'dfs', '-Ddfs.checksum.combine.mode=COMPOSITE_CRC', '-checksum',
+             '/wmf/data/a', '/wmf/missing'],
+            check_return_code=False, return_stderr=True)
+
+    @patch('refinery.hdfs.sh', return_value='')
+    def test_setrep_and_storage_policy(self, sh):
+        Hdfs.setrep('/wmf/data/a /wmf/data/b', 2)
+        sh.assert_called_with(['hdfs', 'dfs', '-setrep', '2', '/wmf/data/a', '/wmf/data/b'],
+                              check_return_code=True)
+        Hdfs.set_storage_policy('/wmf/data/a', 'COLD')
+        sh.assert_called_with(['hdfs', 'storagepolicies', '-setStoragePolicy',
+                               '-path', '/wmf/data/a', '-policy', 'COLD'])
+
+    def test_chunk_arguments(self):
+        self.assertEqual(chunk_arguments(['aaa', 'bbb', 'ccc', 'dddddddd'], max_length=8),
+                         [['aaa', 'bbb'], ['ccc'], ['dddddddd']])
+        self.assertEqual(chunk_arguments([]), [])
+
+    def test_listing_cache_expiry_and_eviction(self):
+        cache = HdfsListingCache(ttl=0)
+        cache.put('key', ['/a'], ['value'])
+        self.assertIsNone(cache.get('key'))
+        cache = HdfsListingCache(max_entries=2)
+        for key in ('k1', 'k2', 'k3'):
+            cache.put(key, ['/a/' + key], [key])
+        self.assertIsNone(cache.get('k1'))
+        self.assertEqual(cache.get('k3'), ['k3'])
+        self.assertEqual(cache.stats()['evictions'], 1)
+        cache.invalidate(['/a/k2/file'])
+        self.assertIsNone(cache.get('k2'))
+        cache.invalidate(['/a/k'])
+        self.assertEqual(cache.get('k3'), ['k3'])
+
+    def test_cache_prefix(self):
+        self.assertEqual(cache_prefix('/wmf/data/'), '/wmf/data')
+        self.assertEqual(cache_prefix('hdfs://analytics/wmf/data'), '/wmf/data')
+        self.assertEqual(cache_prefix('/wmf/*/data'), '/wmf')
+        self.assertEqual(cache_prefix('/*'), '/')
+
+    def test_backend_from_config(self):
+        self.assertIsInstance(backend_from_config({}), HdfsCliBackend)
+        backend = backend_from_config({'hdfs.backend': 'webhdfs', 'webhdfs.url': 'http://nn:9870/'})
+        self.assertIsInstance(backend, WebHdfsBackend)
+        self.assertEqual(backend.url, 'http://nn:9870')
+        self.assertRaises(ValueError, backend_from_config, {'hdfs.backend': 'webhdfs'})
+        self.assertRaises(ValueError, backend_from_config, {'hdfs.backend': 'unknown'})
+
+
+class TestWebHdfsBackend(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeWebHdfsServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.backend = WebHdfsBackend(self.server.url, user='analytics')
+        Hdfs.set_backend(self.backend)
+        self.local_dir = tempfile.mkdtemp()
+        Hdfs.mkdir('/data/2023/04 /data/2023/05')
+        self.local_file = os.path.join(self.local_dir, 'part-0')
+        with open(self.local_file, 'w') as f:
+            f.write('hello\n')
+
+    def tearDown(self):
+        Hdfs.set_backend(None)
+        self.backend.pool.close()
+        shutil.rmtree(self.local_dir)
+        shutil.rmtree(self.server.local('/data'), ignore_errors=True)
+        shutil.rmtree(self.server.local('/user'), ignore_errors=True)
+
+    def test_ls(self):
+        self.assertEqual(Hdfs.ls('/data/2023'), ['/data/2023/04', '/data/2023/05'])
+        self.assertEqual(Hdfs.ls('/data/2023', include_children=False), ['/data/2023'])
+        self.assertEqual(Hdfs.ls('/data/missing'), [])
+
+    def test_iter_ls(self):
+        Hdfs.put(self.local_file, '/data/2023/04')
+        del self.server.requests[:]
+        self.server.list_batch_size = 1
+        try:
+            statuses = list(Hdfs.iter_ls('/data/2023 /data/2023/04/part-0'))
+        finally:
+            self.server.list_batch_size = 1000
+        self.assertEqual([s.path for s in statuses], ['/data/2023/04', '/data/2023/05', '/data/2023/04/part-0'])
+        self.assertEqual([s.file_type for s in statuses], [FileType.DIRECTORY, FileType.DIRECTORY, FileType.FILE])
+        self.assertEqual(statuses[2].size, 6)
+        self.assertEqual(statuses[2].permission, 'rw-r--r--')
+        self.assertEqual(self.server.ops().count('LISTSTATUS_BATCH'), 2)
+
+    def test_ls_glob(self):
+        Hdfs.put(self.local_file, '/data/2023/04')
+        self.assertEqual(Hdfs.ls('/data/*/0[45]', include_children=False),
+                         ['/data/2023/04', '/data/2023/05'])
+        self.assertEqual(Hdfs.ls('/data/2023/{04,05}/*'), ['/data/2023/04/part-0'])
+
+    def test_ls_glob_keeps_scheme(self):
+        Hdfs.put(self.local_file, '/data/2023/04')
+        self.assertEqual(Hdfs.ls('hdfs://analytics-hadoop/data/*/0[45]', include_children=False),
+                         ['hdfs://analytics-hadoop/data/2023/04', 'hdfs://analytics-hadoop/data/2023/05'])
+        self.assertEqual(Hdfs.ls('hdfs://analytics-hadoop/data/2023/04'),
+                         ['hdfs://analytics-hadoop/data/2023/04/part-0'])
+        Hdfs.rm('hdfs://analytics-hadoop/data/2023/0*', skip_trash=False)
+        self.assertEqual(Hdfs.ls('/user/analytics/.Trash/Current/data/2023'),
+                         ['/user/analytics/.Trash/Current/data/2023/04',
+                          '/user/analytics/.Trash/Current/data/2023/05'])
+
+    def test_put_get_cat(self):
+        Hdfs.put(self.local_file, '/data/2023/04')
+        details = Hdfs.ls('/data/2023/04', with_details=True)
+        self.assertEqual(len(details), 1)
+        self.assertEqual(details[0]['file_type'], 'f')
+        self.assertEqual(details[0]['file_size'], '6')
+        self.assertEqual(details[0]['path'], '/data/2023/04/part-0')
+        self.assertEqual(Hdfs.cat('/data/2023/04/part-0'), 'hello')
+        self.assertRaises(RuntimeError, Hdfs.put, self.local_file, '/data/2023/04')
+        Hdfs.put(self.local_file, '/data/2023/04', force=True)
+
+        local_copy = os.path.join(self.local_dir, 'copy')
+        Hdfs.get('/data/2023/04/part-0', local_copy)
+        with open(local_copy) as f:
+            self.assertEqual(f.read(), 'hello\n')
+
+    def test_rsync_parallel_batches(self):
+        for i in range(5):
+            with open(os.path.join(self.local_dir, 'part-{}'.format(i)), 'w') as f:
+                f.write('x' * i)
+        Hdfs.put(os.path.join(self.local_dir, 'part-2'), '/data/2023/04')
+        Hdfs.touchz('/data/2023/04/part-3 /data/2023/04/extra')
+        del self.server.requests[:]
+        self.assertTrue(Hdfs.rsync(self.local_dir, '/data/2023/04', should_delete=True,
+                                   dry_run=False, workers=2, batch_size=2))
+        self.assertEqual(Hdfs.ls('/data/2023/04'),
+                         ['/data/2023/04/part-{}'.format(i) for i in range(5)])
+        self.assertEqual(Hdfs.cat('/data/2023/04/part-4'), 'xxxx')
+        self.assertEqual(self.server.ops().count('CREATE'), 4)
+        self.assertEqual(self.server.ops().count('DELETE'), 2)
+
+    def test_rsync_connection_error(self):
+        # Transport errors fail their batch instead of escaping rsync.
+        with patch.object(Hdfs, 'put', side_effect=ConnectionResetError('reset by peer')):
+            with self.assertLogs('hdfs-util', 'ERROR'):
+                self.assertFalse(Hdfs.rsync(self.local_dir, '/data/2023/04', dry_run=False))
+
+    def test_rsync_manifest(self):
+        manifest_path = self.local_dir + '.manifest'
+        self.addCleanup(os.remove, manifest_path)
+        self.assertTrue(Hdfs.rsync(self.local_dir, '/data/2023/04', dry_run=False,
+                                   manifest_path=manifest_path))
+        self.assertTrue(RsyncManifest(manifest_path).is_verified(
+            Hdfs._get_local_files(self.local_file)['part-0']))
+
+        # Files verified by the first run are neither compared nor copied
+        with open(os.path.join(self.local_dir, 'part-1'), 'w') as f:
+            f.write('world\n')
+        Hdfs.touchz('/data/2023/04/_manifest_trusted')
+        Hdfs.rm('/data/2023/04/part-0')
+        del self.server.requests[:]
+        self.assertTrue(Hdfs.rsync(self.local_dir, '/data/2023/04', should_delete=True,
+                                   dry_run=False, manifest_path=manifest_path))
+        self.assertEqual(self.server.ops().count('CREATE'), 1)
+        self.assertEqual(Hdfs.ls('/data/2023/04'), ['/data/2023/04/part-1'])
+
+        # The destination isn't listed once all source files are verified
+        del self.server.requests[:]
+        self.assertTrue(Hdfs.rsync(self.local_dir, '/data/2023/04', dry_run=False,
+                                   manifest_path=manifest_path))
+        self.assertNotIn('LISTSTATUS', self.server.ops())
+        self.assertNotIn('LISTSTATUS_BATCH', self.server.ops())
+
+    def test_rsync_checksum(self):
+        self.server.checksum_combine_mode = 'COMPOSITE_CRC'
+        self.addCleanup(setattr, self.server, 'checksum_combine_mode', 'MD5MD5CRC')
+        Hdfs.put(self.local_file, '/data/2023/04')
+        self.assertEqual(Hdfs.checksum('/data/2023/04/part-0 /data/missing'), {
+            '/data/2023/04/part-0': file_checksum(self.local_file), '/data/missing': None})
+
+        # Same size but different content is only detected by checksum.
+        with open(self.server.local('/data/2023/04/part-0'), 'w') as f:
+            f.write('world\n')
+        del self.server.requests[:]
+        self.assertTrue(Hdfs.rsync(self.local_dir, '/data/2023/04', dry_run=False))
+        self.assertEqual(self.server.ops().count('CREATE'), 0)
+        self.assertTrue(Hdfs.rsync(self.local_dir, '/data/2023/04', dry_run=False, checksum=True))
+        self.assertEqual(self.server.ops().count('CREATE'), 1)
+        self.assertEqual(self.server.ops().count('GETFILECHECKSUM'), 2)
+        self.assertEqual(Hdfs.cat('/data/2023/04/part-0'), 'hello')
+
+    def test_rsync_checksum_not_composite(self):
+        Hdfs.put(self.local_file, '/data/2023/04')
+        self.assertEqual(Hdfs.checksum('/data/2023/04/part-0')['/data/2023/04/part-0']['algorithm'],
+                         'MD5-of-0MD5-of-512CRC32C')
+
+        # Files are then only compared by size.
+        with open(self.server.local('/data/2023/04/part-0'), 'w') as f:
+            f.write('world\n')
+        del self.server.requests[:]
+        with self.assertLogs('hdfs-util', 'WARNING'):
+            self.assertTrue(Hdfs.rsync(self.local_dir, '/data/2023/04', dry_run=False, checksum=True))
+        self.assertEqual(self.server.ops().count('CREATE'), 0)
+
+    def test_rsync_recursive(self):
+        os.makedirs(os.path.join(self.local_dir, 'a', 'b'))
+        os.makedirs(os.path.join(self.local_dir, 'c'))
+        for name in ['a/part-0', 'a/b/part-0', 'a/b/part-1']:
+            with open(os.path.join(self.local_dir, name), 'w') as f:
+                f.write(name)
+        Hdfs.mkdir('/data/2023/04/a/b/extra /data/2023/04/c/d', create_parent=True)
+        Hdfs.touchz('/data/2023/04/a/b/part-1 /data/2023/04/c/d/e')
+        self.assertTrue(Hdfs.rsync(self.local_dir, '/data/2023/04', should_delete=True,
+                                   dry_run=False, recursive=True, batch_size=10))
+        self.assertEqual(sorted(Hdfs._get_hdfs_tree('/data/2023/04')),
+                         ['a', 'a/b', 'a/b/part-0', 'a/b/part-1', 'a/part-0', 'c', 'part-0'])
+        self.assertEqual(Hdfs.cat('/data/2023/04/a/b/part-1'), 'a/b/part-1')
+
+        local_copy = os.path.join(self.local_dir, 'copy')
+        os.makedirs(os.path.join(local_copy, 'a', 'b', 'part-0'))
+        self.assertTrue(Hdfs.rsync(local_copy, '/data/2023/04', local_to_hdfs=False,
+                                   dry_run=False, recursive=True))
+        self.assertEqual(sorted(Hdfs._get_local_tree(local_copy)),
+                         ['a', 'a/b', 'a/b/part-0', 'a/b/part-1', 'a/part-0', 'c', 'part-0'])
+        with open(os.path.join(local_copy, 'a', 'b', 'part-0')) as f:
+            self.assertEqual(f.read(), 'a/b/part-0')
+
+    def test_rsync_recursive_to_local_manifest(self):
+        # Files sharing their name in different folders are verified separately.
+        Hdfs.mkdir('/data/2023/04/a/b')
+        Hdfs.put(self.local_file, '/data/2023/04/a')
+        Hdfs.put(self.local_file, '/data/2023/04/a/b')
+        local_copy = os.path.join(self.local_dir, 'copy')
+        os.makedirs(local_copy)
+        manifest_path = self.local_dir + '.manifest'
+        self.addCleanup(os.remove, manifest_path)
+        self.assertTrue(Hdfs.rsync(local_copy, '/data/2023/04', local_to_hdfs=False, dry_run=False,
+                                   recursive=True, manifest_path=manifest_path))
+        manifest = RsyncManifest(manifest_path)
+        self.assertEqual(sorted(entry['path'] for entry in manifest.entries.values()
+                                if entry['state'] == RsyncManifest.VERIFIED),
+                         ['/data/2023/04/a', '/data/2023/04/a/b', '/data/2023/04/a/b/part-0',
+                          '/data/2023/04/a/part-0'])
+
+    def test_open(self):
+        with bz2.open(os.path.join(self.local_dir, 'part-1.bz2'), 'wt') as f:
+            f.write('a\nb\n')
+        Hdfs.put([self.local_file, os.path.join(self.local_dir, 'part-1.bz2')], '/data/2023/04')
+        with Hdfs.open('/data/2023/04/part-1.bz2', 'r') as f:
+            self.assertEqual(list(f), ['a\n', 'b\n'])
+        # Closing early drops the connection instead of reusing it.
+        with Hdfs.open('/data/2023/04/part-0', buffer_size=1) as f:
+            self.assertEqual(f.read(1), b'h')
+        self.assertEqual(Hdfs.cat('/data/2023/04/part-0'), 'hello')
+        self.assertRaises(RuntimeError, Hdfs.open, '/data/2023/04')
+
+    def test_stat_du_count(self):
+        Hdfs.put(self.local_file, '/data/2023/04')
+        paths = ['/data/2023/04', '/data/2023/04/part-0', '/data/missing']
+        stats = Hdfs.stat(paths)
+        self.assertEqual(stats['/data/2023/04/part-0']['size'], 6)
+        self.assertEqual(stats['/data/2023/04']['file_type'], 'd')
+        self.assertIsNone(stats['/data/missing'])
+        self.assertEqual(Hdfs.du(paths), {'/data/2023/04': 6, '/data/2023/04/part-0': 6, '/data/missing': None})
+        self.assertEqual(Hdfs.count(paths)['/data/2023/04'],
+                         {'directory_count': 1, 'file_count': 1, 'content_size': 6})
+
+    def test_walk_and_find(self):
+        Hdfs.mkdir('/data/2023/04/a /data/2023/05/b')
+        Hdfs.put(self.local_file, '/data/2023/04/a')
+        Hdfs.touchz('/data/2023/05/_SUCCESS')
+        self.assertEqual(sorted(s.path for s in Hdfs.walk('/data')), [
+            '/data/2023', '/data/2023/04', '/data/2023/04/a', '/data/2023/04/a/part-0',
+            '/data/2023/05', '/data/2023/05/_SUCCESS', '/data/2023/05/b'])
+        self.assertEqual([s.path for s in Hdfs.walk('/data', max_depth=2)],
+                         ['/data/2023', '/data/2023/04', '/data/2023/05'])
+
+        # Pruned directories are yielded but not listed.
+        del self.server.requests[:]
+        walked = [s.path for s in Hdfs.walk('/data', workers=2,
+                                           prune=lambda s: s.path.endswith('05'))]
+        self.assertEqual(walked, ['/data/2023', '/data/2023/04', '/data/2023/05',
+                                  '/data/2023/04/a', '/data/2023/04/a/part-0'])
+        self.assertEqual(self.server.ops().count('LISTSTATUS_BATCH'), 4)
+
+        self.assertEqual([s.path for s in Hdfs.find('/data', file_type=FileType.FILE)],
+                         ['/data/2023/04/a/part-0', '/data/2023/05/_SUCCESS'])
+        self.assertEqual([s.path for s in Hdfs.find('/data', larger_than=0)], ['/data/2023/04/a/part-0'])
+        self.assertEqual([s.path for s in Hdfs.find('/data', name_regex='^_')], ['/data/2023/05/_SUCCESS'])
+        self.assertEqual(list(Hdfs.find('/data', older_than=datetime(2000, 1, 1))), [])
+
+    def test_setrep_and_storage_policy(self):
+        self.addCleanup(self.server.replication.clear)
+        self.addCleanup(self.server.storage_policies.clear)
+        Hdfs.mkdir('/data/2023/04/a')
+        Hdfs.touchz('/data/2023/04/part-0 /data/2023/04/a/part-0 /data/2023/05/part-0')
+        self.assertEqual([s.replication for s in Hdfs.iter_ls('/data/2023/04/part-0')], [3])
+        Hdfs.setrep('/data/2023/04', 2)
+        self.assertEqual(self.server.replication, {'/data/2023/04/part-0': 2, '/data/2023/04/a/part-0': 2})
+        self.assertEqual([s.replication for s in Hdfs.iter_ls('/data/2023/04/part-0')], [2])
+        # Files already having the replication are skipped.
+        del self.server.requests[:]
+        Hdfs.setrep('/data/2023', 2)
+        self.assertEqual(self.server.ops().count('SETREPLICATION'), 1)
+        self.assertEqual(self.server.replication['/data/2023/05/part-0'], 2)
+        Hdfs.set_storage_policy('/data/2023/04 /data/2023/05', 'COLD')
+        self.assertEqual(self.server.storage_policies, {'/data/2023/04': 'COLD', '/data/2023/05': 'COLD'})
+
+    def test_mv_cp_rm(self):
+        Hdfs.put(self.local_file, '/data/2023/04')
+        Hdfs.mv('/data/2023/04/part-0', '/data/2023/06/part-0')
+        self.assertEqual(Hdfs.ls('/data/2023/06'), ['/data/2023/06/part-0'])
+        Hdfs.cp('/data/2023/06/part-0', '/data/2023/05')
+        self.assertEqual(Hdfs.cat('/data/2023/05/part-0'), 'hello')
+        self.assertEqual(Hdfs.dir_bytes_size('/data/2023'), 12)
+        Hdfs.rm('/data/2023/05')
+        self.assertEqual(Hdfs.ls('/data/2023/05'), [])
+        Hdfs.rm('/data/2023/06', skip_trash=False)
+        self.assertEqual(Hdfs.ls('/user/analytics/.Trash/Current/data/2023'),
+                         ['/user/analytics/.Trash/Current/data/2023/06'])
+        self.assertRaises(RuntimeError, Hdfs.rm, '/data/missing')
+
+    def test_bulk_mv(self):
+        Hdfs.put(self.local_file, '/data/2023/04')
+        Hdfs.touchz('/data/2023/04/_SUCCESS')
+        Hdfs.mv(['/data/2023/04/part-0', '/data/2023/04/_SUCCESS'],
+                ['/data/2024/01/part-0', '/data/2024/01/_SUCCESS'], bulk=True)
+        self.assertEqual(Hdfs.ls('/data/2024/01'), ['/data/2024/01/_SUCCESS', '/data/2024/01/part-0'])
+        self.assertEqual(Hdfs.ls('/data/2023/04'), [])
+
+    def test_listing_cache(self):
+        Hdfs.enable_cache()
+        try:
+            del self.server.requests[:]
+            self.assertEqual(Hdfs.ls('/data/2023'), ['/data/2023/04', '/data/2023/05'])
+            self.assertEqual(Hdfs.ls('/data/2023'), ['/data/2023/04', '/data/2023/05'])
+            self.assertEqual([s.path for s in Hdfs.iter_ls('/data/2023/0*')], [])
+            self.assertEqual([s.path for s in Hdfs.iter_ls('/data/2023/0*')], [])
+            # One listing for ls, one for the glob expansion of iter_ls.
+            self.assertEqual(self.server.ops().count('LISTSTATUS'), 2)
+            self.assertEqual(Hdfs.cache_stats()['hits'], 2)
+            self.assertEqual(Hdfs.cache_stats()['misses'], 2)
+
+            # Writing under a listed path invalidates it, glob listings included.
+            Hdfs.touchz('/data/2023/04/_SUCCESS')
+            self.assertEqual(Hdfs.cache_stats()['invalidations'], 2)
+            self.assertEqual(Hdfs.ls('/data/2023/04'), ['/data/2023/04/_SUCCESS'])
+            self.assertEqual([s.path for s in Hdfs.iter_ls('/data/2023/0*')], ['/data/2023/04/_SUCCESS'])
+
+            Hdfs.mv('/data/2023/04/_SUCCESS', '/data/2023/05/_SUCCESS')
+            self.assertEqual(Hdfs.ls('/data/2023/04'), [])
+            Hdfs.rm('/data/2023/05')
+            self.assertEqual(Hdfs.ls('/data/2023'), ['/data/2023/04'])
+        finally:
+            Hdfs.disable_cache()
+        self.assertIsNone(Hdfs.cache_stats())
+
+    def test_touchz_and_modified_datetime(self):
+        Hdfs.touchz('/data/2023/04/_SUCCESS')
+        Hdfs.touchz('/data/2023/04/_SUCCESS')
+        self.assertEqual(Hdfs.cat('/data/2023/04/_SUCCESS'), '')
+        modified = Hdfs.get_modified_datetime('/data/2023/04/_SUCCESS')
+        self.assertEqual(modified.tzinfo, timezone.utc)
+        self.assertLess(abs((datetime.now(timezone.utc) - modified).total_seconds()), 60)
+
+    def test_mkdir_without_parents(self):
+        self.assertRaises(RuntimeError, Hdfs.mkdir, '/data/2024/01', create_parent=False)
+        Hdfs.rmdir('/data/2023/05')
+        self.assertEqual(Hdfs.ls('/data/2023'), ['/data/2023/04'])
+
+    def test_permission_string(self):
+        self.assertEqual(permission_string('755'), 'rwxr-xr-x')
+        self.assertEqual(permission_string('1777'), 'rwxrwxrwt')
+
+    def test_expand_braces(self):
+        self.assertEqual(expand_braces('a{b,c}d{1,2}'), ['abd1', 'abd2', 'acd1', 'acd2'])
+
+
+class TestFsShellWorkerBackend(TestCase):
+    def setUp(self):
+        worker = os.path.join(os.path.dirname(__file__), 'fake_fsshell_worker.py')
+        self.backend = FsShellWorkerBackend([sys.executable, worker])
+        Hdfs.set_backend(self.backend)
+
+    def tearDown(self):
+        Hdfs.set_backend(None)
+        self.backend.close()
+
+    def test_worker_is_reused(self):
+        first = Hdfs.ls('/wmf/data/a', with_details=True)[0]
+        second = Hdfs.ls('/wmf/data/b', with_details=True)[0]
+        self.assertEqual(first['path'], '/wmf/data/a')
+        self.assertEqual(first['file_size'], '42')
+        self.assertEqual(first['owner'], second['owner'])
+        self.assertEqual(first['owner'], str(self.backend.process.pid))
+
+    def test_failing_command_raises(self):
+        with self.assertRaises(RuntimeError) as context:
+            Hdfs.rm('/wmf/data/missing')
+        self.assertIn(b'No such file', context.exception.args[2])
+        # The worker is still usable after a failed command.
+        self.assertEqual(Hdfs.ls('/wmf/data/a'), ['/wmf/data/a'])
+
+    def test_dead_worker_is_restarted(self):
+        pid = Hdfs.ls('/wmf/data/a', with_details=True)[0]['owner']
+        self.assertRaises(RuntimeError, self.backend._dfs, ['-exit'])
+        self.assertIsNone(self.backend.process)
+        self.assertNotEqual(Hdfs.ls('/wmf/data/a', with_details=True)[0]['owner'], pid)
+
+    @patch('refinery.hdfs.sh')
+    def test_admin_tools_run_in_worker(self, sh):
+        self.assertEqual(self.backend._admin('storagepolicies', ['-listPolicies']),
+                         '["@storagepolicies", "-listPolicies"]')
+        Hdfs.set_storage_policy('/wmf/data/a /wmf/data/b', 'COLD')
+        sh.assert_not_called()
@@ -1,7 +1,9 @@
 from unittest import TestCase
+from mock import patch
 from datetime import datetime
 from dateutil.parser import ParserError
-from refinery.hive import Hive, HivePartition
+from refinery.hive import (CompactHivePartition, Hive, HivePartition,
+                           _dateutil_partition_datetime, partition_datetime)
 
 class TestHivePartition(TestCase):
     def setUp(self):
@@ -81,6 +83,24 @@ class TestHivePartition(TestCase):
         partition = HivePartition(partition_desc)
         self.assertRaises(ParserError, partition.datetime)
 
+    def test_datetime_from_date_schemes(self):
+        self.assertEqual(HivePartition('date=2022-12-05/wiki=enwiki').datetime(), datetime(2022, 12, 5))
+        self.assertEqual(HivePartition('dt=2022-12-05').datetime(), datetime(2022, 12, 5))
+        self.assertEqual(HivePartition('month=2022-12').datetime(), datetime(2022, 12, 1))
+        self.assertEqual(HivePartition('hour=2022-12-05-07').datetime(), datetime(2022, 12, 5, 7))
+        self.assertEqual(HivePartition('year=2022').datetime(), datetime(2022, 1, 1))
+
+    def test_datetime_falls_back_to_dateutil(self):
+        partition_datetime.cache_clear()
+        with patch('refinery.hive._dateutil_partition_datetime', wraps=_dateutil_partition_datetime) as dateutil:
+            HivePartition('datacenter=eqiad/year=2017/month=11/day=2/hour=16').datetime()
+            dateutil.assert_not_called()
+            partition = HivePartition('date=20171102')
+            self.assertEqual(partition.datetime(), datetime(2017, 11, 2))
+            self.assertEqual(partition.datetime(), datetime(2017, 11, 2))
+            # Results are memoized.
+            dateutil.assert_called_once()
+
     def test_list(self):
         self.assertEqual(self.partition_desc.split('/'), self.hive_partition.list())
 
@@ -198,3 +218,171 @@ class TestHive(TestCase):
 
         statement = self.hive.drop_partitions_ddl('table1', self.table_info['table1']['partitions_spec'])
         self.assertEqual(statement, expect)
+
+    def test_prefetch(self):
+        self.hive.tables['table3'] = {}
+
+        def fake_hive_cli(args, check_return_code=True):
+            # Runs the prefetch script, printing SET variables and fake outputs.
+            self.assertEqual(args[0], '-f')
+            with open(args[1]) as f:
+                statements = f.read().splitlines()
+            variables, out = {}, []
+            for statement in statements:
+                words = statement.rstrip(';').split()
+                if words[0] == 'SET' and '=' in words[1]:
+                    key, value = words[1].split('=', 1)
+                    variables[key] = value
+                elif words[0] == 'SET' and words[1] in variables:
+                    out.append('{0}={1}'.format(words[1], variables[words[1]]))
+                elif words[0] == 'DESCRIBE':
+                    out += ['# Detailed Table Information', 'Location:\thdfs://test/{0}\t'.format(words[2])]
+                elif words[:2] == ['SHOW', 'PARTITIONS']:
+                    out += self.table_info.get(words[2], {}).get('partitions_desc', [])
+            return '\n'.join(out)
+
+        with patch.object(self.hive, '_command', side_effect=fake_hive_cli) as command:
+            self.hive.prefetch(['table1', 'table3', 'missing_table'])
+            command.assert_called_once()
+
+            # Cached metadata is not fetched again.
+            self.assertEqual(self.hive.table_location('table1'), 'hdfs://test.example.com:8020/path/to/table1')
+            self.assertEqual(self.hive.table_location('table3'), 'hdfs://test/table3')
+            self.assertEqual(self.hive.partition_specs('table1'), [
+                Hive.partition_spec_from_partition_desc(desc)
+                for desc in self.table_info['table1']['partitions_desc']])
+            self.assertEqual(self.hive.partition_specs('table3'), [])
+            self.hive.prefetch(['table1', 'table3'])
+            command.assert_called_once()
+
+    def test_prefetch_unknown_information(self):
+        with self.assertRaises(ValueError):
+            self.hive.prefetch(['table1'], what=['statistics'])
+
+    def test_metadata_from_describe(self):
+        output = '\n'.join([
+            '# col_name            \tdata_type           \tcomment             ',
+            '\t \t ',
+            'uri_host            \tstring              \t                    ',
+            '\t \t ',
+            '# Partition Information\t \t ',
+            '# col_name            \tdata_type           \tcomment             ',
+            '\t \t ',
+            'year                \tint                 \t                    ',
+            'month               \tint                 \t                    ',
+            '\t \t ',
+            '# Detailed Table Information\t \t ',
+            'Database:           \twmf                 \t ',
+            'Location:           \thdfs://test.example.com:8020/path/to/table1\t ',
+            'Table Type:         \tEXTERNAL_TABLE      \t ',
+        ])
+        metadata = Hive._metadata_from_describe(output)
+        self.assertEqual(metadata['Partition Keys'], ['year', 'month'])
+        self.assertEqual(metadata['Location'], 'hdfs://test.example.com:8020/path/to/table1')
+        self.assertEqual(metadata['Table Type'], 'EXTERNAL_TABLE')
+
+    def test_compress_partition_specs(self):
+        existing = [
+            HivePartition('year={0}/month={1}'.format(year, month)).spec()
+            for year in (2021, 2022, 2023) for month in range(1, 13)
+        ]
+        # Drop everything up to 2023-04, and 2023-06.
+        drop = existing[:24 + 4] + [existing[24 + 5]]
+        self.assertEqual(Hive.compress_partition_specs(drop, existing), [
+            '`year`<=2022',
+            '`year`=2023,`month`<=4',
+            '`year`=2023,`month`=6',
+        ])
+
+    def test_compress_partition_specs_full_prefix(self):
+        existing = [
+            'webrequest_source=\'text\',year=2023,month=1',
+            'webrequest_source=\'text\',year=2023,month=2',
+            'webrequest_source=\'upload\',year=2023,month=1',
+            'webrequest_source=\'upload\',year=2023,month=2',
+        ]
+        drop = ['`webrequest_source`=\'text\',`year`=2023,`month`=1',
+                '`webrequest_source`=\'upload\',`year`=2023,`month`=1',
+                '`webrequest_source`=\'upload\',`year`=2023,`month`=2']
+        self.assertEqual(Hive.compress_partition_specs(drop, existing), [
+            '`webrequest_source`=\'text\',`year`=2023,`month`=1',
+            '`webrequest_source`=\'upload\'',
+        ])
+
+    def test_compress_partition_specs_keeps_other_comparators(self):
+        existing = ["snapshot='2023-01',wiki_db='enwiki'", "snapshot='2023-02',wiki_db='enwiki'"]
+        drop = ["snapshot='2023-01',wiki_db!=''"]
+        self.assertEqual(Hive.compress_partition_specs(drop, existing), drop)
+
+    def test_drop_partitions_scripts(self):
+        specs = ['`year`=2023,`month`={0}'.format(m) for m in range(1, 10)]
+        scripts = self.hive.drop_partitions_scripts('table1', specs, compress=False,
+                                                    max_statement_size=120, max_script_size=250)
+        statements = [s for script in scripts for s in script.splitlines()]
+        self.assertTrue(all(len(s) <= 120 for s in statements))
+        self.assertTrue(all(len(script) <= 250 for script in scripts))
+        self.assertEqual(len(scripts), 3)
+        self.assertEqual(statements[0], 'ALTER TABLE table1 DROP IF EXISTS '
+                         'PARTITION (`year`=2023,`month`=1), PARTITION (`year`=2023,`month`=2);')
+        self.assertEqual(sum(s.count('PARTITION (') for s in statements), 9)
+
+    def test_drop_partitions(self):
+        self.hive.tables['table1']['partitions'] = [
+            'year=2023,month={0}'.format(m) for m in range(1, 13)]
+        specs = ['`year`=2023,`month`={0}'.format(m) for m in range(1, 6)]
+        with patch.object(self.hive, 'query', return_value='') as query:
+            self.hive.drop_partitions('table1', specs, compress=True, workers=2)
+            query.assert_called_once_with(
+                'ALTER TABLE table1 DROP IF EXISTS PARTITION (`year`=2023,`month`<=5);', use_tempfile=True)
+        self.assertNotIn('partitions', self.hive.tables['table1'])
+
+    def test_drop_partitions_failure(self):
+        specs = ['`year`=2023,`month`={0}'.format(m) for m in range(1, 10)]
+        with patch.object(self.hive, 'query', side_effect=['', RuntimeError('Hive failed'), '']) as query:
+            with self.assertRaises(RuntimeError):
+                self.hive.drop_partitions('table1', specs, compress=False, max_statement_size=120,
+                                          max_script_size=250)
+            self.assertEqual(query.call_count, 3)
+
+
+class TestCompactHivePartition(TestCase):
+    def setUp(self):
+        self.partition_desc = 'datacenter=eqiad/year=2017/month=11/day=2/hour=16'
+        self.hive_partition = HivePartition(self.partition_desc)
+        self.partition = CompactHivePartition(self.partition_desc)
+
+    def test_same_as_hive_partition(self):
+        self.assertEqual(self.partition, self.hive_partition)
+        self.assertEqual(list(self.partition.items()), list(self.hive_partition.items()))
+        self.assertEqual(self.partition['month'], '11')
+        self.assertEqual(self.partition.get('minute'), None)
+        self.assertIn('hour', self.partition)
+        for method in ['desc', 'spec', 'path', 'camus_path', 'glob', 'datetime', 'snapshot_period']:
+            self.assertEqual(getattr(self.partition, method)(), getattr(self.hive_partition, method)())
+        self.assertEqual(self.partition.path('/wmf/data'), self.hive_partition.path('/wmf/data'))
+        camus_path = '/path/to/eqiad_data/hourly/2017/11/02/16'
+        self.assertEqual(CompactHivePartition(camus_path), HivePartition(camus_path))
+
+    def test_immutable(self):
+        with self.assertRaises(TypeError):
+            self.partition['year'] = '2018'
+        with self.assertRaises(AttributeError):
+            self.partition.other = 1
+
+    def test_hashing_and_ordering(self):
+        other = CompactHivePartition('datacenter=eqiad/year=2017/month=11/day=3/hour=16')
+        same = CompactHivePartition.from_items(
+            ['datacenter', 'year', 'month', 'day', 'hour'], ['eqiad', '2017', '11', '2', '16'])
+        self.assertEqual(len(set([self.partition, other, same])), 2)
+        self.assertEqual(sorted([other, same]), [same, other])
+        self.assertLess(self.partition, other)
+        # Keys tuples are shared by partitions having the same keys.
+        self.assertIs(self.partition.keys(), other.keys())
+
+    def test_hive_partitions(self):
+        hive = Hive()
+        hive.tables = {'table1': {'partitions': ["year=2017,month=11", "year=2017,month=12"]}}
+        partitions = hive.partitions('table1', compact=True)
+        self.assertEqual([p.spec() for p in partitions], ['`year`=2017,`month`=11', '`year`=2017,`month`=12'])
+        self.assertEqual(partitions, hive.partitions('table1'))
+        self.assertIs(partitions[0], hive.partitions('table1', compact=True)[0])
@@ -0,0 +1,175 @@
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+from mock import patch
+
+from fake_metastore import FakeMetastore
+from fake_webhdfs import FakeWebHdfsServer
+from refinery.hdfs import Hdfs
+from refinery.hive import Hive
+from refinery.hive_metastore import HIVE_CONFIG_ENV_VARIABLE, metastore_backend_from_environment
+from refinery.webhdfs import WebHdfsBackend
+
+
+class TestHiveMetastoreBackend(TestCase):
+    def setUp(self):
+        self.metastore = FakeMetastore()
+        self.addCleanup(self.metastore.close)
+        self.metastore.add_table('wmf', 'webrequest', 'hdfs://analytics-hadoop/wmf/data/wmf/webrequest',
+                                 ['webrequest_source', 'year', 'month'], parameters={'numFiles': '12'})
+        self.metastore.add_table('wmf', 'pageview_hourly', '/wmf/data/wmf/pageview/hourly')
+        self.metastore.add_table('event', 'navigationtiming', '/wmf/data/event/navigationtiming')
+        self.metastore.add_partition('wmf', 'webrequest', 'webrequest_source=text/year=2023/month=2')
+        self.metastore.add_partition('wmf', 'webrequest', 'webrequest_source=text/year=2023/month=1')
+        self.metastore.add_partition('wmf', 'webrequest', 'webrequest_source=upload/year=2023/month=1',
+                                     location='/wmf/data/archive/upload/2023/1')
+        self.backend = self.metastore.backend()
+
+    def test_tables(self):
+        self.assertEqual(self.backend.tables('wmf'), ['pageview_hourly', 'webrequest'])
+        self.assertEqual(self.backend.tables('WMF'), ['pageview_hourly', 'webrequest'])
+        self.assertEqual(self.backend.tables('unknown'), [])
+
+    def test_table_metadata(self):
+        metadata = self.backend.table_metadata('wmf', 'WebRequest')
+        self.assertEqual(metadata['Database'], 'wmf')
+        self.assertEqual(metadata['Location'], 'hdfs://analytics-hadoop/wmf/data/wmf/webrequest')
+        self.assertEqual(metadata['Table Type'], 'EXTERNAL_TABLE')
+        self.assertEqual(metadata['Owner'], 'analytics')
+        self.assertEqual(metadata['Table Parameters'], {'numFiles': '12'})
+        self.assertEqual(metadata['Partition Keys'], ['webrequest_source', 'year', 'month'])
+        self.assertIsNone(self.backend.table_metadata('event', 'webrequest'))
+
+    def test_partitions(self):
+        self.assertEqual(self.backend.partitions('wmf', 'webrequest'), [
+            ('webrequest_source=text/year=2023/month=1',
+             'hdfs://analytics-hadoop/wmf/data/wmf/webrequest/webrequest_source=text/year=2023/month=1'),
+            ('webrequest_source=text/year=2023/month=2',
+             'hdfs://analytics-hadoop/wmf/data/wmf/webrequest/webrequest_source=text/year=2023/month=2'),
+            ('webrequest_source=upload/year=2023/month=1', '/wmf/data/archive/upload/2023/1'),
+        ])
+        self.assertEqual(self.backend.partitions('wmf', 'pageview_hourly'), [])
+
+    def test_partitions_by_ids(self):
+        table_id = self.backend.table_id('wmf', 'webrequest')
+        partitions = self.backend.partitions_after(table_id)
+        ids = [partition_id for partition_id, _, _ in partitions]
+        self.assertEqual(self.backend.partitions_by_ids(table_id, ids[:0:-1], chunk_size=1), partitions[1:])
+        self.assertEqual(self.backend.partitions_by_ids(table_id, []), [])
+
+    def test_connections_are_pooled(self):
+        for _ in range(5):
+            self.backend.tables('wmf')
+            self.backend.partitions('wmf', 'webrequest')
+        self.assertEqual(self.metastore.connections, 1)
+
+    def test_failed_connections_are_not_pooled(self):
+        with self.assertRaises(Exception):
+            self.backend._fetch('SELECT * FROM UNKNOWN_TABLE', ())
+        self.backend.tables('wmf')
+        self.assertEqual(self.metastore.connections, 2)
+
+    def test_hive_reads_metastore(self):
+        hive = Hive('wmf', metastore=self.backend)
+        with patch.object(Hive, '_command') as command:
+            self.assertEqual(sorted(hive.get_tables()), ['pageview_hourly', 'webrequest'])
+            self.assertEqual(hive.table_location('webrequest', strip_nameservice=True),
+                             '/wmf/data/wmf/webrequest')
+            self.assertEqual(hive.partition_specs('webrequest'), [
+                "webrequest_source='text',year=2023,month=1",
+                "webrequest_source='text',year=2023,month=2",
+                "webrequest_source='upload',year=2023,month=1",
+            ])
+            self.assertEqual([p.datetime().month for p in hive.partitions('webrequest')], [1, 2, 1])
+            command.assert_not_called()
+
+    def test_hive_runs_ddl_with_cli(self):
+        hive = Hive('wmf', metastore=self.backend)
+        with patch.object(Hive, '_command', return_value='') as command:
+            hive.drop_partitions('webrequest', ["webrequest_source='text',year=2023,month=1"])
+            command.assert_called_once()
+
+
+class TestPartitionsFromLayout(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeWebHdfsServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.backend = WebHdfsBackend(self.server.url, user='analytics')
+        Hdfs.set_backend(self.backend)
+        self.addCleanup(Hdfs.set_backend, None)
+        self.addCleanup(self.backend.pool.close)
+        self.addCleanup(shutil.rmtree, self.server.local('/wmf'), True)
+        for path in [
+            'year=2023/month=1/part-0.parquet',
+            'year=2023/month=2/part-0.parquet',
+            'year=2023/month=3/_SUCCESS',
+            'year=2023/_tmp/part-0.parquet',
+            'year=2023/month=4',  # A file, not a partition directory
+            '_temporary/0/year=2023/month=5/part-0.parquet',
+        ]:
+            local_path = self.server.local('/wmf/data/wmf/webrequest/' + path)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            open(local_path, 'w').close()
+
+        self.metastore = FakeMetastore()
+        self.addCleanup(self.metastore.close)
+        self.metastore.add_table('wmf', 'webrequest', 'hdfs://analytics-hadoop/wmf/data/wmf/webrequest',
+                                 ['year', 'month'])
+        self.metastore.add_table('wmf', 'unpartitioned', '/wmf/data/wmf/unpartitioned')
+        for desc in ['year=2023/month=1', 'year=2023/month=2', 'year=2022/month=12']:
+            self.metastore.add_partition('wmf', 'webrequest', desc)
+        self.hive = Hive('wmf', metastore=self.metastore.backend())
+
+    def test_partitions_from_layout(self):
+        partitions = self.hive.partitions_from_layout('webrequest')
+        self.assertEqual([p.desc() for p in partitions],
+                         ['year=2023/month=1', 'year=2023/month=2', 'year=2023/month=3'])
+        self.assertEqual(partitions[0].datetime().month, 1)
+        self.assertEqual(self.hive.partitions_from_layout('unpartitioned'), [])
+
+    def test_partitions_from_layout_prunes_directories(self):
+        del self.server.requests[:]
+        self.hive.partitions_from_layout('webrequest')
+        listed = [path for op, path in self.server.requests if op == 'LISTSTATUS_BATCH']
+        self.assertEqual(listed, ['/wmf/data/wmf/webrequest', '/wmf/data/wmf/webrequest/year=2023'])
+
+    def test_partitions_layout_diff(self):
+        orphans, dangling = self.hive.partitions_layout_diff('webrequest')
+        self.assertEqual([p.desc() for p in orphans], ['year=2023/month=3'])
+        self.assertEqual([p.desc() for p in dangling], ['year=2022/month=12'])
+
+
+class TestMetastoreBackendFromEnvironment(TestCase):
+    def setUp(self):
+        metastore_backend_from_environment.cache_clear()
+        self.addCleanup(metastore_backend_from_environment.cache_clear)
+
+    def _with_config(self, content):
+        config_file = tempfile.NamedTemporaryFile(mode='w', suffix='.properties', delete=False)
+        self.addCleanup(os.remove, config_file.name)
+        with config_file:
+            config_file.write(content)
+        return patch.dict(os.environ, {HIVE_CONFIG_ENV_VARIABLE: config_file.name})
+
+    def test_default_is_cli(self):
+        with patch.dict(os.environ, clear=True):
+            self.assertIsNone(metastore_backend_from_environment())
+            self.assertIsNone(Hive('wmf').metastore)
+
+    def test_unknown_backend(self):
+        with self._with_config('hive.backend = thrift\n'):
+            with self.assertRaises(ValueError):
+                metastore_backend_from_environment()
+
+    def test_missing_host(self):
+        with self._with_config('hive.backend = metastore\n'):
+            with self.assertRaises(ValueError):
+                metastore_backend_from_environment()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+from mock import patch
+
+from fake_metastore import FakeMetastore
+from refinery.hive import Hive
+from refinery.partition_catalog import PartitionCatalog
+
+
+class TestPartitionCatalog(TestCase):
+    def setUp(self):
+        self.metastore = FakeMetastore()
+        self.addCleanup(self.metastore.close)
+        self.metastore.add_table('wmf', 'webrequest', '/wmf/data/wmf/webrequest', ['year', 'month'])
+        for month in (1, 2, 3):
+            self.metastore.add_partition('wmf', 'webrequest', 'year=2023/month={0}'.format(month))
+        self.backend = self.metastore.backend()
+
+        self.tmp_dir = tempfile.mkdtemp(prefix='test-partition-catalog-')
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'partitions.sqlite')
+        self.catalog = PartitionCatalog(self.path)
+        self.addCleanup(self.catalog.close)
+
+    def descs(self, catalog=None):
+        catalog = catalog or self.catalog
+        return [desc for desc, _ in catalog.partitions(self.backend, 'wmf', 'webrequest')]
+
+    def test_partitions(self):
+        self.assertEqual(self.catalog.partitions(self.backend, 'wmf', 'webrequest'), [
+            ('year=2023/month=1', '/wmf/data/wmf/webrequest/year=2023/month=1'),
+            ('year=2023/month=2', '/wmf/data/wmf/webrequest/year=2023/month=2'),
+            ('year=2023/month=3', '/wmf/data/wmf/webrequest/year=2023/month=3'),
+        ])
+        self.assertEqual(self.catalog.partitions(self.backend, 'wmf', 'missing_table'), [])
+
+    def test_incremental_refresh(self):
+        self.assertEqual(self.catalog.refresh(self.backend, 'wmf', 'webrequest'), (3, 0))
+        self.metastore.add_partition('wmf', 'webrequest', 'year=2023/month=4')
+        with patch.object(self.backend, 'partition_ids', wraps=self.backend.partition_ids) as partition_ids:
+            self.assertEqual(self.catalog.refresh(self.backend, 'wmf', 'webrequest'), (1, 0))
+            # Partition ids are only listed when some partitions were dropped.
+            partition_ids.assert_not_called()
+
+    def test_dropped_partitions(self):
+        self.descs()
+        self.metastore.drop_partition('wmf', 'webrequest', 'year=2023/month=1')
+        self.metastore.add_partition('wmf', 'webrequest', 'year=2023/month=4')
+        self.assertEqual(self.descs(), ['year=2023/month=2', 'year=2023/month=3', 'year=2023/month=4'])
+
+    def test_partitions_added_with_lower_ids(self):
+        self.metastore.add_partition('wmf', 'webrequest', 'year=2023/month=4', partition_id=100)
+        self.descs()
+        self.metastore.add_partition('wmf', 'webrequest', 'year=2023/month=5', partition_id=50)
+        self.assertEqual(self.catalog.refresh(self.backend, 'wmf', 'webrequest'), (1, 0))
+        self.assertEqual(self.descs()[-1], 'year=2023/month=5')
+
+    def test_full_sync(self):
+        self.metastore.add_partition('wmf', 'webrequest', 'year=2023/month=4', partition_id=100)
+        self.descs()
+        # Partition counts match, only a full sync notices the changes.
+        self.metastore.drop_partition('wmf', 'webrequest', 'year=2023/month=1')
+        self.metastore.add_partition('wmf', 'webrequest', 'year=2023/month=5', partition_id=50)
+        self.assertEqual(self.catalog.refresh(self.backend, 'wmf', 'webrequest'), (0, 0))
+        catalog = PartitionCatalog(self.path, full_sync_interval=0)
+        self.addCleanup(catalog.close)
+        self.assertEqual(catalog.refresh(self.backend, 'wmf', 'webrequest'), (1, 1))
+        self.assertEqual(self.descs(), ['year=2023/month={0}'.format(month) for month in (2, 3, 4, 5)])
+
+    def test_recreated_table(self):
+        self.descs()
+        self.metastore.drop_table('wmf', 'webrequest')
+        self.assertEqual(self.descs(), [])
+        self.metastore.add_table('wmf', 'webrequest', '/wmf/data/wmf/webrequest', ['year'])
+        self.metastore.add_partition('wmf', 'webrequest', 'year=2024')
+        self.assertEqual(self.descs(), ['year=2024'])
+
+    def test_persistence(self):
+        self.descs()
+        self.metastore.add_partition('wmf', 'webrequest', 'year=2023/month=4')
+        catalog = PartitionCatalog(self.path)
+        self.addCleanup(catalog.close)
+        self.assertEqual(catalog.refresh(self.backend, 'wmf', 'webrequest'), (1, 0))
+        self.assertEqual(len(self.descs(catalog)), 4)
+
+    def test_hive_uses_catalog(self):
+        hive = Hive('wmf', metastore=self.backend, catalog=self.catalog)
+        self.assertEqual(hive.partition_specs('webrequest'), [
+            'year=2023,month=1', 'year=2023,month=2', 'year=2023,month=3'])
+        self.assertEqual(self.catalog.refresh(self.backend, 'wmf', 'webrequest'), (0, 0))
+
+    def test_catalog_needs_metastore(self):
+        with patch('refinery.hive.metastore_backend_from_environment', return_value=None):
+            with self.assertRaises(ValueError):
+                Hive('wmf', catalog=self.catalog)
@@ -1,5 +1,5 @@
 from unittest import TestCase
-from refinery.util import sh
+from refinery.util import sh, sh_lines
 
 
 class TestRefineryUtil(TestCase):
@@ -16,3 +16,12 @@ class TestRefineryUtil(TestCase):
         command = '/bin/echo hi_there | /usr/bin/env sed -e \'s@_there@_you@\''
         output = sh(command)
         self.assertEqual(output, 'hi_you')
+
+    def test_sh_lines(self):
+        lines = sh_lines(['/usr/bin/env', 'printf', 'a\\nb\\n'])
+        self.assertEqual(list(lines), ['a', 'b'])
+
+    def test_sh_lines_return_code(self):
+        lines = sh_lines(['/usr/bin/env', 'false'])
+        self.assertRaises(RuntimeError, list, lines)
+        self.assertEqual(list(sh_lines(['/usr/bin/env', 'false'], check_return_code=False)), [])